@@ -1,13 +1,14 @@
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-import bank.logic as logic
+import bank.data as data
+import bank.handlers as handlers
+from util import metrics, profiling, wire
 from flask import Flask, jsonify, request, Response, abort
 
 
 web = Flask("digi-cash-bank")
-
-spent_tokens = dict()
+profiling.install(web, "bank")
 
 
 @web.errorhandler(400)
@@ -34,130 +35,56 @@ def unknown_error(e):
     }), 500
 
 
+def _request_body():
+    """ The JSON or binary document in the request; None when it is neither """
+    try:
+        return wire.parse_body(request.get_data(), request.content_type, request.headers.get("Content-Encoding"))
+    except wire.WireFormatError as e:
+        abort(400, str(e))
+
+
+def _respond(payload, status: int):
+    """ Encodes the payload as JSON or binary, as the request's Accept header asks """
+    body, headers = wire.render(payload, request.headers.get("Accept"), request.headers.get("Accept-Encoding"))
+    return Response(body, status=status, headers=headers)
+
+
 @web.route("/redeem", methods=["POST"])
 def redeem_token():
-    if request.is_json:
-        token = request.json
-        try:
-            return jsonify({
-                "token": logic.redeem_token(token),
-                "status": "success"
-            })
-
-        except logic.BadTokenFormat:
-            return jsonify({
-                "status": "rejected",
-                "message": "This token has an incorrect format",
-            }), 400
-        except logic.BadSignature:
-            return jsonify({
-                "status": "rejected",
-                "message": "The bank signature on this token does not match.",
-            }), 403
-        except logic.ChecksumConflict:
-            return jsonify({
-                "status": "rejected",
-                "message": "The checksum does not match the token content.",
-            }), 400
-        except logic.MerchantSpentAgain:
-            return jsonify({
-                "status": "rejected",
-                "message": "The merchant has already redeemed this token.",
-            }), 403
-        except logic.ClientSpentAgain:
-            return jsonify({
-                "status": "rejected",
-                "message": "The client has already redeemed this token.",
-            }), 403
-
-    else:
-        return jsonify({
-            "status": "rejected",
-            "message": "Token must be in JSON format.",
-        }), 400
+    payload, status = handlers.redeem(_request_body())
+    return _respond(payload, status)
+
+
+@web.route("/redeem-batch", methods=["POST"])
+def redeem_tokens():
+    """ See bank.handlers.redeem_batch """
+    payload, status = handlers.redeem_batch(_request_body())
+    return _respond(payload, status)
 
 
 @web.route("/open-request", methods=["POST"])
 def open_signing_request():
-    if request.is_json:
-        checksums = request.json
-        try:
-            keep, session_id = logic.open_signing_request(checksums)
-            return jsonify({
-                "keep": keep,
-                "session_id": session_id,
-                "status": "success"
-            })
-        except Exception as e:
-            return jsonify({
-                "status": "rejected",
-                "message": "Unknown Error",
-                "error": str(e)
-            }), 500
-
-    else:
-        return jsonify({
-            "status": "rejected",
-            "message": "Token must be in JSON format.",
-        }), 400
+    payload, status = handlers.open_request(_request_body())
+    return _respond(payload, status)
 
 
 @web.route("/fill-request", methods=["POST"])
 def fill_signing_request():
-    """
-    Expected request format:
-
-    {
-      "session_id": <session id>,
-      "tokens": {
-        <token 1 checksum> : {
-          "key": <full key 1>, 
-          "token": <full token 1>
-        },
-        <token 2 checksum> : [<full token 2>,
-        ...
-      }
-    }
-    """
-    if request.is_json:
-        try:
-            tokens_to_validate = request.json.get("tokens")
-            session_id = request.json.get("session_id")
-            return jsonify({
-                "signature": logic.fill_signing_request(session_id, tokens_to_validate),
-                "status": "success"
-            })
-        except logic.TokenValueMismatch as e:
-            return jsonify({
-                "status": "rejected",
-                "message": "Token mismatch",
-                "error": str(e)
-            }), 403
-        except Exception as e:
-            return jsonify({
-                "status": "rejected",
-                "message": "Unknown Error",
-                "error": str(e)
-            }), 500
-
-    else:
-        return jsonify({
-            "status": "rejected",
-            "message": "Token must be in JSON format.",
-        }), 400
+    """ See bank.handlers.fill_request """
+    payload, status = handlers.fill_request(_request_body())
+    return _respond(payload, status)
 
 
 @web.route("/public-key", methods=["GET"])
 def public_key():
     try:
-        return jsonify({
-            "key": logic.get_public_key().to_bytes(128, 'big').hex(),  # generated 128-byte number
-            "key_len": 128,
-            # product of 2 128-byte numbers
-            "modulus": logic.get_public_modulus().to_bytes(256, 'big').hex(),
-            "modulus_len": 256,
-            "status": "success"
-        })
+        body, etag = handlers.public_key()
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = handlers.PUBLIC_KEY_MAX_AGE
+        # answers If-None-Match revalidation with an empty 304
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({
             "status": "rejected",
@@ -166,10 +93,16 @@ def public_key():
         }), 500
 
 
+@web.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @web.route("/", methods=["GET"])
 def hello_world():
     return "Hello, World!", 200
 
 
 if __name__ == "__main__":
+    data.load_keychain()
     web.run(port=5000, debug=True)
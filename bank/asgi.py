@@ -0,0 +1,183 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import bank.data as data
+import bank.handlers as handlers
+from util import config, metrics, wire
+
+# asyncio serving mode for the bank: the routes of bank/__main__.py as a
+# plain ASGI application. Connections are held by the event loop, and the
+# crypto-heavy handlers run in an executor, so slow clients do not tie up a
+# worker thread each. Serve it with any ASGI server, e.g.
+#
+#   python -m bank.asgi                   (uses uvicorn)
+#   uvicorn bank.asgi:app --port 5000
+
+# threads running the handlers (modular exponentiation, identity checks)
+EXECUTOR_WORKERS = config.get_int("DIGICASH_ASGI_WORKERS", os.cpu_count() or 1)
+# requests allowed in the executor at once; the rest wait on the event loop
+MAX_CONCURRENCY = config.get_int("DIGICASH_ASGI_MAX_CONCURRENCY", 4 * EXECUTOR_WORKERS)
+# largest request body accepted, in bytes
+MAX_BODY_SIZE = config.get_int("DIGICASH_ASGI_MAX_BODY", 16 * 1024 * 1024)
+
+_executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="bank-asgi")
+_semaphore = None
+
+_post_routes = {
+    "/redeem": handlers.redeem,
+    "/redeem-batch": handlers.redeem_batch,
+    "/open-request": handlers.open_request,
+    "/fill-request": handlers.fill_request,
+}
+
+
+class RequestTooLarge(ValueError):
+    pass
+
+
+def _header(headers: dict, name: bytes):
+    value = headers.get(name)
+    return value.decode("latin-1") if value is not None else None
+
+
+async def _read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_SIZE:
+            raise RequestTooLarge()
+        if not message.get("more_body", False):
+            break
+    return bytes(body)
+
+
+async def _send(send, status: int, body: bytes, content_type=b"application/json", headers=()):
+    headers = list(headers)
+    if content_type is not None:
+        headers.insert(0, (b"content-type", content_type))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers + [(b"content-length", str(len(body)).encode("ascii"))],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, payload, status: int):
+    await _send(send, status, json.dumps(payload).encode("utf-8"))
+
+
+def _run_handler(handler, headers: dict, body: bytes):
+    """
+    Runs in the executor: parses the JSON or binary body, calls the handler
+    and encodes its payload as the Accept header asks. Returns
+    (status, body, response headers).
+    """
+    try:
+        parsed = wire.parse_body(body, _header(headers, b"content-type"), _header(headers, b"content-encoding"))
+    except wire.WireFormatError as e:
+        payload, status = {
+            "status": "Error 400: Malformed request.",
+            "message": str(e)
+        }, 400
+    else:
+        payload, status = handler(parsed)
+    body, response_headers = wire.render(payload, _header(headers, b"accept"), _header(headers, b"accept-encoding"))
+    return status, body, [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                          for name, value in response_headers.items()]
+
+
+async def _public_key(headers: dict, send):
+    body, etag = handlers.public_key()
+    quoted_etag = ('"%s"' % etag).encode("ascii")
+    response_headers = [
+        (b"etag", quoted_etag),
+        (b"cache-control", b"public, max-age=%d" % handlers.PUBLIC_KEY_MAX_AGE),
+    ]
+    if_none_match = headers.get(b"if-none-match")
+    if if_none_match is not None and (if_none_match.strip() == b"*" or quoted_etag in [
+            tag.strip().replace(b"W/", b"", 1) for tag in if_none_match.split(b",")]):
+        await send({"type": "http.response.start", "status": 304, "headers": response_headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await _send(send, 200, body, headers=response_headers)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # load or create the keychain before serving, off the event loop
+            try:
+                await asyncio.get_running_loop().run_in_executor(_executor, data.load_keychain)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    global _semaphore
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    path, method = scope["path"], scope["method"]
+    headers = dict((name.lower(), value) for name, value in scope["headers"])
+    try:
+        if path == "/" and method == "GET":
+            return await _send(send, 200, b"Hello, World!", b"text/html; charset=utf-8")
+        if path == "/public-key" and method == "GET":
+            return await _public_key(headers, send)
+        if path == "/metrics" and method == "GET":
+            return await _send(send, 200, metrics.render().encode("utf-8"), metrics.CONTENT_TYPE.encode("ascii"))
+        handler = _post_routes.get(path)
+        if handler is None:
+            return await _send_json(send, {
+                "status": "Error 404: Endpoint not found.",
+                "message": "404 Not Found: The requested URL was not found on the server."
+            }, 404)
+        if method != "POST":
+            return await _send_json(send, {
+                "status": "Error 405: Method not allowed.",
+                "message": "405 Method Not Allowed: %s is not allowed for %s" % (method, path)
+            }, 405)
+        try:
+            body = await _read_body(receive)
+        except RequestTooLarge:
+            return await _send_json(send, {
+                "status": "rejected",
+                "message": "Request body is larger than %d bytes." % MAX_BODY_SIZE,
+            }, 413)
+        async with _semaphore:
+            status, body, response_headers = await asyncio.get_running_loop().run_in_executor(
+                _executor, _run_handler, handler, headers, body)
+        await _send(send, status, body, None, response_headers)
+    except Exception as e:
+        await _send_json(send, {
+            "status": "Unknown Error",
+            "message": str(e),
+        }, 500)
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        print("The asyncio server mode needs an ASGI server: pip install uvicorn")
+        sys.exit(1)
+    uvicorn.run(app,
+                host=config.get_str("DIGICASH_BANK_HOST", "127.0.0.1"),
+                port=config.get_int("DIGICASH_BANK_PORT", 5000))
@@ -1,24 +1,62 @@
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from util.blind_signatures import generate_keychain
+import threading
+import uuid
+from bank import keystore
 
 redeemed_tokens = dict()
+# held across a double-spend check and the write that follows it
+ledger_lock = threading.RLock()
 
-_e, _d, _n = generate_keychain()
+_keychain = None
+# only one thread may load or create the keychain; concurrent first requests
+# would otherwise each generate and save a different one
+_keychain_lock = threading.Lock()
+
+def _get_keychain():
+  global _keychain
+  if _keychain is None:
+    with _keychain_lock:
+      if _keychain is None:
+        _keychain = keystore.with_crt_parameters(keystore.load_or_create_keychain())
+  return _keychain
+
+def load_keychain():
+  """ Loads the keychain, creating it on first run, so no request has to """
+  _get_keychain()
+
+def use_keychain(keychain:dict):
+  """ Replaces the active keychain, e.g. one loaded from a non-default path """
+  global _keychain
+  with _keychain_lock:
+    _keychain = keystore.with_crt_parameters(keychain)
+
+def _ledger_key(token_id) -> str:
+  """ Canonical form of a token uuid, so no other spelling of it escapes the double-spend check """
+  return str(uuid.UUID(str(token_id)))
 
 def redeem_token(token:dict):
   token_id = token.get("token").get("uuid")
-  redeemed_tokens[str(token_id)] = token
+  redeemed_tokens[_ledger_key(token_id)] = token
   return token_id
 
 def get_token(token_id:str):
-  return redeemed_tokens.get(str(token_id))
+  return redeemed_tokens.get(_ledger_key(token_id))
 
 def get_public_key():
-  return _e
+  return _get_keychain()["e"]
 
 def get_private_key():
-  return _d
+  return _get_keychain()["d"]
 
 def get_public_modulus():
-  return _n
\ No newline at end of file
+  return _get_keychain()["n"]
+
+def get_modulus_length():
+  """ Length of the public modulus in bytes """
+  return (get_public_modulus().bit_length() + 7) // 8
+
+def get_crt_private_key():
+  """ (p, q, dP, dQ, qInv) for CRT signing """
+  keychain = _get_keychain()
+  return (keychain["p"], keychain["q"], keychain["dp"], keychain["dq"], keychain["q_inv"])
@@ -0,0 +1,163 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import bank.logic as logic
+from util import config
+
+# Request handling for the bank routes, shared by the Flask app
+# (bank/__main__.py) and the asyncio app (bank/asgi.py). Every handler takes
+# the parsed JSON body, or None when the request was not JSON, and returns
+# (response payload, status code).
+
+# seconds clients may reuse /public-key before revalidating it
+PUBLIC_KEY_MAX_AGE = config.get_int("DIGICASH_PUBLIC_KEY_MAX_AGE", 300)
+# most claims accepted by one /redeem-batch request
+REDEEM_BATCH_MAX = config.get_int("DIGICASH_REDEEM_BATCH_MAX", 10000)
+
+# reasons a claim is refused by /redeem and /redeem-batch, as
+# (exception, status code, message); subclasses before their parents
+_redeem_rejections = (
+    (logic.BadTokenFormat, 400, "This token has an incorrect format"),
+    (logic.BadSignature, 403, "The bank signature on this token does not match."),
+    (logic.ChecksumConflict, 400, "The checksum does not match the token content."),
+    (logic.MerchantSpentAgain, 403, "The merchant has already redeemed this token."),
+    (logic.ClientSpentAgain, 403, "The client has already redeemed this token."),
+)
+_redeem_rejection_types = tuple(error_type for error_type, _, _ in _redeem_rejections)
+
+
+def _redeem_rejection(error):
+    for error_type, code, message in _redeem_rejections:
+        if isinstance(error, error_type):
+            return code, message
+    return None
+
+
+def _not_json(message="Token must be in JSON format."):
+    return {
+        "status": "rejected",
+        "message": message,
+    }, 400
+
+
+def redeem(token):
+    if token is None:
+        return _not_json()
+    try:
+        return {
+            "token": logic.redeem_token(token),
+            "status": "success"
+        }, 200
+    except _redeem_rejection_types as e:
+        code, message = _redeem_rejection(e)
+        return {
+            "status": "rejected",
+            "message": message,
+        }, code
+
+
+def redeem_batch(body):
+    """
+    Expected request format:
+
+    {
+      "claims": [<claim 1>, <claim 2>, ...]
+    }
+
+    Responds with one result per claim, in order, each either
+    {"status": "success", "token": <checksum>} or
+    {"status": "rejected", "error": <rejection>, "message": ..., "code": ...}
+    A MerchantSpentAgain rejection also holds the checksum already redeemed
+    as "token", so a merchant retrying a deposit can tell its own earlier
+    attempt went through.
+    """
+    if not (isinstance(body, dict) and isinstance(body.get("claims"), list)):
+        return _not_json("Claims must be a JSON object with a list of \"claims\".")
+    claims = body["claims"]
+    if len(claims) > REDEEM_BATCH_MAX:
+        return {
+            "status": "rejected",
+            "message": "At most %d claims can be redeemed per batch." % REDEEM_BATCH_MAX,
+        }, 413
+    results = []
+    for result in logic.redeem_tokens(claims):
+        if not isinstance(result, Exception):
+            results.append({"status": "success", "token": result})
+            continue
+        rejection = _redeem_rejection(result)
+        code, message = rejection if rejection else (500, "Unknown Error")
+        entry = {
+            "status": "rejected",
+            "error": result.__class__.__name__,
+            "message": message,
+            "code": code,
+        }
+        if isinstance(result, logic.MerchantSpentAgain) and result.checksum:
+            entry["token"] = result.checksum
+        results.append(entry)
+    return {
+        "results": results,
+        "status": "success"
+    }, 200
+
+
+def open_request(checksums):
+    if checksums is None:
+        return _not_json()
+    try:
+        keep, session_id = logic.open_signing_request(checksums)
+        return {
+            "keep": keep,
+            "session_id": session_id,
+            "status": "success"
+        }, 200
+    except Exception as e:
+        return {
+            "status": "rejected",
+            "message": "Unknown Error",
+            "error": str(e)
+        }, 500
+
+
+def fill_request(body):
+    """
+    Expected request format:
+
+    {
+      "session_id": <session id>,
+      "tokens": {
+        <token 1 checksum> : {
+          "key": <full key 1>,
+          "token": <full token 1>
+        },
+        <token 2 checksum> : [<full token 2>,
+        ...
+      }
+    }
+    """
+    if body is None:
+        return _not_json()
+    try:
+        tokens_to_validate = body.get("tokens")
+        session_id = body.get("session_id")
+        return {
+            "signature": logic.fill_signing_request(session_id, tokens_to_validate),
+            "status": "success"
+        }, 200
+    except logic.TokenValueMismatch as e:
+        return {
+            "status": "rejected",
+            "message": "Token mismatch",
+            "error": str(e)
+        }, 403
+    except Exception as e:
+        return {
+            "status": "rejected",
+            "message": "Unknown Error",
+            "error": str(e)
+        }, 500
+
+
+def public_key():
+    """ Returns (body, etag) of the /public-key document """
+    return logic.get_public_key_document()
@@ -0,0 +1,130 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import json
+import tempfile
+from util import config
+from util.blind_signatures import generate_keychain, compute_crt_parameters, SMALL_PUBLIC_EXPONENT
+from util.primes import KEY_PROFILES, DEFAULT_KEY_PROFILE
+
+_current_dir = os.path.dirname(os.path.realpath(__file__))
+
+DEFAULT_KEYCHAIN_PATH = os.path.join(_current_dir, "keys", "bank_keychain.json")
+_KEYCHAIN_FIELDS = ("e", "d", "n", "p", "q")
+
+
+class KeychainCorrupted(ValueError):
+    """ To be raised when a stored keychain cannot be read or does not describe a valid key. """
+    pass
+
+
+def get_keychain_path():
+    return config.get_str("DIGICASH_BANK_KEYCHAIN", DEFAULT_KEYCHAIN_PATH)
+
+
+def get_public_exponent():
+    """
+    Public exponent for new keychains: DIGICASH_PUBLIC_EXPONENT is either
+    "random" (a random prime as long as the factors) or a fixed odd integer
+    such as 65537.
+    """
+    value = config.get_str("DIGICASH_PUBLIC_EXPONENT", "random")
+    return _parse_public_exponent(value)
+
+
+def _parse_public_exponent(value: str):
+    if value == "random":
+        return None
+    exponent = int(value)
+    if exponent < 3 or exponent % 2 == 0:
+        raise ValueError("The public exponent must be an odd integer of at least 3, found %s" % value)
+    return exponent
+
+
+def create_keychain(profile: str = None, workers: int = None, public_exponent: int = None) -> dict:
+    e, d, n, p, q = generate_keychain(
+        include_factors=True, profile=profile, workers=workers, public_exponent=public_exponent)
+    return {"e": e, "d": d, "n": n, "p": p, "q": q}
+
+
+def save_keychain(keychain: dict, path: str = None):
+    """
+    Writes the keychain atomically, readable only by the current user.
+    """
+    path = path or get_keychain_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".keychain-")
+    try:
+        with os.fdopen(fd, "w") as key_file:
+            json.dump({field: "%x" % keychain[field] for field in _KEYCHAIN_FIELDS}, key_file, indent=2)
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_keychain(path: str = None) -> dict:
+    path = path or get_keychain_path()
+    try:
+        with open(path) as key_file:
+            stored = json.load(key_file)
+        keychain = {field: int(stored[field], 16) for field in _KEYCHAIN_FIELDS}
+    except (KeyError, TypeError, ValueError) as e:
+        raise KeychainCorrupted("Could not read keychain %s: %s" % (path, str(e)))
+    if keychain["p"] * keychain["q"] != keychain["n"]:
+        raise KeychainCorrupted("Keychain %s: modulus does not match its prime factors" % path)
+    if (keychain["e"] * keychain["d"]) % ((keychain["p"] - 1) * (keychain["q"] - 1)) != 1:
+        raise KeychainCorrupted("Keychain %s: public and private exponents do not match" % path)
+    return keychain
+
+
+def load_or_create_keychain(path: str = None) -> dict:
+    """
+    Loads the stored keychain, generating and saving a new one on first run.
+    """
+    path = path or get_keychain_path()
+    if os.path.exists(path):
+        return load_keychain(path)
+    print("No keychain found at %s" % path)
+    keychain = create_keychain(public_exponent=get_public_exponent())
+    save_keychain(keychain, path)
+    print("Saved new keychain to %s" % path)
+    return keychain
+
+
+def with_crt_parameters(keychain: dict) -> dict:
+    dp, dq, q_inv = compute_crt_parameters(keychain["d"], keychain["p"], keychain["q"])
+    return dict(keychain, dp=dp, dq=dq, q_inv=q_inv)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m bank.keystore",
+        description="Generate the bank keychain ahead of time.")
+    parser.add_argument("path", nargs="?", default=None,
+                        help="keychain file (default: $DIGICASH_BANK_KEYCHAIN or %s)" % DEFAULT_KEYCHAIN_PATH)
+    parser.add_argument("--profile", choices=sorted(KEY_PROFILES), default=None,
+                        help="key size profile (default: $DIGICASH_KEY_PROFILE or %s)" % DEFAULT_KEY_PROFILE)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used to search for primes (default: $DIGICASH_PRIME_WORKERS or all cores)")
+    parser.add_argument("--public-exponent", type=_parse_public_exponent,
+                        default=config.get_str("DIGICASH_PUBLIC_EXPONENT", "random"),
+                        help="'random' or a fixed exponent such as %d (default: $DIGICASH_PUBLIC_EXPONENT or random)"
+                        % SMALL_PUBLIC_EXPONENT)
+    parser.add_argument("--force", action="store_true",
+                        help="replace an existing keychain; tokens issued under it stop validating")
+    args = parser.parse_args()
+    path = args.path or get_keychain_path()
+    if os.path.exists(path) and not args.force:
+        load_keychain(path)
+        print("Keychain already exists at %s, use --force to replace it" % path)
+        sys.exit(1)
+    save_keychain(create_keychain(args.profile, args.workers, args.public_exponent), path)
+    print("Saved keychain to %s" % path)
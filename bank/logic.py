@@ -3,7 +3,9 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 from util.encryption import xor_bytes, _unpad, aes_decrypt
-from util import blind_signatures
+from util import blind_signatures, config, metrics, session_tickets
+from util.token_encoding import parse_hex, validate_token_checksum
+from util.session_store import SessionStore
 from util.custom_exceptions import BadSignature, ChecksumConflict
 from util.token_format import (
     verify_format,  # function: Token format verification
@@ -13,7 +15,11 @@ from util.token_format import (
     TokenFormatMalformed  # Exception: Raised when token format file is malformed
 )
 from Crypto.Cipher import AES
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import random
+import threading
 import rsa
 import hashlib
 import uuid
@@ -34,7 +40,11 @@ class TokenAlreadyRedeemed(ValueError):
 
 class MerchantSpentAgain(TokenAlreadyRedeemed):
     """ To be raised when a merchant is detected redeeming a token again. """
-    pass
+
+    def __init__(self, checksum: str = None):
+        super().__init__()
+        # checksum of the claim already in the ledger
+        self.checksum = checksum
 
 
 class ClientSpentAgain(TokenAlreadyRedeemed):
@@ -52,20 +62,60 @@ class MissingToken(ValueError):
     pass
 
 
-_sessions = dict()
+# open withdrawals, by session id
+_sessions = SessionStore(
+    ttl=config.get_float("DIGICASH_SESSION_TTL", 300),
+    max_size=config.get_int("DIGICASH_SESSION_MAX", 100000))
+# "memory" keeps sessions in _sessions; "ticket" seals them into the session
+# id itself (see util.session_tickets), so any bank process can finish them
+SESSION_MODE = config.get_str("DIGICASH_SESSION_MODE", "memory")
+_TICKET_PURPOSE = "bank/fill-request"
+_public_key_document = None
+
+# processes checking the revealed tokens of a withdrawal; 1 checks them inline
+VERIFY_WORKERS = config.get_int("DIGICASH_VERIFY_WORKERS", os.cpu_count() or 1)
+_verify_pool = None
+_verify_pool_lock = threading.Lock()
+
+stage_seconds = metrics.Histogram(
+    "digicash_bank_stage_seconds", "Time spent in each stage of a bank operation.", ("operation", "stage"))
+operation_seconds = metrics.Histogram(
+    "digicash_bank_operation_seconds", "Time spent in a bank operation.", ("operation",))
+operations = metrics.Counter(
+    "digicash_bank_operations_total", "Bank operations, by outcome.", ("operation", "outcome"))
+redemptions = metrics.Counter(
+    "digicash_bank_redemptions_total", "Claims presented for redemption, by outcome.", ("outcome",))
+metrics.session_store_metrics("digicash_bank", _sessions)
+
+
+def _signature_pair(claim: dict) -> tuple:
+    """ (checksum, signature) of a claim as integers; BadSignature when the signature is missing or not hex """
+    checksum = int.from_bytes(parse_hex(claim["checksum"]), "big")
+    try:
+        signature = int.from_bytes(parse_hex(claim.get("signature")), "big")
+    except (TypeError, ValueError):
+        raise BadSignature("The claim has no valid signature")
+    return checksum, signature
 
 
 def verify_signature(token: dict):
-    signature = int.from_bytes(bytes.fromhex(token.get("signature")), "big")
-    checksum = int.from_bytes(bytes.fromhex(token.get("checksum")), "big")
+    checksum, signature = _signature_pair(token)
     blind_signatures.validate_signature(
         checksum, signature, (get_public_key(), get_public_modulus()))
     return True
 
 
+def verify_signatures(pairs: list):
+    """
+    Checks the bank signature on many (checksum, signature) pairs at once.
+    Returns the indices of the pairs whose signature does not match.
+    """
+    return blind_signatures.find_bad_signatures(
+        pairs, (get_public_key(), get_public_modulus()))
+
+
 def verify_checksum(token: dict):
-    blind_signatures.validate_checksum(json.dumps(
-        token["token"]), bytes.fromhex(token["checksum"]))
+    validate_token_checksum(token["token"], bytes.fromhex(token["checksum"]))
     return True
 
 
@@ -102,17 +152,74 @@ def verify_all_identities(claim: dict):
     return revealed_identity
 
 def redeem_token(claim: dict):
-    verify_format(claim)
-    verify_checksum(claim)
-    verify_signature(claim)
-    verify_revealed_identities(claim)
+    try:
+        with metrics.track(operation_seconds, operations, "redeem"):
+            with stage_seconds.time("redeem", "verify_format"):
+                verify_format(claim)
+            with stage_seconds.time("redeem", "verify_checksum"):
+                verify_checksum(claim)
+            with stage_seconds.time("redeem", "verify_signature"):
+                verify_signature(claim)
+            with stage_seconds.time("redeem", "verify_revealed_identities"):
+                verify_revealed_identities(claim)
+            with stage_seconds.time("redeem", "ledger"):
+                with data.ledger_lock:
+                    checksum = _record_redemption(claim)
+    except Exception as e:
+        redemptions.inc(e.__class__.__name__)
+        raise
+    redemptions.inc("success")
+    return checksum
+
+
+def redeem_tokens(claims: list):
+    """
+    Redeems many claims at once. Every claim gets the same checks as
+    redeem_token, with the bank signatures verified as one batch, and the
+    double-spend checks are applied in order while holding the ledger, so a
+    token repeated within the batch is caught like one spent earlier.
+    Returns one entry per claim: its checksum, or the exception rejecting it.
+    """
+    with metrics.track(operation_seconds, operations, "redeem_batch"):
+        results = [None] * len(claims)
+        verified, pairs = [], []
+        with stage_seconds.time("redeem_batch", "verify_claims"):
+            for index, claim in enumerate(claims):
+                try:
+                    verify_format(claim)
+                    verify_checksum(claim)
+                    verify_revealed_identities(claim)
+                    pair = _signature_pair(claim)
+                except Exception as e:
+                    results[index] = e
+                    continue
+                verified.append(index)
+                pairs.append(pair)
+        with stage_seconds.time("redeem_batch", "verify_signatures"):
+            for bad in verify_signatures(pairs):
+                results[verified[bad]] = BadSignature()
+        with stage_seconds.time("redeem_batch", "ledger"):
+            with data.ledger_lock:
+                for index in verified:
+                    if results[index] is None:
+                        try:
+                            results[index] = _record_redemption(claims[index])
+                        except Exception as e:
+                            results[index] = e
+    for result in results:
+        redemptions.inc(result.__class__.__name__ if isinstance(result, Exception) else "success")
+    return results
+
+
+def _record_redemption(claim: dict):
+    """ Double-spend check and ledger entry; the caller holds data.ledger_lock """
     existing_token = data.get_token(claim["token"]["uuid"])
     if(existing_token is not None):
         existing_bitstring = existing_token["identity-pattern"]
         new_bitstring = claim["identity-pattern"]
         if existing_bitstring == new_bitstring:
             print("The merchant tried to spend again!")
-            raise MerchantSpentAgain()
+            raise MerchantSpentAgain(existing_token["checksum"])
         else:
             identity = None
             for a, b in zip(existing_token["revealed-identities"], claim["revealed-identities"]):
@@ -127,29 +234,124 @@ def redeem_token(claim: dict):
 
 
 def open_signing_request(tokens_to_validate):
-    session_id = str(uuid.uuid4())
+    with metrics.track(operation_seconds, operations, "open_request"):
+        return _open_signing_request(tokens_to_validate)
+
+
+def _open_signing_request(tokens_to_validate):
     keep = random.choice(tokens_to_validate)
     tokens_to_validate.remove(keep)
-    _sessions[session_id] = tokens_to_validate, keep
+    if SESSION_MODE == "ticket":
+        session_id = session_tickets.seal(
+            {"checksums": _checksums_digest(tokens_to_validate), "keep": keep}, _TICKET_PURPOSE, _sessions.ttl)
+    else:
+        session_id = str(uuid.uuid4())
+        _sessions.put(session_id, (tokens_to_validate, keep))
     return keep, session_id
 
 
+def _checksums_digest(checksums):
+    return hashlib.sha256("|".join(sorted(checksums)).encode("utf-8")).hexdigest()
+
+
+def _close_session(session_id, revealed_checksums):
+    """
+    Returns the (checksums, keep) of an open withdrawal, or None.
+    A ticket only holds a digest of the candidate checksums, so in ticket
+    mode the client must reveal every token the bank is not signing.
+    """
+    if SESSION_MODE == "ticket":
+        try:
+            # stateless: a replayed ticket only gets the same signature on the same blinded token again
+            session = session_tickets.open_ticket(session_id, _TICKET_PURPOSE)
+        except (session_tickets.InvalidTicket, TypeError):
+            return None
+        if _checksums_digest(revealed_checksums) != session["checksums"]:
+            error = "The revealed tokens do not match the query"
+            print(error)
+            raise ValueError(error)
+        return list(revealed_checksums), session["keep"]
+    return _sessions.pop(session_id)
+
+
+def _verify_revealed_claim(claim: dict):
+    """ Full validation of one revealed token; returns the identity it hides """
+    verify_checksum(claim)
+    verify_format(claim)
+    return verify_all_identities(claim)
+
+
+def _get_verify_pool():
+    global _verify_pool
+    if _verify_pool is None:
+        with _verify_pool_lock:
+            if _verify_pool is None:
+                # the workers are started from a fresh process, not forked from
+                # this threaded server, which may hold locks in other threads
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _verify_pool = ProcessPoolExecutor(max_workers=VERIFY_WORKERS, mp_context=context)
+    return _verify_pool
+
+
+def _reset_verify_pool(pool):
+    """ Drops a broken pool, so the next withdrawal starts a new one """
+    global _verify_pool
+    with _verify_pool_lock:
+        if _verify_pool is pool:
+            _verify_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _verify_revealed_claims(claims: list):
+    """
+    Runs _verify_revealed_claim on every claim, across the verification
+    pool when there is more than one worker. The first failure cancels the
+    checks that have not started yet and is raised.
+    Returns the identities in the order of the claims.
+    """
+    if VERIFY_WORKERS <= 1 or len(claims) <= 1:
+        return [_verify_revealed_claim(claim) for claim in claims]
+    pool = _get_verify_pool()
+    futures = []
+    try:
+        for claim in claims:
+            futures.append(pool.submit(_verify_revealed_claim, claim))
+        for future in as_completed(futures):
+            future.result()
+    except BrokenProcessPool:
+        _reset_verify_pool(pool)
+        raise
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    return [future.result() for future in futures]
+
+
 def fill_signing_request(session_id, claims):
-    if session_id in _sessions:
-        checksums, checksum_to_sign = _sessions[session_id]
-        del _sessions[session_id]
+    with metrics.track(operation_seconds, operations, "fill_request"):
+        return _fill_signing_request(session_id, claims)
+
+
+def _fill_signing_request(session_id, claims):
+    with stage_seconds.time("fill_request", "session"):
+        session = _close_session(session_id, claims)
+    if session is not None:
+        checksums, checksum_to_sign = session
         last_claim_value = None
         last_identity = None
-        for checksum, claim in claims.items():
+        for checksum in claims:
             if checksum not in checksums:
                 error = "This token never appeared in the query: %s" % checksum
                 print(error)
                 raise ValueError(error)
 
-            # do full validation of all the tokens
-            verify_checksum(claim)
-            verify_format(claim)
-            identity = verify_all_identities(claim)
+        # do full validation of all the tokens, then compare them
+        claims = list(claims.values())
+        with stage_seconds.time("fill_request", "verify_revealed_claims"):
+            identities = _verify_revealed_claims(claims)
+        for claim, identity in zip(claims, identities):
             if last_identity and identity != last_identity:
                 print("The identities do not match on these tokens!")
                 print(identity)
@@ -161,19 +363,45 @@ def fill_signing_request(session_id, claims):
                 raise TokenValueMismatch("The monetary values do not match on these tokens: %02f ||| %02f" % (last_claim_value, claim["token"]["amount"]))
             last_claim_value = claim["token"]["amount"]
 
-        d = data.get_private_key()
-        n = data.get_public_modulus()
-
         t = int.from_bytes(bytes.fromhex(checksum_to_sign), 'big')
-        return pow(t, d, n).to_bytes(256, 'big').hex()
+        with stage_seconds.time("fill_request", "sign"):
+            signature = blind_signatures.sign(
+                t, (get_public_key(), get_public_modulus()), data.get_crt_private_key())
+        return signature.to_bytes(get_modulus_length(), 'big').hex()
 
     else:
         raise InvalidSession("Invalid session token")
 
 
+def get_public_key_document():
+    """
+    Returns the /public-key response body and its ETag. Both are built once
+    per keychain, not on every request.
+    """
+    global _public_key_document
+    key = (get_public_key(), get_public_modulus())
+    if _public_key_document is None or _public_key_document[0] != key:
+        modulus_len = get_modulus_length()
+        body = json.dumps({
+            # the public key is at most as long as one of the primes
+            "key": key[0].to_bytes(modulus_len // 2, 'big').hex(),
+            "key_len": modulus_len // 2,
+            # product of 2 primes, 256 bytes for the standard key profile
+            "modulus": key[1].to_bytes(modulus_len, 'big').hex(),
+            "modulus_len": modulus_len,
+            "status": "success"
+        }).encode("utf-8")
+        _public_key_document = key, body, hashlib.sha256(body).hexdigest()[:32]
+    return _public_key_document[1:]
+
+
 def get_public_key():
     return data.get_public_key()
 
 
 def get_public_modulus():
     return data.get_public_modulus()
+
+
+def get_modulus_length():
+    return data.get_modulus_length()
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import json
+from benchmarks import harness
+
+# Runs the micro-benchmarks and prints the results as JSON:
+#
+#   python -m benchmarks --save baseline.json
+#   python -m benchmarks --compare baseline.json
+#
+# With --compare, the exit status is 1 when a benchmark got slower than the
+# baseline by more than --threshold.
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the crypto and validation primitives.")
+    parser.add_argument("-k", "--filter", action="append", default=[],
+                        help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--full", action="store_true", help="include the largest key profiles and identity counts")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds each timed run lasts at least")
+    parser.add_argument("--save", metavar="PATH", help="write the results to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change in median reported as slower or faster")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+    # util.token_format appends to sys.argv when imported, so parse first
+    from benchmarks import cases
+
+    benchmarks = [benchmark for benchmark in cases.get_benchmarks(args.full)
+                  if not args.filter or any(name in benchmark.key for name in args.filter)]
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.key)
+        return 0
+    baseline = harness.load(args.compare) if args.compare else None
+
+    report = harness.run_suite(benchmarks, args.repeat, args.min_time)
+    status = 0
+    if baseline is not None:
+        rows = harness.compare(report, baseline, args.threshold)
+        report["comparison"] = {
+            "baseline": args.compare,
+            "threshold": args.threshold,
+            "results": {key: {"baseline": before, "median": after, "ratio": ratio, "status": change}
+                        for key, before, after, ratio, change in rows},
+        }
+        for key, before, after, ratio, change in rows:
+            print("%-60s %12s -> %12s  x%.2f %s" % (key, harness.format_time(before), harness.format_time(after),
+                                                    ratio, change), file=sys.stderr)
+        if any(change == "slower" for _, _, _, _, change in rows):
+            status = 1
+    if args.save:
+        harness.save(report, args.save)
+    print(json.dumps(report, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
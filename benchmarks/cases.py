@@ -0,0 +1,173 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import contextlib
+import copy
+import io
+import json
+from Crypto import Random
+from util import blind_signatures, encryption, token_format, wire
+from util.primes import KEY_PROFILES, generate_prime
+from util.token_encoding import token_checksum
+from benchmarks.harness import Benchmark
+
+# The benchmarks of the suite. Inputs (keys, primes, tokens) are built in the
+# setup functions and cached, so only the measured call is timed.
+
+# sizes used by the default run; --full adds the larger ones
+KEY_PROFILE_NAMES = ("test", "standard")
+FULL_KEY_PROFILE_NAMES = tuple(KEY_PROFILES)
+DATA_SIZES = (64, 1024, 65536)
+IDENTITY_COUNTS = (5, 32, 128)
+FULL_IDENTITY_COUNTS = (5, 32, 128, 1024)
+
+_keychains = dict()
+_primes = dict()
+
+
+@contextlib.contextmanager
+def _quiet():
+    """ The primitives print progress; keep it out of the results """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _keychain(profile: str, exponent: str) -> tuple:
+    if (profile, exponent) not in _keychains:
+        public_exponent = blind_signatures.SMALL_PUBLIC_EXPONENT if exponent == "65537" else None
+        with _quiet():
+            _keychains[profile, exponent] = blind_signatures.generate_keychain(
+                profile=profile, public_exponent=public_exponent)
+    return _keychains[profile, exponent]
+
+
+def _prime(bits: int) -> int:
+    if bits not in _primes:
+        _primes[bits] = generate_prime(bits)
+    return _primes[bits]
+
+
+def _identities(count: int) -> list:
+    from client.protocol import generateIdentities
+    with _quiet():
+        return generateIdentities("Benchmark Identity", count)
+
+
+def setup_generate_keychain(profile):
+    def run():
+        with _quiet():
+            blind_signatures.generate_keychain(profile=profile, public_exponent=blind_signatures.SMALL_PUBLIC_EXPONENT)
+    return run
+
+
+def setup_is_prime(bits):
+    prime = _prime(bits)
+    return lambda: blind_signatures.is_prime(prime)
+
+
+def setup_validate_signature(profile, exponent):
+    e, d, n = _keychain(profile, exponent)
+    checksum = int.from_bytes(Random.get_random_bytes(32), "big")
+    signature = pow(checksum, d, n)
+    return lambda: blind_signatures.validate_signature(checksum, signature, (e, n))
+
+
+def setup_modulo_multiplicative_inverse(profile):
+    e, d, n = _keychain(profile, "65537")
+    value = int.from_bytes(Random.get_random_bytes(KEY_PROFILES[profile] // 8), "big") % n
+    return lambda: blind_signatures.modulo_multiplicative_inverse(value, n)
+
+
+def setup_aes_encrypt(size):
+    key, data = Random.get_random_bytes(16), Random.get_random_bytes(size)
+    return lambda: encryption.aes_encrypt(data, key)
+
+
+def setup_aes_decrypt(size):
+    key = Random.get_random_bytes(16)
+    encrypted = encryption.aes_encrypt(Random.get_random_bytes(size), key)
+    return lambda: encryption.aes_decrypt(encrypted, key)
+
+
+def setup_xor_bytes(size):
+    a, b = Random.get_random_bytes(size), Random.get_random_bytes(size)
+    return lambda: encryption.xor_bytes(a, b)
+
+
+def setup_verify_format(identities):
+    # the shipped format fixes the number of identities, so compile one for this count
+    expected_format = copy.deepcopy(token_format.get_token_format())
+    expected_format["token"]["properties"]["identities"]["length"] = identities
+    validate = token_format.compile_format(expected_format)
+    token = {
+        "amount": 100,
+        "uuid": "3ec92f30-ce41-4e6c-90b9-09c1552d664d",
+        "created_datetime": "2026-01-01T12:00:00.000000",
+        "identities": _identities(identities)[1],
+    }
+    claim = {"token": token, "checksum": token_checksum(token).hex()}
+    return lambda: validate(claim)
+
+
+def setup_generate_identities(identities):
+    from client.protocol import generateIdentities
+    return lambda: generateIdentities("Benchmark Identity", identities)
+
+
+def setup_generate_identity_batch(tokens, identities):
+    from client.protocol import generateIdentityBatch
+    return lambda: generateIdentityBatch("Benchmark Identity", tokens, identities)
+
+
+def _claim(identities: int) -> dict:
+    token = {
+        "amount": 100,
+        "uuid": "3ec92f30-ce41-4e6c-90b9-09c1552d664d",
+        "created_datetime": "2026-01-01T12:00:00.000000",
+        "identities": _identities(identities)[1],
+    }
+    return {"token": token, "checksum": token_checksum(token).hex(), "signature": Random.get_random_bytes(256).hex()}
+
+
+def setup_wire_encode(identities, format):
+    claim = _claim(identities)
+    if format == "json":
+        return lambda: json.dumps(claim).encode("utf-8")
+    return lambda: wire.encode(claim)
+
+
+def setup_wire_decode(identities, format):
+    claim = _claim(identities)
+    if format == "json":
+        body = json.dumps(claim).encode("utf-8")
+        return lambda: json.loads(body)
+    body = wire.encode(claim)
+    return lambda: wire.decode(body)
+
+
+def get_benchmarks(full: bool = False) -> list:
+    profiles = FULL_KEY_PROFILE_NAMES if full else KEY_PROFILE_NAMES
+    identity_counts = FULL_IDENTITY_COUNTS if full else IDENTITY_COUNTS
+    benchmarks = []
+    for profile in profiles:
+        benchmarks.append(Benchmark("generate_keychain", setup_generate_keychain, {"profile": profile},
+                                    loops=1, repeat=3))
+        benchmarks.append(Benchmark("is_prime", setup_is_prime, {"bits": KEY_PROFILES[profile] // 2}))
+        for exponent in ("65537", "random"):
+            benchmarks.append(Benchmark("validate_signature", setup_validate_signature,
+                                        {"profile": profile, "exponent": exponent}))
+        benchmarks.append(Benchmark("modulo_multiplicative_inverse", setup_modulo_multiplicative_inverse,
+                                    {"profile": profile}))
+    for size in DATA_SIZES:
+        benchmarks.append(Benchmark("aes_encrypt", setup_aes_encrypt, {"size": size}))
+        benchmarks.append(Benchmark("aes_decrypt", setup_aes_decrypt, {"size": size}))
+        benchmarks.append(Benchmark("xor_bytes", setup_xor_bytes, {"size": size}))
+    for count in identity_counts:
+        benchmarks.append(Benchmark("verify_format", setup_verify_format, {"identities": count}))
+        benchmarks.append(Benchmark("generateIdentities", setup_generate_identities, {"identities": count}))
+        benchmarks.append(Benchmark("generateIdentityBatch", setup_generate_identity_batch,
+                                    {"tokens": 5, "identities": count}))
+        for format in ("json", "binary"):
+            benchmarks.append(Benchmark("wire_encode", setup_wire_encode, {"identities": count, "format": format}))
+            benchmarks.append(Benchmark("wire_decode", setup_wire_decode, {"identities": count, "format": format}))
+    return benchmarks
@@ -0,0 +1,152 @@
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Timing, result files and baseline comparison for the benchmark suite.
+# A benchmark is a named function plus a set of parameters; its setup builds
+# the inputs once, then the returned callable is timed over repeated runs.
+
+
+class Benchmark:
+
+    def __init__(self, name: str, setup, params: dict = None, loops: int = None, repeat: int = None):
+        """
+        setup(**params) returns the no-argument callable to time. loops fixes
+        the calls per run for slow benchmarks; otherwise it is calibrated so a
+        run lasts at least the suite's min_time.
+        """
+        self.name = name
+        self.setup = setup
+        self.params = params or dict()
+        self.loops = loops
+        self.repeat = repeat
+
+    @property
+    def key(self) -> str:
+        """ Unique name of the benchmark with its parameters, e.g. aes_encrypt[size=1024] """
+        if not self.params:
+            return self.name
+        return "%s[%s]" % (self.name, ",".join("%s=%s" % item for item in sorted(self.params.items())))
+
+
+def _calibrate(func, min_time: float) -> int:
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 30:
+            return loops
+        # aim a little past min_time, at most 10x more calls per step
+        loops = max(loops + 1, min(loops * 10, int(loops * min_time * 1.2 / max(elapsed, 1e-9))))
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """ Times one benchmark; every time is in seconds per call """
+    func = benchmark.setup(**benchmark.params)
+    loops = benchmark.loops or _calibrate(func, min_time)
+    repeat = benchmark.repeat or repeat
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops)
+    return {
+        "name": benchmark.name,
+        "params": benchmark.params,
+        "loops": loops,
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "revision": _git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_suite(benchmarks: list, repeat: int = 5, min_time: float = 0.2, verbose: bool = True) -> dict:
+    results = dict()
+    for benchmark in benchmarks:
+        result = run_benchmark(benchmark, repeat, min_time)
+        results[benchmark.key] = result
+        if verbose:
+            print("%-60s %s +- %s" % (benchmark.key, format_time(result["median"]), format_time(result["stdev"])),
+                  file=sys.stderr)
+    return {
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def percentile(values: list, fraction: float) -> float:
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%.3f %s" % (seconds / scale, unit)
+    return "%.1f ns" % (seconds / 1e-9)
+
+
+def save(report: dict, path: str):
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+        output.write("\n")
+
+
+def load(path: str) -> dict:
+    with open(path) as report:
+        return json.load(report)
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.1) -> list:
+    """
+    Compares the medians of a report with a baseline report. Returns one
+    (key, baseline median, median, ratio, status) row per benchmark found in
+    both, where status is "slower" when the ratio is above 1 + threshold,
+    "faster" when below 1 - threshold, and "same" otherwise.
+    """
+    rows = []
+    baseline_results = baseline["results"]
+    for key, result in report["results"].items():
+        if key not in baseline_results:
+            continue
+        before, after = baseline_results[key]["median"], result["median"]
+        ratio = after / before if before else float("inf")
+        if ratio > 1 + threshold:
+            status = "slower"
+        elif ratio < 1 - threshold:
+            status = "faster"
+        else:
+            status = "same"
+        rows.append((key, before, after, ratio, status))
+    return rows
@@ -0,0 +1,219 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import contextlib
+import json
+import random
+import time
+from benchmarks import harness
+
+# Offline replay of the bank's core logic. `record` builds a corpus of the
+# documents the client and merchant exchange with the bank, `run` replays
+# them in-process against bank.logic, with no HTTP in between:
+#
+#   python -m benchmarks.replay record /tmp/corpus --withdrawals 200 --profile test
+#   python -m benchmarks.replay run /tmp/corpus --json replay.json
+#
+# A corpus directory holds
+#   keychain.json       the bank keychain the tokens are signed with
+#   withdrawals.jsonl   per withdrawal, the blinded checksums sent to
+#                       /open-request and every token behind them, so any one
+#                       can be kept back whichever the bank picks
+#   redemptions.jsonl   revealed claims, as the merchant sends to /redeem
+
+KEYCHAIN_FILE = "keychain.json"
+WITHDRAWALS_FILE = "withdrawals.jsonl"
+REDEMPTIONS_FILE = "redemptions.jsonl"
+TOKENS_PER_WITHDRAWAL = 5
+AMOUNT = 1000
+BANK_ADDRESS = "http://localhost:5000"
+
+
+def _write_lines(path: str, documents):
+    with open(path, "w") as output:
+        for document in documents:
+            output.write(json.dumps(document, separators=(",", ":")))
+            output.write("\n")
+
+
+def _read_lines(path: str) -> list:
+    with open(path) as lines:
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+def _revealed_claim(token: dict, keychain: dict, chooser: random.Random) -> dict:
+    """ Signs a token with the corpus key and reveals the identity halves a merchant would ask for """
+    from util.blind_signatures import sign, compute_crt_parameters
+    from util.encryption import aes_decrypt
+    from client import protocol
+    e, n = keychain["e"], keychain["n"]
+    checksum = int.from_bytes(bytes.fromhex(token["checksum"]), "big")
+    crt_key = (keychain["p"], keychain["q"]) + compute_crt_parameters(keychain["d"], keychain["p"], keychain["q"])
+    claim = protocol.purchase_token(token)
+    for field in ("key", "key-inverse"):
+        claim.pop(field, None)
+    claim["signature"] = sign(checksum, (e, n), crt_key).to_bytes((n.bit_length() + 7) // 8, "big").hex()
+    claim["bank-address"] = BANK_ADDRESS
+    pattern = [chooser.choice([0, 1]) for _ in token["token"]["identities"]]
+    claim["revealed-identities"] = [
+        aes_decrypt(bytes.fromhex(identity["identity"][toggle]), bytes.fromhex(keys[toggle])).hex()
+        for identity, keys, toggle in zip(token["token"]["identities"], token["identity_keys"], pattern)]
+    claim["identity-pattern"] = pattern
+    return claim
+
+
+def record(corpus: str, withdrawals: int, profile: str = None, keychain_path: str = None, seed: int = None):
+    from bank import keystore
+    from client import blinding, protocol
+    os.makedirs(corpus, exist_ok=True)
+    if keychain_path:
+        keychain = keystore.load_keychain(keychain_path)
+    else:
+        keychain = keystore.create_keychain(profile, public_exponent=keystore.get_public_exponent())
+    keystore.save_keychain(keychain, os.path.join(corpus, KEYCHAIN_FILE))
+    e, n = keychain["e"], keychain["n"]
+    n_len = (n.bit_length() + 7) // 8
+    pool = blinding.BlindingPool((e, n))
+    chooser = random.Random(seed)
+    withdrawal_documents, redemption_documents = [], []
+    try:
+        for number in range(withdrawals):
+            identity = "Replay Wallet %d | #%09d" % (number, number)
+            tokens = dict()
+            for token in protocol.generateTokens(AMOUNT, identity, TOKENS_PER_WITHDRAWAL, verbose=False):
+                tokens[protocol.blindToken(token, pool, n, n_len)] = token
+            withdrawal_documents.append({"checksums": list(tokens.keys()), "tokens": tokens})
+            redemption_documents.append(_revealed_claim(chooser.choice(list(tokens.values())), keychain, chooser))
+    finally:
+        pool.close()
+    _write_lines(os.path.join(corpus, WITHDRAWALS_FILE), withdrawal_documents)
+    _write_lines(os.path.join(corpus, REDEMPTIONS_FILE), redemption_documents)
+    print("Recorded %d withdrawals and %d redemptions in %s" % (
+        len(withdrawal_documents), len(redemption_documents), corpus), file=sys.stderr)
+
+
+def _summary(name: str, durations: list, outcomes: dict) -> dict:
+    durations = sorted(durations)
+    return {
+        "name": name,
+        "count": len(durations),
+        "outcomes": outcomes,
+        "total": sum(durations),
+        "mean": sum(durations) / len(durations) if durations else 0.0,
+        "min": durations[0] if durations else 0.0,
+        "median": harness.percentile(durations, 0.5),
+        "p90": harness.percentile(durations, 0.9),
+        "p99": harness.percentile(durations, 0.99),
+        "max": durations[-1] if durations else 0.0,
+    }
+
+
+def _timed(timings: dict, name: str, func, *args):
+    durations, outcomes = timings.setdefault(name, ([], dict()))
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        return func(*args)
+    except Exception as e:
+        outcome = e.__class__.__name__
+        return None
+    finally:
+        durations.append(time.perf_counter() - start)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+
+def replay(corpus: str, repeat: int = 1) -> dict:
+    """
+    Replays the corpus against bank.logic, `repeat` times over. Every pass
+    starts from an empty ledger and redeems each claim twice, so both the
+    accepted path and the double-spend check are timed.
+    """
+    from bank import keystore
+    import bank.data as data
+    import bank.logic as logic
+    data.use_keychain(keystore.load_keychain(os.path.join(corpus, KEYCHAIN_FILE)))
+    withdrawals = _read_lines(os.path.join(corpus, WITHDRAWALS_FILE))
+    redemptions = _read_lines(os.path.join(corpus, REDEMPTIONS_FILE))
+    timings = dict()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for withdrawal in withdrawals:
+            opened = _timed(timings, "open_signing_request", logic.open_signing_request, list(withdrawal["checksums"]))
+            if opened is None:
+                continue
+            keep, session_id = opened
+            revealed = {checksum: token for checksum, token in withdrawal["tokens"].items() if checksum != keep}
+            _timed(timings, "fill_signing_request", logic.fill_signing_request, session_id, revealed)
+        with data.ledger_lock:
+            data.redeemed_tokens.clear()
+        for claim in redemptions:
+            _timed(timings, "redeem_token", logic.redeem_token, claim)
+        for claim in redemptions:
+            _timed(timings, "redeem_token[spent_again]", logic.redeem_token, claim)
+    elapsed = time.perf_counter() - start
+    with data.ledger_lock:
+        data.redeemed_tokens.clear()
+    return {
+        "environment": harness.environment(),
+        "corpus": {
+            "path": corpus,
+            "withdrawals": len(withdrawals),
+            "redemptions": len(redemptions),
+            "modulus_bits": data.get_public_modulus().bit_length(),
+            "repeat": repeat,
+        },
+        "elapsed": elapsed,
+        "results": {name: _summary(name, durations, outcomes) for name, (durations, outcomes) in timings.items()},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.replay",
+                                     description="Record and replay protocol documents against bank.logic.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="build a corpus")
+    record_parser.add_argument("corpus", help="corpus directory")
+    record_parser.add_argument("--withdrawals", type=int, default=100, help="withdrawals to record")
+    record_parser.add_argument("--profile", help="key profile of a new corpus keychain (default: $DIGICASH_KEY_PROFILE)")
+    record_parser.add_argument("--keychain", help="sign with this existing keychain instead")
+    record_parser.add_argument("--seed", type=int, help="seed for the kept tokens and identity patterns")
+    run_parser = commands.add_parser("run", help="replay a corpus")
+    run_parser.add_argument("corpus", help="corpus directory")
+    run_parser.add_argument("--repeat", type=int, default=1, help="passes over the corpus")
+    run_parser.add_argument("--json", metavar="PATH", help="also write the report to PATH")
+    run_parser.add_argument("--compare", metavar="PATH", help="compare the medians with a saved report")
+    run_parser.add_argument("--verbose", action="store_true", help="show what bank.logic prints")
+    run_parser.add_argument("--threshold", type=float, default=0.1,
+                            help="relative change in median reported as slower or faster")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.corpus, args.withdrawals, args.profile, args.keychain, args.seed)
+        return 0
+
+    if args.verbose:
+        report = replay(args.corpus, args.repeat)
+    else:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            report = replay(args.corpus, args.repeat)
+    print("%-32s %7s %10s %10s %10s %10s  %s" % ("function", "count", "median", "p90", "p99", "max", "outcomes"))
+    for name, result in report["results"].items():
+        print("%-32s %7d %10s %10s %10s %10s  %s" % (
+            name, result["count"], harness.format_time(result["median"]), harness.format_time(result["p90"]),
+            harness.format_time(result["p99"]), harness.format_time(result["max"]),
+            ", ".join("%s=%d" % item for item in sorted(result["outcomes"].items()))))
+    status = 0
+    if args.compare:
+        for key, before, after, ratio, change in harness.compare(report, harness.load(args.compare), args.threshold):
+            print("%-32s %12s -> %12s  x%.2f %s" % (key, harness.format_time(before), harness.format_time(after),
+                                                    ratio, change))
+            if change == "slower":
+                status = 1
+    if args.json:
+        harness.save(report, args.json)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import collections
+import threading
+from Crypto import Random
+from util import config
+from util.blind_signatures import batch_modulo_multiplicative_inverse
+
+# Blinding factors (k, k^e mod n, k^-1 mod n) are precomputed in the
+# background for the current bank key, so blinding a token on the withdrawal
+# path is a single modular multiplication.
+
+POOL_CAPACITY = config.get_int("DIGICASH_BLINDING_POOL_CAPACITY", 64)
+POOL_LOW_WATERMARK = config.get_int("DIGICASH_BLINDING_POOL_LOW_WATERMARK", 16)
+# factors computed together, sharing one modular inversion
+REFILL_BATCH = config.get_int("DIGICASH_BLINDING_POOL_BATCH", 16)
+
+
+def generate_blinding_factors(key: tuple, count: int) -> list:
+    """ Returns `count` random (k, k^e mod n, k^-1 mod n) for key = (e, n) """
+    e, n = key
+    n_len = (n.bit_length() + 7) // 8
+    factors = []
+    while len(factors) < count:
+        ks = [int.from_bytes(Random.get_random_bytes(n_len), 'big') % n for _ in range(count - len(factors))]
+        for k, k_inv in zip(ks, batch_modulo_multiplicative_inverse(ks, n)):
+            # k shares a factor with n: no inverse (and the modulus is broken)
+            if k < 2 or k_inv is None:
+                continue
+            factors.append((k, pow(k, e, n), k_inv))
+    return factors
+
+
+def generate_blinding_factor(key: tuple) -> tuple:
+    """ Returns a random (k, k^e mod n, k^-1 mod n) for key = (e, n) """
+    return generate_blinding_factors(key, 1)[0]
+
+
+class BlindingPool:
+    """ Precomputed blinding factors for one bank key (e, n). """
+
+    def __init__(self, key: tuple, capacity: int = POOL_CAPACITY, low_watermark: int = POOL_LOW_WATERMARK):
+        self.key = key
+        self.capacity = max(1, capacity)
+        self.low_watermark = min(low_watermark, self.capacity)
+        self._factors = collections.deque()
+        self._refill_needed = threading.Event()
+        self._closed = False
+        self._refill_needed.set()
+        self._worker = threading.Thread(target=self._refill, name="blinding-pool", daemon=True)
+        self._worker.start()
+
+    def __len__(self):
+        return len(self._factors)
+
+    def take(self) -> tuple:
+        """ Returns one (k, k^e mod n, k^-1 mod n), computing it inline if the pool ran dry """
+        try:
+            factor = self._factors.popleft()
+        except IndexError:
+            factor = None
+        if len(self._factors) < self.low_watermark:
+            self._refill_needed.set()
+        if factor is None:
+            factor = generate_blinding_factor(self.key)
+        return factor
+
+    def close(self):
+        self._closed = True
+        self._factors.clear()
+        self._refill_needed.set()
+
+    def _refill(self):
+        while not self._closed:
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+            while not self._closed and len(self._factors) < self.capacity:
+                count = min(REFILL_BATCH, self.capacity - len(self._factors))
+                factors = generate_blinding_factors(self.key, count)
+                if not self._closed:
+                    self._factors.extend(factors)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(key: tuple) -> BlindingPool:
+    """ Returns the pool for key = (e, n), discarding the previous one if the bank key changed """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.key != key:
+            if _pool is not None:
+                _pool.close()
+            _pool = BlindingPool(key)
+        return _pool
@@ -0,0 +1,290 @@
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from client import blinding, protocol
+from util import http_client
+
+# Load generator for the withdrawal and purchase protocols: many simulated
+# wallets run complete flows concurrently against a running bank and
+# merchant, at a target rate, and the latency of every protocol step is
+# reported.
+#
+#   python -m client.loadgen --wallets 32 --rate 20 --duration 60
+#   python -m client.loadgen --flows 500 --mix honest=0.7,double_spend=0.3 --json report.json
+#
+# Flow kinds:
+#   honest            withdraw a token and spend it once
+#   double_spend      withdraw a token and spend it twice
+#   cheat_withdrawal  withdraw with one token worth 1000 times the others
+#   merchant_replay   spend through /fill-request-malicious, which redeems twice
+
+KINDS = ("honest", "double_spend", "cheat_withdrawal", "merchant_replay")
+DEFAULT_MIX = "honest=0.85,double_spend=0.05,cheat_withdrawal=0.05,merchant_replay=0.05"
+TOKENS_PER_WITHDRAWAL = 5
+AMOUNT = 1000
+
+
+def parse_mix(text: str) -> list:
+    """ "honest=0.9,double_spend=0.1" -> [(kind, weight), ...] """
+    mix = []
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("Unknown flow kind %s, expected one of %s" % (kind, ", ".join(KINDS)))
+        mix.append((kind, float(weight or 1)))
+    if not mix or sum(weight for _, weight in mix) <= 0:
+        raise ValueError("The flow mix needs a positive weight")
+    return mix
+
+
+def percentile(values: list, fraction: float) -> float:
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Recorder:
+    """ Latencies and outcomes of the protocol steps and flows, shared by the wallets """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps = dict()
+        self._flows = dict()
+        self._lag = []
+
+    def step(self, step: str, seconds: float, outcome: str):
+        with self._lock:
+            entry = self._steps.setdefault(step, ([], dict()))
+            entry[0].append(seconds)
+            entry[1][outcome] = entry[1].get(outcome, 0) + 1
+
+    def flow(self, kind: str, outcome: str, lag: float):
+        with self._lock:
+            outcomes = self._flows.setdefault(kind, dict())
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            self._lag.append(lag)
+
+    def report(self, elapsed: float) -> dict:
+        with self._lock:
+            steps = {step: (sorted(latencies), dict(outcomes)) for step, (latencies, outcomes) in self._steps.items()}
+            flows = {kind: dict(outcomes) for kind, outcomes in self._flows.items()}
+            lag = sorted(self._lag)
+        return {
+            "elapsed": elapsed,
+            "flows": {
+                "count": len(lag),
+                "throughput": len(lag) / elapsed if elapsed else 0.0,
+                "outcomes": flows,
+                # how late flows started against the target rate; a growing lag means saturation
+                "start_lag_p50": percentile(lag, 0.5),
+                "start_lag_p99": percentile(lag, 0.99),
+            },
+            "steps": {step: {
+                "count": len(latencies),
+                "throughput": len(latencies) / elapsed if elapsed else 0.0,
+                "outcomes": outcomes,
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1],
+            } for step, (latencies, outcomes) in steps.items()},
+        }
+
+
+class Wallet:
+    """ One simulated client, running flows with its own identity """
+
+    def __init__(self, number: int, key: tuple, n_len: int, recorder: Recorder,
+                 bank_address: str, merchant_address: str):
+        self.identity = "Load Wallet %d | #%09d" % (number, number)
+        self.key = key
+        self.n_len = n_len
+        self.pool = blinding.get_pool(key)
+        self.recorder = recorder
+        self.bank_address = bank_address
+        self.merchant_address = merchant_address
+
+    def _timed(self, step: str, func, *args):
+        """ Runs one step, recording its latency as ok, rejected (refused by the server) or error """
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except protocol.StepFailed:
+            self.recorder.step(step, time.perf_counter() - start, "rejected")
+            raise
+        except Exception:
+            self.recorder.step(step, time.perf_counter() - start, "error")
+            raise
+        self.recorder.step(step, time.perf_counter() - start, "ok")
+        return result
+
+    def _generate(self, cheat: bool) -> dict:
+        e, n = self.key
+        tokens = dict()
+        generated = protocol.generateTokens(AMOUNT, self.identity, TOKENS_PER_WITHDRAWAL - cheat, verbose=False)
+        if cheat:
+            generated.append(protocol.generateToken(AMOUNT * 1000, self.identity, verbose=False))
+        for token in generated:
+            tokens[protocol.blindToken(token, self.pool, n, self.n_len)] = token
+        return tokens
+
+    def withdraw(self, cheat: bool = False) -> dict:
+        """ Returns a signed token; raises StepFailed when the bank refuses it """
+        tokens = self._timed("client/generate-tokens", self._generate, cheat)
+        keep, session_id = self._timed("bank/open-request", protocol.open_withdrawal,
+                                       list(tokens.keys()), self.bank_address)
+        unsigned_tokens = protocol.unsigned_tokens_request(tokens, keep, session_id)
+        signature = self._timed("bank/fill-request", protocol.fill_withdrawal, unsigned_tokens, self.bank_address)
+        return self._timed("client/unblind", protocol.unblind_token,
+                           tokens[keep], signature, self.key, self.n_len, self.bank_address)
+
+    def _fill_spend(self, claim, purchase, spend, malicious):
+        response, _ = protocol.fill_spend(claim, purchase, spend, malicious, self.merchant_address)
+        if not response.ok:
+            raise protocol.StepFailed("fill-request", response)
+        return response
+
+    def spend(self, claim: dict, malicious: bool = False):
+        """ Raises StepFailed when the merchant refuses the purchase """
+        purchase = protocol.purchase_token(claim)
+        spend = self._timed("merchant/request-spend", protocol.request_spend, purchase, self.merchant_address)
+        step = "merchant/fill-request-malicious" if malicious else "merchant/fill-request"
+        self._timed(step, self._fill_spend, claim, purchase, spend, malicious)
+
+    def run(self, kind: str) -> str:
+        """ Runs one flow; returns its outcome """
+        try:
+            if kind == "cheat_withdrawal":
+                try:
+                    self.withdraw(cheat=True)
+                except protocol.StepFailed:
+                    return "caught"
+                # the bank signs the token it did not inspect: the cheat goes unseen 1 time in 5
+                return "undetected"
+            claim = self.withdraw()
+            if kind == "merchant_replay":
+                try:
+                    self.spend(claim, malicious=True)
+                except protocol.StepFailed:
+                    return "caught"
+                return "undetected"
+            self.spend(claim)
+            if kind == "double_spend":
+                try:
+                    self.spend(claim)
+                except protocol.StepFailed:
+                    return "caught"
+                # expected when the merchant settles through its deposit queue
+                return "accepted"
+            return "ok"
+        except protocol.StepFailed:
+            return "rejected"
+        except Exception:
+            return "error"
+
+
+def run_load(wallets: int, rate: float, duration: float, flows: int, mix: list,
+             bank_address: str, merchant_address: str, seed: int = None) -> dict:
+    """
+    Runs flows from `wallets` concurrent wallets until `flows` have started or
+    `duration` seconds have passed. Flows are scheduled at `rate` per second
+    (0: as fast as the wallets go), with kinds drawn from mix.
+    """
+    e, n, n_len = protocol.get_bank_key(bank_address)
+    recorder = Recorder()
+    chooser = random.Random(seed)
+    kinds, weights = zip(*mix)
+    schedule_lock = threading.Lock()
+    started = [0]
+    start = time.perf_counter()
+
+    def next_flow():
+        with schedule_lock:
+            number = started[0]
+            scheduled = start + number / rate if rate > 0 else time.perf_counter()
+            if (flows and number >= flows) or (duration and scheduled - start >= duration):
+                return None
+            started[0] += 1
+            return scheduled, chooser.choices(kinds, weights)[0]
+
+    def wallet_loop(wallet):
+        while True:
+            flow = next_flow()
+            if flow is None:
+                return
+            scheduled, kind = flow
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lag = time.perf_counter() - scheduled
+            recorder.flow(kind, wallet.run(kind), max(0.0, lag))
+
+    threads = [threading.Thread(target=wallet_loop, name="wallet-%d" % number, daemon=True,
+                                args=(Wallet(number, (e, n), n_len, recorder, bank_address, merchant_address),))
+               for number in range(wallets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report = recorder.report(time.perf_counter() - start)
+    report["config"] = {
+        "wallets": wallets,
+        "rate": rate,
+        "duration": duration,
+        "flows": flows,
+        "mix": dict(mix),
+        "bank": bank_address,
+        "merchant": merchant_address,
+    }
+    return report
+
+
+def print_report(report: dict):
+    flows = report["flows"]
+    print("%d flows in %.1f s: %.1f flows/s, start lag p50 %.1f ms, p99 %.1f ms" % (
+        flows["count"], report["elapsed"], flows["throughput"],
+        flows["start_lag_p50"] * 1000, flows["start_lag_p99"] * 1000))
+    for kind, outcomes in sorted(flows["outcomes"].items()):
+        print("  %-18s %s" % (kind, ", ".join("%s=%d" % item for item in sorted(outcomes.items()))))
+    print()
+    print("%-34s %7s %8s %9s %9s %9s %9s  %s" % ("step", "count", "per s", "p50 ms", "p90 ms", "p99 ms", "max ms",
+                                                "outcomes"))
+    for step, stats in sorted(report["steps"].items()):
+        print("%-34s %7d %8.1f %9.2f %9.2f %9.2f %9.2f  %s" % (
+            step, stats["count"], stats["throughput"], stats["p50"] * 1000, stats["p90"] * 1000,
+            stats["p99"] * 1000, stats["max"] * 1000,
+            ", ".join("%s=%d" % item for item in sorted(stats["outcomes"].items()))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive concurrent withdrawal and purchase flows against a bank and merchant.")
+    parser.add_argument("--wallets", type=int, default=8, help="concurrent simulated wallets")
+    parser.add_argument("--rate", type=float, default=0, help="flows started per second (0: as fast as possible)")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to start flows for")
+    parser.add_argument("--flows", type=int, default=0, help="number of flows to run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="flow kinds and weights (default: %s)" % DEFAULT_MIX)
+    parser.add_argument("--bank", default=protocol.BANK_ADDRESS, help="bank address")
+    parser.add_argument("--merchant", default=protocol.MERCHANT_ADDRESS, help="merchant address")
+    parser.add_argument("--seed", type=int, help="seed for the flow kinds")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON to PATH")
+    args = parser.parse_args()
+    if not args.flows and not args.duration:
+        args.flows = 100
+    if "DIGICASH_HTTP_POOL_SIZE" not in os.environ:
+        # keep one connection per wallet alive instead of reconnecting
+        http_client.POOL_SIZE = max(http_client.POOL_SIZE, args.wallets)
+    report = run_load(args.wallets, args.rate, args.duration, args.flows, parse_mix(args.mix),
+                      args.bank, args.merchant, args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
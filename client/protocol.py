@@ -0,0 +1,197 @@
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import uuid
+import datetime
+import hashlib
+from Crypto import Random
+from util import config, http_client, wire
+from util.blind_signatures import validate_signature
+from util.encryption import aes_encrypt_many, _pad, xor_bytes
+from util.token_encoding import token_checksum
+
+# The client side of the withdrawal and purchase protocols, one function per
+# step. client/__main__.py runs them once and saves every intermediate
+# document; client/loadgen.py runs them concurrently from many wallets.
+
+BANK_ADDRESS = config.get_str("DIGICASH_BANK_ADDRESS", "http://localhost:5000")
+MERCHANT_ADDRESS = config.get_str("DIGICASH_MERCHANT_ADDRESS", "http://localhost:5001")
+
+
+class StepFailed(ValueError):
+    """ To be raised when the bank or the merchant refuses a protocol step. """
+
+    def __init__(self, step: str, response):
+        super().__init__("%s failed with %d: %s" % (step, response.status_code, wire.response_text(response)[:200]))
+        self.step = step
+        self.response = response
+
+
+def generateIdentityBatch(identityString: str, tokens: int, quantity: int = 5) -> list:
+    """
+    generateIdentities for `tokens` tokens at once: one (keys, identities)
+    per token. The one-time pads and keys of every share are drawn in a
+    single call, and all the identity strings are XORed with their pads as
+    one buffer.
+    """
+    id_strings = [_pad(bytes("%010d: %s" % (i, identityString), 'utf-8')) for i in range(quantity)]
+    plain = b"".join(id_strings) * tokens
+    pad_length = len(plain)
+    random_bytes = Random.get_random_bytes(pad_length + 32 * quantity * tokens)
+    otps, keys = random_bytes[:pad_length], random_bytes[pad_length:]
+    masked = xor_bytes(otps, plain)
+
+    # split the buffers back into (otp, masked identity, otp key, id key) per share
+    shares, offset = [], 0
+    for index in range(quantity * tokens):
+        length = len(id_strings[index % quantity])
+        shares.append((otps[offset:offset + length], masked[offset:offset + length],
+                       keys[32 * index:32 * index + 16], keys[32 * index + 16:32 * index + 32]))
+        offset += length
+    encrypted = aes_encrypt_many(
+        [data for otp, id_string, _, _ in shares for data in (otp, id_string)],
+        [key for _, _, otp_key, id_key in shares for key in (otp_key, id_key)])
+
+    batch = []
+    for token in range(tokens):
+        token_keys, identities = [], []
+        for index in range(token * quantity, (token + 1) * quantity):
+            otp, id_string, otp_key, id_key = shares[index]
+            token_keys.append((otp_key.hex(), id_key.hex()))
+            identities.append({
+                "identity": (encrypted[2 * index].hex(), encrypted[2 * index + 1].hex()),
+                "checksum": (hashlib.sha256(otp).hexdigest(), hashlib.sha256(id_string).hexdigest())
+            })
+        batch.append((token_keys, identities))
+    return batch
+
+
+def generateIdentities(identityString: str, quantity: int = 5, block_size: int = 32) -> tuple:
+    return generateIdentityBatch(identityString, 1, quantity)[0]
+
+
+def _token(amount: float, id_keys: list, identities: list, verbose: bool) -> dict:
+    token = dict()
+    token["amount"] = amount
+    token["uuid"] = str(uuid.uuid4())
+    token["created_datetime"] = datetime.datetime.now().isoformat()
+    token["identities"] = identities
+
+    checksum = token_checksum(token).hex()
+
+    if verbose:
+        print("Token checksum: %s" % checksum[:16])
+
+    return {
+        "token": token,
+        "checksum": checksum,
+        "identity_keys": id_keys
+    }
+
+
+def generateToken(amount: float, identity: str, verbose: bool = True) -> dict:
+    if verbose:
+        print("Creating Money Order token worth $%.02f \nfor '%s'" % (amount, identity))
+    id_keys, identities = generateIdentities(identity)
+    return _token(amount, id_keys, identities, verbose)
+
+
+def generateTokens(amount: float, identity: str, count: int, verbose: bool = True) -> list:
+    """ `count` tokens of the same amount and identity, with their identities generated as one batch """
+    if verbose:
+        print("Creating %d Money Order tokens worth $%.02f \nfor '%s'" % (count, amount, identity))
+    return [_token(amount, id_keys, identities, verbose)
+            for id_keys, identities in generateIdentityBatch(identity, count)]
+
+
+def blindToken(token: dict, pool, n: int, n_len: int) -> str:
+    """ Blinds the token checksum with a factor from the pool; returns the blinded checksum """
+    k, k_e, k_inv = pool.take()
+    token["key"] = k
+    token["key-inverse"] = k_inv
+
+    M = int.from_bytes(bytes.fromhex(token["checksum"]), 'big')
+    C = (M*k_e) % n
+    return C.to_bytes(n_len, 'big').hex()
+
+
+def get_bank_key(bank_address: str = BANK_ADDRESS) -> tuple:
+    """ Returns the bank's (e, n, modulus length in bytes) """
+    response = http_client.get(bank_address + "/public-key")
+    if not response.ok:
+        raise StepFailed("public-key", response)
+    data = response.json()
+    e = int.from_bytes(bytes.fromhex(data.get("key")), 'big')
+    n = int.from_bytes(bytes.fromhex(data.get("modulus")), 'big')
+    return e, n, data.get("modulus_len")
+
+
+def open_withdrawal(checksums: list, bank_address: str = BANK_ADDRESS) -> tuple:
+    """ Sends the blinded checksums to the bank; returns (checksum the bank will sign, session id) """
+    response = wire.post(bank_address + "/open-request", checksums)
+    if not response.ok:
+        raise StepFailed("open-request", response)
+    data = wire.read_response(response)
+    return data["keep"], data.get("session_id")
+
+
+def unsigned_tokens_request(tokens: dict, keep: str, session_id: str) -> dict:
+    """ The /fill-request body revealing every token but the one the bank signs """
+    return {
+        "session_id": session_id,
+        "tokens": {key: value for key, value in tokens.items() if key != keep}
+    }
+
+
+def fill_withdrawal(unsigned_tokens: dict, bank_address: str = BANK_ADDRESS) -> int:
+    """ Reveals the other tokens to the bank; returns the blind signature """
+    response = wire.post(bank_address + "/fill-request", unsigned_tokens)
+    if not response.ok:
+        raise StepFailed("fill-request", response)
+    return int.from_bytes(bytes.fromhex(wire.read_response(response).get("signature")), 'big')
+
+
+def unblind_token(token: dict, signature: int, key: tuple, n_len: int, bank_address: str = BANK_ADDRESS) -> dict:
+    """ Unblinds and checks the bank signature, turning the kept token into a signed one """
+    e, n = key
+    checksum = int.from_bytes(bytes.fromhex(token["checksum"]), 'big')
+    signature = (signature * token["key-inverse"]) % n
+    validate_signature(checksum, signature, (e, n))
+    token["signature"] = signature.to_bytes(n_len, 'big').hex()
+    token["bank-address"] = bank_address
+
+    # remove these from the token as they are no longer necessary
+    del token["key-inverse"]
+    del token["key"]
+    return token
+
+
+def purchase_token(claim: dict) -> dict:
+    """ The signed token as shown to the merchant, without the identity keys """
+    return {key: value for key, value in claim.items() if key != "identity_keys"}
+
+
+def request_spend(purchase: dict, merchant_address: str = MERCHANT_ADDRESS) -> dict:
+    """ Presents the token to the merchant; returns its session id, bitstring and session mode """
+    response = wire.post(merchant_address + "/request-spend", purchase)
+    if not response.ok:
+        raise StepFailed("request-spend", response)
+    return wire.read_response(response)
+
+
+def fill_spend(claim: dict, purchase: dict, spend: dict, malicious: bool = False,
+               merchant_address: str = MERCHANT_ADDRESS):
+    """ Reveals the identity halves the merchant asked for; returns (merchant response, keys sent) """
+    keys = claim["identity_keys"]
+    purchase_keys = [key[i] for key, i in zip(keys, spend["bitstring"])]
+    url = merchant_address + "/fill-request"
+    if malicious:
+        url += "-malicious"
+    fill_request = {
+        "session_id": spend["session_id"],
+        "keys": purchase_keys
+    }
+    if spend.get("session_mode") == "ticket":
+        # the merchant keeps no session state, hand the claim back
+        fill_request["claim"] = purchase
+    return wire.post(url, fill_request), purchase_keys
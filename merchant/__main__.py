@@ -2,10 +2,19 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from flask import Flask, jsonify, request, Response, abort
+from werkzeug.serving import is_running_from_reloader
 import merchant.merchant_logic as logic
+from merchant import deposit_queue
 from util.custom_exceptions import BadSignature, BadTokenFormat
+from util import metrics, profiling, wire
 # from util.blind_signatures import
 web = Flask('digi-cash-merchant')
+profiling.install(web, "merchant")
+
+# settle deposits left pending by an earlier run now, not on the next
+# purchase; under the debug reloader only the serving process does
+if logic.SETTLEMENT_MODE == "queue" and (__name__ != "__main__" or is_running_from_reloader()):
+    deposit_queue.get_queue()
 
 
 @web.errorhandler(500)
@@ -16,15 +25,32 @@ def unknown_error(e):
         "message": str(e),
     }), 500
 
+
+def _request_body():
+    """ The JSON or binary document in the request; None when it is neither """
+    try:
+        return wire.parse_body(request.get_data(), request.content_type, request.headers.get("Content-Encoding"))
+    except wire.WireFormatError as e:
+        abort(400, str(e))
+
+
+def _respond(payload, status: int = 200):
+    """ Encodes the payload as JSON or binary, as the request's Accept header asks """
+    body, headers = wire.render(payload, request.headers.get("Accept"), request.headers.get("Accept-Encoding"))
+    return Response(body, status=status, headers=headers)
+
+
 @web.route("/request-spend", methods=["POST"])
 def spend_token():
-    if request.is_json:
-        token = request.json
+    token = _request_body()
+    if token is not None:
         try:
             session_id, pattern = logic.redeem_token(token)
-            return jsonify({
+            return _respond({
                 "session_id": session_id,
                 "bitstring": pattern,
+                # "ticket": the claim must be sent back with the keys
+                "session_mode": logic.SESSION_MODE,
                 "status": "accepted"
             })
         except BadSignature as e :
@@ -58,12 +84,12 @@ def spend_token():
 
 @web.route("/fill-request", methods=["POST"])
 def fill_request():
-    if request.is_json:
-        data = request.json
+    data = _request_body()
+    if data is not None:
         session_id = data["session_id"]
         keys = data["keys"]
         try:
-            logic.fill_request(session_id, keys)
+            logic.fill_request(session_id, keys, claim=data.get("claim"))
         except Exception as e:
             print("Unknown error: " + str(e))
             abort(500, "Unknown error: " + str(e))
@@ -71,12 +97,12 @@ def fill_request():
 
 @web.route("/fill-request-malicious", methods=["POST"])
 def fill_request_malicious():
-    if request.is_json:
-        data = request.json
+    data = _request_body()
+    if data is not None:
         session_id = data["session_id"]
         keys = data["keys"]
         try:
-            logic.fill_request(session_id, keys, malicious=True)
+            logic.fill_request(session_id, keys, malicious=True, claim=data.get("claim"))
         except logic.TokenRejected as e:
             return jsonify({
                 "message": "The claim was rejected by the bank.",
@@ -89,5 +115,10 @@ def fill_request_malicious():
     return "something", 200
 
 
+@web.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     web.run(port=5001, debug=True)
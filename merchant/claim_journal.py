@@ -0,0 +1,227 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import json
+import re
+import threading
+import time
+from util import config
+
+# Append-only audit trail of the claims the merchant has verified. Records
+# are compact JSON lines, {"time": <unix time>, "claim": <claim>}, appended to
+# numbered segment files:
+#
+#   merchant/tokens/journal/claims-00000001.jsonl
+#   merchant/tokens/journal/claims-00000002.jsonl
+#   ...
+#
+# Appends are group-committed: while one thread writes and fsyncs a batch,
+# the records appended by other threads collect into the next batch, so one
+# fsync covers every purchase that arrived during the previous one.
+
+_current_dir = os.path.dirname(os.path.realpath(__file__))
+
+JOURNAL_DIR = config.get_str("DIGICASH_CLAIM_JOURNAL_DIR", os.path.join(_current_dir, "tokens", "journal"))
+# bytes after which the journal moves on to a new segment
+SEGMENT_SIZE = config.get_int("DIGICASH_CLAIM_JOURNAL_SEGMENT_SIZE", 64 * 1024 * 1024)
+# fsync every batch; turning this off trades durability for speed
+FSYNC = config.get_bool("DIGICASH_CLAIM_JOURNAL_FSYNC", True)
+
+_segment_name = re.compile(r"^claims-(\d{8})\.jsonl$")
+
+
+def _segment_path(directory: str, number: int) -> str:
+    return os.path.join(directory, "claims-%08d.jsonl" % number)
+
+
+def list_segments(directory: str = JOURNAL_DIR) -> list:
+    """ The segment files of a journal, oldest first """
+    if not os.path.isdir(directory):
+        return []
+    numbers = sorted(int(match.group(1)) for match in map(_segment_name.match, os.listdir(directory)) if match)
+    return [_segment_path(directory, number) for number in numbers]
+
+
+def _fsync_directory(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _complete_length(path: str) -> int:
+    """ Length of a segment up to its last complete record """
+    with open(path, "rb") as segment:
+        end = segment.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 65536)
+            segment.seek(start)
+            newline = segment.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+        return 0
+
+
+class _Batch:
+
+    def __init__(self):
+        self.records = []
+        self.done = False
+        self.error = None
+
+
+class ClaimJournal:
+
+    def __init__(self, directory: str = JOURNAL_DIR, segment_size: int = SEGMENT_SIZE, fsync: bool = FSYNC):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._batch = _Batch()
+        self._committing = False
+        segments = list_segments(directory)
+        self._segment_number = int(_segment_name.match(os.path.basename(segments[-1])).group(1)) if segments else 1
+        self._open_segment()
+        if segments:
+            # drop a record torn by a crash, so new records start on a fresh line
+            length = _complete_length(self._segment_path)
+            if length < self._size:
+                os.ftruncate(self._fd, length)
+                self._size = length
+
+    @property
+    def _segment_path(self) -> str:
+        return _segment_path(self.directory, self._segment_number)
+
+    def _open_segment(self):
+        self._fd = os.open(self._segment_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+
+    def _rotate(self):
+        os.close(self._fd)
+        self._segment_number += 1
+        self._open_segment()
+        if self.fsync:
+            _fsync_directory(self.directory)
+
+    def _write(self, records: list):
+        """ Writes and fsyncs one batch; only the committing thread calls this """
+        if self._size >= self.segment_size:
+            self._rotate()
+        data = b"".join(records)
+        written = 0
+        while written < len(data):
+            written += os.write(self._fd, data[written:])
+        self._size += len(data)
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def append(self, claim: dict):
+        """ Adds the claim to the journal; returns once it is on disk """
+        record = json.dumps({"time": time.time(), "claim": claim}, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            batch = self._batch
+            batch.records.append(record)
+            while not batch.done:
+                if self._committing:
+                    self._committed.wait()
+                    continue
+                # nobody is writing: commit everything collected so far
+                self._committing = True
+                committing, self._batch = self._batch, _Batch()
+                self._lock.release()
+                try:
+                    self._write(committing.records)
+                except Exception as e:
+                    committing.error = e
+                finally:
+                    self._lock.acquire()
+                    self._committing = False
+                    committing.done = True
+                    self._committed.notify_all()
+            if batch.error is not None:
+                raise IOError("Failed to journal the claim: %s" % str(batch.error))
+
+    def close(self):
+        with self._lock:
+            while self._committing:
+                self._committed.wait()
+            os.close(self._fd)
+
+
+class ClaimJournalReader:
+    """ Reads a journal, including the segment still being written """
+
+    def __init__(self, directory: str = JOURNAL_DIR):
+        self.directory = directory
+        # token uuid -> [(segment path, offset)], and how far each segment is indexed
+        self._index = dict()
+        self._indexed = dict()
+
+    def _records(self, path: str, offset: int = 0):
+        """ Yields (offset, end offset, record) for the complete records of a segment """
+        with open(path, "rb") as segment:
+            segment.seek(offset)
+            for line in segment:
+                if not line.endswith(b"\n"):
+                    # torn or still being written
+                    break
+                yield offset, offset + len(line), json.loads(line)
+                offset += len(line)
+
+    def replay(self):
+        """ Yields every record, oldest first """
+        for path in list_segments(self.directory):
+            for _, _, record in self._records(path):
+                yield record
+
+    def _refresh_index(self):
+        for path in list_segments(self.directory):
+            for offset, end, record in self._records(path, self._indexed.get(path, 0)):
+                self._index.setdefault(str(record["claim"]["token"]["uuid"]), []).append((path, offset))
+                self._indexed[path] = end
+
+    def lookup(self, token_uuid: str) -> list:
+        """ Every record of a claim on the token, oldest first """
+        self._refresh_index()
+        records = []
+        for path, offset in self._index.get(str(token_uuid), ()):
+            for _, _, record in self._records(path, offset):
+                records.append(record)
+                break
+        return records
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> ClaimJournal:
+    """ The process-wide journal """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = ClaimJournal()
+        return _journal
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Print the merchant's claim journal.")
+    parser.add_argument("uuid", nargs="?", help="only print the claims on this token")
+    parser.add_argument("--dir", default=JOURNAL_DIR, help="journal directory")
+    args = parser.parse_args()
+    reader = ClaimJournalReader(args.dir)
+    records = reader.lookup(args.uuid) if args.uuid else reader.replay()
+    for record in records:
+        print(json.dumps(record))
@@ -0,0 +1,197 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import json
+import sqlite3
+import threading
+import time
+from util import config, wire
+
+# Durable queue of verified claims waiting to be deposited at the bank.
+# A purchase only has to wait for its claim to be committed here; a
+# background worker sends the queued claims to the bank's /redeem-batch in
+# batches, retrying with exponential backoff while the bank is unreachable.
+# A claim the bank keeps failing with a server error is given up on after
+# MAX_ATTEMPTS and left in the queue as failed.
+
+_current_dir = os.path.dirname(os.path.realpath(__file__))
+
+QUEUE_PATH = config.get_str("DIGICASH_DEPOSIT_QUEUE_PATH", os.path.join(_current_dir, "tokens", "deposits.sqlite3"))
+# most claims sent in one /redeem-batch request
+BATCH_SIZE = config.get_int("DIGICASH_DEPOSIT_BATCH", 500)
+# seconds the worker waits for more claims before sending a partial batch
+FLUSH_INTERVAL = config.get_float("DIGICASH_DEPOSIT_FLUSH_INTERVAL", 2)
+# retry delays: RETRY_BASE * 2^attempts seconds, at most RETRY_MAX
+RETRY_BASE = config.get_float("DIGICASH_DEPOSIT_RETRY_BASE", 1)
+RETRY_MAX = config.get_float("DIGICASH_DEPOSIT_RETRY_MAX", 300)
+# attempts after which a claim the bank answers with a server error is marked failed
+MAX_ATTEMPTS = config.get_int("DIGICASH_DEPOSIT_MAX_ATTEMPTS", 20)
+
+PENDING, SETTLED, REJECTED, FAILED = "pending", "settled", "rejected", "failed"
+
+
+class DepositQueue:
+
+    def __init__(self, path: str = QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # fsync every commit: a queued claim survives a crash
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS deposits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token_uuid TEXT NOT NULL,
+                bank_address TEXT NOT NULL,
+                claim TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                result TEXT
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS deposits_pending ON deposits (status, next_attempt)")
+        # nonces of the purchase session tickets already used, until they expire
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS used_tickets (
+                nonce BLOB PRIMARY KEY,
+                expires INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS used_tickets_expires ON used_tickets (expires)")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+        self._queued = 0
+
+    def enqueue(self, claim: dict) -> int:
+        """ Commits the claim to the queue and returns its deposit id """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO deposits (token_uuid, bank_address, claim, status) VALUES (?, ?, ?, ?)",
+                (str(claim["token"]["uuid"]), claim["bank-address"],
+                 json.dumps(claim, separators=(",", ":")), PENDING))
+            deposit_id = cursor.lastrowid
+            self._queued += 1
+            # a full batch is sent right away, anything less on the next flush
+            if self._queued >= BATCH_SIZE:
+                self._wakeup.set()
+        return deposit_id
+
+    def use_ticket(self, nonce: bytes, expires: int) -> bool:
+        """ Records a session ticket nonce; False if it was already used, by any process sharing the queue """
+        with self._lock:
+            self._db.execute("DELETE FROM used_tickets WHERE expires < ?", (time.time(),))
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO used_tickets (nonce, expires) VALUES (?, ?)", (nonce, expires))
+            return cursor.rowcount == 1
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopped.clear()
+                self._worker = threading.Thread(target=self._run, name="deposit-queue", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout: float = None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM deposits GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (PENDING, SETTLED, REJECTED, FAILED)}
+
+    def _due(self, now: float) -> list:
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, bank_address, claim, attempts FROM deposits "
+                "WHERE status = ? AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (PENDING, now, BATCH_SIZE)).fetchall()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                self._queued = 0
+            try:
+                while not self._stopped.is_set() and self.flush() == BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print("Deposit queue flush failed: %s" % str(e))
+
+    def flush(self) -> int:
+        """ Sends one batch of due claims per bank; returns the number of claims sent """
+        rows = self._due(time.time())
+        by_bank = dict()
+        for row in rows:
+            by_bank.setdefault(row[1], []).append(row)
+        for bank_address, bank_rows in by_bank.items():
+            self._settle(bank_address, bank_rows)
+        return len(rows)
+
+    def _settle(self, bank_address: str, rows: list):
+        claims = [json.loads(claim) for _, _, claim, _ in rows]
+        try:
+            response = wire.post(bank_address + "/redeem-batch", {"claims": claims})
+            if not response.ok:
+                raise IOError("Bank answered %d: %s" % (response.status_code, wire.response_text(response)[:200]))
+            results = wire.read_response(response)["results"]
+            if len(results) != len(rows):
+                raise IOError("Bank returned %d results for %d claims" % (len(results), len(rows)))
+        except Exception as e:
+            print("Deposit of %d claims to %s failed, will retry: %s" % (len(rows), bank_address, str(e)))
+            self._retry(rows)
+            return
+
+        updates, retries = [], []
+        for row, claim, result in zip(rows, claims, results):
+            attempts = row[3]
+            if result.get("status") == "success":
+                updates.append((SETTLED, json.dumps(result), row[0]))
+            elif (result.get("error") == "MerchantSpentAgain" and attempts > 0
+                  and result.get("token") == claim["checksum"]):
+                # an earlier attempt went through, only its response was lost
+                updates.append((SETTLED, json.dumps(result), row[0]))
+            elif result.get("code", 500) >= 500:
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    print("Giving up on deposit %d after %d attempts: %s" % (row[0], attempts + 1, result.get("error")))
+                    updates.append((FAILED, json.dumps(result), row[0]))
+                else:
+                    retries.append(row)
+            else:
+                print("The bank rejected deposit %d: %s" % (row[0], result.get("error")))
+                updates.append((REJECTED, json.dumps(result), row[0]))
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("UPDATE deposits SET status = ?, result = ? WHERE id = ?", updates)
+            self._db.execute("COMMIT")
+        if retries:
+            self._retry(retries)
+
+    def _retry(self, rows: list):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "UPDATE deposits SET attempts = ?, next_attempt = ? WHERE id = ?",
+                [(attempts + 1, now + min(RETRY_MAX, RETRY_BASE * 2 ** attempts), deposit_id)
+                 for deposit_id, _, _, attempts in rows])
+            self._db.execute("COMMIT")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> DepositQueue:
+    """ The process-wide queue, with its worker running """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = DepositQueue()
+        _queue.start()
+        return _queue
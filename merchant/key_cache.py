@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import re
+import threading
+import time
+from util import config, http_client
+
+# seconds a fetched key is trusted when the bank does not send a max-age
+DEFAULT_TTL = config.get_float("DIGICASH_BANK_KEY_TTL", 300)
+# minimum seconds between forced refreshes of one bank's key, so a stream of
+# forged signatures cannot turn into a stream of requests to the bank
+MIN_REFRESH_INTERVAL = config.get_float("DIGICASH_BANK_KEY_MIN_REFRESH", 5)
+
+_max_age_pattern = re.compile(r"max-age=(\d+)")
+
+# bank address -> {"key": (e, n), "etag": str, "expires": float, "fetched": float}
+_keys = dict()
+_lock = threading.Lock()
+
+
+def _ttl(response):
+    match = _max_age_pattern.search(response.headers.get("Cache-Control", ""))
+    if match:
+        return float(match.group(1))
+    return DEFAULT_TTL
+
+
+def get_bank_key(bank_address: str, refresh: bool = False) -> tuple:
+    """
+    Returns the (e, n) public key of the bank at bank_address, from the cache
+    while it is fresh. refresh forces a revalidation with the bank, which is a
+    conditional request answered with 304 when the key did not change.
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _keys.get(bank_address)
+    # an expired key is never served, however recently it was fetched
+    if entry is not None and entry["expires"] > now:
+        if not refresh or now - entry["fetched"] < MIN_REFRESH_INTERVAL:
+            return entry["key"]
+
+    headers = dict()
+    if entry is not None and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    print("Fetching Keys from Bank")
+    response = http_client.get(bank_address + "/public-key", headers=headers)
+    if response.status_code == 304 and entry is not None:
+        key = entry["key"]
+    elif not response.ok:
+        raise IOError("The bank answered %d to /public-key" % response.status_code)
+    else:
+        data = response.json()
+        e = int.from_bytes(bytes.fromhex(data.get("key")), "big")
+        n = int.from_bytes(bytes.fromhex(data.get("modulus")), "big")
+        key = (e, n)
+    with _lock:
+        _keys[bank_address] = {
+            "key": key,
+            "etag": response.headers.get("ETag") or (entry and entry["etag"]),
+            "expires": now + _ttl(response),
+            "fetched": now,
+        }
+    return key
+
+
+def invalidate(bank_address: str = None):
+    with _lock:
+        if bank_address is None:
+            _keys.clear()
+        else:
+            _keys.pop(bank_address, None)
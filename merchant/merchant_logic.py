@@ -1,60 +1,158 @@
 from Crypto.Random import random
 from util.encryption import aes_decrypt
 from util.blind_signatures import validate_checksum, validate_signature
+import hashlib
 import json
 import uuid
-import requests
 import os
 import sys
 import traceback
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-_sessions = dict()
+from util.custom_exceptions import BadSignature
+from util import config, metrics, session_tickets, wire
+from util.token_encoding import validate_token_checksum
+from util.session_store import SessionStore
+from merchant import key_cache, deposit_queue, claim_journal
+
+# open purchases, by session id
+_sessions = SessionStore(
+    ttl=config.get_float("DIGICASH_SESSION_TTL", 300),
+    max_size=config.get_int("DIGICASH_SESSION_MAX", 100000))
+# "memory" keeps sessions in _sessions; "ticket" seals them into the session
+# id (see util.session_tickets) and has the client send the claim back
+SESSION_MODE = config.get_str("DIGICASH_SESSION_MODE", "memory")
+_TICKET_PURPOSE = "merchant/fill-request"
+# "sync" redeems each claim at the bank before answering the purchase;
+# "queue" answers once the claim is in the deposit queue (merchant.deposit_queue)
+SETTLEMENT_MODE = config.get_str("DIGICASH_MERCHANT_SETTLEMENT", "sync")
 
 _current_dir = os.path.dirname(os.path.realpath(__file__))
 
+stage_seconds = metrics.Histogram(
+    "digicash_merchant_stage_seconds", "Time spent in each stage of a merchant operation.", ("operation", "stage"))
+operation_seconds = metrics.Histogram(
+    "digicash_merchant_operation_seconds", "Time spent in a merchant operation.", ("operation",))
+operations = metrics.Counter(
+    "digicash_merchant_operations_total", "Merchant operations, by outcome.", ("operation", "outcome"))
+bank_responses = metrics.Counter(
+    "digicash_merchant_bank_responses_total", "Responses of the bank to /redeem, by status code.", ("code",))
+metrics.session_store_metrics("digicash_merchant", _sessions)
+if SETTLEMENT_MODE == "queue":
+    metrics.CallbackMetric(
+        "digicash_merchant_deposits", "Claims in the deposit queue, by status.",
+        lambda: [((status,), count) for status, count in deposit_queue.get_queue().stats().items()], ("status",))
+
 
 class TokenRejected(ValueError):
     pass
 
 
-def redeem_token(claim):
+class InvalidSession(ValueError):
+    """ To be raised when an unknown or expired session id is provided. """
+    pass
+
+
+def get_bank_key(bank_address, refresh=False):
+    return key_cache.get_bank_key(bank_address, refresh)
+
+
+def validate_bank_signature(bank_address, checksum: int, signature: int):
+    """
+    Validates against the cached bank key. On a mismatch the key is
+    revalidated with the bank once, in case the bank rotated it.
+    """
+    key = get_bank_key(bank_address)
     try:
+        return validate_signature(checksum, signature, key)
+    except BadSignature:
+        refreshed_key = get_bank_key(bank_address, refresh=True)
+        if refreshed_key == key:
+            raise
+        return validate_signature(checksum, signature, refreshed_key)
+
+
+def redeem_token(claim):
+    with metrics.track(operation_seconds, operations, "request_spend"):
         # verify the checksum of the file against its "token" object
         token = claim["token"]
-        token_str = json.dumps(token)
         print("Verifying token...")
         checksum = bytes.fromhex(claim["checksum"])
-        validate_checksum(token_str, checksum)
+        with stage_seconds.time("request_spend", "verify_checksum"):
+            validate_token_checksum(token, checksum)
         print("Validated Checksum.")
-        print("Fetching Keys from Bank")
-        response = requests.get(claim["bank-address"] + "/public-key")
-        data = response.json()
-        e = int.from_bytes(bytes.fromhex(data.get("key")), "big")
-        n = int.from_bytes(bytes.fromhex(data.get("modulus")), "big")
         print("Validating Bank Signature...")
         checksum = int.from_bytes(checksum, "big")
         signature = int.from_bytes(
             bytes.fromhex(claim.get("signature")), "big")
-        validate_signature(checksum, signature, (e, n))
+        with stage_seconds.time("request_spend", "verify_signature"):
+            validate_bank_signature(claim["bank-address"], checksum, signature)
         print("Signature Good.")
 
-        session_id = str(uuid.uuid4())
-        print("Establishing Session: %s" % session_id)
         pattern = list(random.choice([0, 1])
                        for identity in token["identities"])
+        with stage_seconds.time("request_spend", "open_session"):
+            if SESSION_MODE == "ticket":
+                session_id = session_tickets.seal(
+                    {"claim": _claim_digest(claim), "pattern": pattern}, _TICKET_PURPOSE, _sessions.ttl)
+            else:
+                session_id = str(uuid.uuid4())
+                _sessions.put(session_id, (claim, pattern))
+        print("Establishing Session: %s" % session_id[:36])
         print("Requesting keys for from Client: \n" + str(pattern))
-        _sessions[session_id] = claim, pattern
         return session_id, pattern
+
+
+def _claim_digest(claim):
+    """ Binds a ticket to the claim whose signature was checked when it was issued """
+    return hashlib.sha256(("%s|%s|%s" % (
+        claim["checksum"], claim["signature"], claim["bank-address"])).encode("utf-8")).hexdigest()
+
+
+def _close_session(session_id, claim=None):
+    """
+    Returns the (claim, pattern) of an open purchase. In ticket mode the
+    client sends the claim back with the keys, and it must be the one the
+    ticket was issued for.
+    """
+    if SESSION_MODE == "ticket":
+        # with queue settlement the bank only sees a replayed purchase after it was
+        # accepted, so the queue database, shared by every merchant process,
+        # records each used ticket
+        used_tickets = deposit_queue.get_queue() if SETTLEMENT_MODE == "queue" else None
+        try:
+            session = session_tickets.open_ticket(session_id, _TICKET_PURPOSE, used_tickets=used_tickets)
+        except (session_tickets.InvalidTicket, TypeError):
+            raise InvalidSession("Invalid session token")
+        if claim is None:
+            raise InvalidSession("The claim must be sent back with the keys")
+        if session["claim"] != _claim_digest(claim):
+            raise InvalidSession("The claim does not match the session")
+        # the checksum was signed, now make sure the token still matches it
+        validate_token_checksum(claim["token"], bytes.fromhex(claim["checksum"]))
+        return claim, session["pattern"]
+    session = _sessions.pop(session_id)
+    if session is None:
+        raise InvalidSession("Invalid session token")
+    return session
+
+
+def fill_request(session_id, keys, malicious=False, claim=None):
+    try:
+        with metrics.track(operation_seconds, operations, "fill_request"):
+            _fill_request(session_id, keys, malicious, claim)
     except Exception as e:
+        print(e.__class__.__name__)
+        print(e)
         raise e
+    return True
 
 
-def fill_request(session_id, keys, malicious=False):
-    try:
-        claim, pattern = _sessions[session_id]
-        del _sessions[session_id]
-        identities = claim["token"]["identities"]
-        decrypted_identities = []
+def _fill_request(session_id, keys, malicious, claim):
+    with stage_seconds.time("fill_request", "session"):
+        claim, pattern = _close_session(session_id, claim)
+    identities = claim["token"]["identities"]
+    decrypted_identities = []
+    with stage_seconds.time("fill_request", "verify_identities"):
         for index, (key, id_obj, toggle) in enumerate(zip(keys, identities, pattern)):
             print("Decrypting %s half of identity %d..." % (("left", "right")[toggle], index))
             enc_identity = bytes.fromhex(id_obj["identity"][toggle])
@@ -67,22 +165,25 @@ def fill_request(session_id, keys, malicious=False):
             # print("Validated %d" % index)
             print("Identity %d is valid." % index)
             decrypted_identities.append(dec_identity.hex())
-        claim["revealed-identities"] = decrypted_identities
-        claim["identity-pattern"] = pattern
-        with open(os.path.join(_current_dir, "tokens", "revealed_token.json"), "w+") as token_output:
-            json.dump(claim, token_output, indent=4)
-        response = requests.post(claim["bank-address"] + "/redeem", json=claim)
-        print(response.text)
-        if malicious:
-            # try to redeem again
-            response = requests.post(claim["bank-address"] + "/redeem", json=claim)
-            print("Second response: \n%s" % response.text)
-        
-        if not response.ok:
-            raise TokenRejected(response.json()["message"])
+    claim["revealed-identities"] = decrypted_identities
+    claim["identity-pattern"] = pattern
+    with stage_seconds.time("fill_request", "journal"):
+        claim_journal.get_journal().append(claim)
+    if SETTLEMENT_MODE == "queue" and not malicious:
+        # the claim is verified and durably queued, the bank settles it later
+        with stage_seconds.time("fill_request", "enqueue_deposit"):
+            deposit_id = deposit_queue.get_queue().enqueue(claim)
+        print("Queued deposit %d for settlement" % deposit_id)
+        return
+    with stage_seconds.time("fill_request", "bank_redeem"):
+        response = wire.post(claim["bank-address"] + "/redeem", claim)
+    bank_responses.inc(str(response.status_code))
+    print(wire.response_text(response))
+    if malicious:
+        # try to redeem again
+        response = wire.post(claim["bank-address"] + "/redeem", claim)
+        bank_responses.inc(str(response.status_code))
+        print("Second response: \n%s" % wire.response_text(response))
 
-    except Exception as e:
-        print(e.__class__.__name__)
-        print(e)
-        raise e
-    return True
+    if not response.ok:
+        raise TokenRejected(wire.read_response(response)["message"])
@@ -0,0 +1,69 @@
+import contextlib
+import io
+import random
+from util.blind_signatures import sign, compute_crt_parameters
+from util.encryption import aes_decrypt
+
+# Shared fixtures for the tests: a small bank keychain, generated once, and
+# signed claims built the way the client and merchant build them.
+
+_keychain = None
+
+
+@contextlib.contextmanager
+def quiet():
+    """ Keeps the progress the modules print out of the test output """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def keychain() -> dict:
+    """ A 1024-bit keychain with e = 65537, shared by every test """
+    global _keychain
+    if _keychain is None:
+        from bank import keystore
+        with quiet():
+            _keychain = keystore.create_keychain("test", public_exponent=65537)
+    return _keychain
+
+
+def use_bank_keychain() -> dict:
+    """ Makes the test keychain the bank's, with an empty ledger """
+    import bank.data as data
+    data.use_keychain(keychain())
+    with data.ledger_lock:
+        data.redeemed_tokens.clear()
+    return keychain()
+
+
+def new_token(identity: str = "Test Wallet | #000000001", amount: float = 1000) -> dict:
+    """ An unsigned client token, with its identity keys """
+    from client import protocol
+    return protocol.generateToken(amount, identity, verbose=False)
+
+
+def signature(checksum: str, keys: dict = None) -> str:
+    keys = keys or keychain()
+    crt_key = (keys["p"], keys["q"]) + compute_crt_parameters(keys["d"], keys["p"], keys["q"])
+    n_len = (keys["n"].bit_length() + 7) // 8
+    signed = sign(int.from_bytes(bytes.fromhex(checksum), "big"), (keys["e"], keys["n"]), crt_key)
+    return signed.to_bytes(n_len, "big").hex()
+
+
+def revealed_claim(token: dict, pattern: list = None, keys: dict = None) -> dict:
+    """
+    The claim a merchant sends to /redeem for a token: signed by the bank,
+    with the identity halves chosen by pattern revealed.
+    """
+    from client import protocol
+    identities = token["token"]["identities"]
+    if pattern is None:
+        pattern = [random.randint(0, 1) for _ in identities]
+    claim = protocol.purchase_token(token)
+    claim["signature"] = signature(token["checksum"], keys)
+    claim["bank-address"] = "http://localhost:5000"
+    claim["revealed-identities"] = [
+        aes_decrypt(bytes.fromhex(identity["identity"][toggle]), bytes.fromhex(token_keys[toggle])).hex()
+        for identity, token_keys, toggle in zip(identities, token["identity_keys"], pattern)]
+    claim["identity-pattern"] = pattern
+    return claim
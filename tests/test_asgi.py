@@ -0,0 +1,165 @@
+import asyncio
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from tests import support
+import bank.asgi as asgi
+import bank.handlers as handlers
+from util import wire
+
+
+def _call(method: str, path: str, body: bytes = b"", headers: dict = None, chunk_size: int = None):
+    """ Runs one request through the ASGI app; returns (status, headers, body) """
+    chunk_size = chunk_size or max(1, len(body))
+    chunks = [body[start:start + chunk_size] for start in range(0, len(body), chunk_size)] or [b""]
+    messages = [{"type": "http.request", "body": chunk, "more_body": index < len(chunks) - 1}
+                for index, chunk in enumerate(chunks)]
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()],
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    response_headers = dict((name.decode("latin-1"), value.decode("latin-1")) for name, value in sent[0]["headers"])
+    return sent[0]["status"], response_headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def _post(path: str, document, headers: dict = None):
+    status, _, body = _call("POST", path, json.dumps(document).encode("utf-8"),
+                            dict({"Content-Type": "application/json"}, **(headers or {})))
+    return status, json.loads(body)
+
+
+class AsgiAppTest(unittest.TestCase):
+
+    def setUp(self):
+        support.use_bank_keychain()
+        # the semaphore is bound to the event loop it is first used on
+        patch = mock.patch.object(asgi, "_semaphore", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_routes_match_the_flask_app(self):
+        from bank.__main__ import web
+        flask_routes = {rule.rule: web.view_functions[rule.endpoint] for rule in web.url_map.iter_rules()
+                        if "POST" in rule.methods}
+        self.assertEqual(set(asgi._post_routes), set(flask_routes))
+        self.assertEqual(asgi._post_routes, {
+            "/redeem": handlers.redeem,
+            "/redeem-batch": handlers.redeem_batch,
+            "/open-request": handlers.open_request,
+            "/fill-request": handlers.fill_request,
+        })
+
+    def test_post_routes_answer_as_the_handlers(self):
+        unsigned = support.revealed_claim(support.new_token())
+        unsigned["signature"] = "00" * 128
+        documents = {
+            "/redeem": unsigned,
+            "/redeem-batch": {"claims": [unsigned, {"token": {}}]},
+            "/fill-request": {"session_id": "unknown", "tokens": {}},
+        }
+        with support.quiet():
+            for path, document in documents.items():
+                payload, status = asgi._post_routes[path](json.loads(json.dumps(document)))
+                self.assertEqual(_post(path, document), (status, payload), path)
+            status, payload = _post("/open-request", [support.new_token()["checksum"] for _ in range(3)])
+        self.assertEqual(status, 200)
+        self.assertEqual(set(payload), {"keep", "session_id", "status"})
+
+    def test_redeem(self):
+        claim = support.revealed_claim(support.new_token())
+        with support.quiet():
+            self.assertEqual(_post("/redeem", claim), (200, {"token": claim["checksum"], "status": "success"}))
+            status, payload = _post("/redeem", claim)
+        self.assertEqual(status, 403)
+        # a body that is not JSON
+        status, _, body = _call("POST", "/redeem", b"token", {"Content-Type": "text/plain"})
+        self.assertEqual((status, json.loads(body)), handlers.redeem(None)[::-1])
+
+    def test_not_found_and_method_not_allowed(self):
+        self.assertEqual(_call("GET", "/nowhere")[0], 404)
+        self.assertEqual(_call("POST", "/public-key")[0], 404)
+        status, _, body = _call("GET", "/redeem")
+        self.assertEqual(status, 405)
+        self.assertIn("GET", json.loads(body)["message"])
+
+    def test_body_too_large(self):
+        with mock.patch.object(asgi, "MAX_BODY_SIZE", 100):
+            status, _, body = _call("POST", "/redeem", b"x" * 101, {"Content-Type": "application/json"}, chunk_size=40)
+            self.assertEqual(status, 413)
+            status, _, body = _call("POST", "/redeem", b"[" * 100, {"Content-Type": "application/json"}, chunk_size=40)
+            self.assertEqual(status, 400)
+
+    def test_public_key_revalidation(self):
+        status, headers, body = _call("GET", "/public-key")
+        self.assertEqual(status, 200)
+        self.assertEqual(int(json.loads(body)["modulus"], 16), support.keychain()["n"])
+        etag = headers["etag"]
+        self.assertIn("max-age=%d" % handlers.PUBLIC_KEY_MAX_AGE, headers["cache-control"])
+        for if_none_match in (etag, "W/" + etag, '"other", ' + etag, "*"):
+            status, headers, body = _call("GET", "/public-key", headers={"If-None-Match": if_none_match})
+            self.assertEqual((status, body), (304, b""), if_none_match)
+            self.assertEqual(headers["etag"], etag)
+        self.assertEqual(_call("GET", "/public-key", headers={"If-None-Match": '"other"'})[0], 200)
+
+    def test_binary_and_json_negotiation(self):
+        document = {"claims": []}
+        binary = {"Content-Type": wire.BINARY_TYPE, "Accept": wire.BINARY_TYPE}
+        status, headers, body = _call("POST", "/redeem-batch", wire.encode(document), binary)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], wire.BINARY_TYPE)
+        self.assertEqual(wire.decode(body), handlers.redeem_batch(document)[0])
+        # a binary request answered in JSON, and a JSON request answered in binary
+        status, headers, body = _call("POST", "/redeem-batch", wire.encode(document), {"Content-Type": wire.BINARY_TYPE})
+        self.assertEqual((status, headers["content-type"]), (200, wire.JSON_TYPE))
+        self.assertEqual(json.loads(body), handlers.redeem_batch(document)[0])
+        status, headers, body = _call("POST", "/redeem-batch", json.dumps(document).encode("utf-8"),
+                                      {"Content-Type": "application/json", "Accept": wire.BINARY_TYPE})
+        self.assertEqual(wire.decode(body), handlers.redeem_batch(document)[0])
+
+    def test_malformed_binary_body(self):
+        status, headers, body = _call("POST", "/redeem-batch", wire.encode({"claims": []})[:-1],
+                                      {"Content-Type": wire.BINARY_TYPE})
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)["status"], "Error 400: Malformed request.")
+
+
+class AsgiLifespanTest(unittest.TestCase):
+
+    def _lifespan(self) -> list:
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        with mock.patch.object(asgi, "_executor", ThreadPoolExecutor(max_workers=1)):
+            asyncio.run(asgi.app({"type": "lifespan"}, receive, send))
+        return [message["type"] for message in sent]
+
+    def test_startup_loads_the_keychain(self):
+        with mock.patch.object(asgi.data, "load_keychain") as load_keychain:
+            self.assertEqual(self._lifespan(), ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        load_keychain.assert_called_once_with()
+
+    def test_startup_fails_without_a_keychain(self):
+        with mock.patch.object(asgi.data, "load_keychain", side_effect=ValueError("corrupted")):
+            self.assertEqual(self._lifespan(), ["lifespan.startup.failed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
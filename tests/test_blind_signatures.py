@@ -0,0 +1,147 @@
+import random
+import unittest
+from tests import support
+from util import blind_signatures
+from util.blind_signatures import batch_modulo_multiplicative_inverse, compute_crt_parameters, find_bad_signatures, \
+    jacobi, modulo_multiplicative_inverse, sign, validate_signatures
+from util.custom_exceptions import BadSignature, SigningFault
+from util.primes import generate_prime
+
+_keys = dict()
+
+
+def _key(minus_one_symbol: int) -> tuple:
+    """
+    (e, d, n) with a 512-bit random e and (-1/n) == minus_one_symbol:
+    p = 3 mod 4 and q = 1 mod 4 give -1, both 3 mod 4 give 1.
+    """
+    if minus_one_symbol not in _keys:
+        residues = (3, 1) if minus_one_symbol == -1 else (3, 3)
+        factors = []
+        for residue in residues:
+            prime = generate_prime(512, workers=1)
+            while prime % 4 != residue or prime in factors:
+                prime = generate_prime(512, workers=1)
+            factors.append(prime)
+        p, q = factors
+        phi = (p - 1) * (q - 1)
+        e = generate_prime(512, workers=1)
+        while blind_signatures.gcd(e, phi) != 1:
+            e = generate_prime(512, workers=1)
+        _keys[minus_one_symbol] = e, modulo_multiplicative_inverse(e, phi), p * q
+    return _keys[minus_one_symbol]
+
+
+def _pairs(key: tuple, count: int) -> list:
+    e, d, n = key
+    checksums = [random.getrandbits(256) for _ in range(count)]
+    return [(checksum, pow(checksum, d, n)) for checksum in checksums]
+
+
+def _one_by_one(pairs: list, key: tuple) -> list:
+    e, d, n = key
+    return [index for index, (checksum, signature) in enumerate(pairs) if pow(signature, e, n) != checksum]
+
+
+class JacobiTest(unittest.TestCase):
+
+    def test_matches_euler_criterion(self):
+        for prime in (3, 5, 7, 11, 13, 101, 65537):
+            for a in range(0, min(prime, 300)):
+                euler = pow(a, (prime - 1) // 2, prime)
+                self.assertEqual(jacobi(a, prime), -1 if euler == prime - 1 else euler)
+
+    def test_multiplicative_in_n(self):
+        for a in range(1, 200):
+            self.assertEqual(jacobi(a, 7 * 11), jacobi(a, 7) * jacobi(a, 11))
+
+
+class BatchVerificationTest(unittest.TestCase):
+
+    def _check(self, pairs: list, key: tuple, expected: list):
+        e, d, n = key
+        self.assertEqual(find_bad_signatures(pairs, (e, n)), expected)
+        self.assertEqual(_one_by_one(pairs, key), expected)
+
+    def test_good_batch(self):
+        for symbol in (-1, 1):
+            key = _key(symbol)
+            self._check(_pairs(key, 10), key, [])
+
+    def test_bad_signatures_are_found(self):
+        key = _key(-1)
+        pairs = _pairs(key, 10)
+        pairs[3] = (pairs[3][0], pairs[3][1] + 1)
+        pairs[7] = (pairs[7][0] + 1, pairs[7][1])
+        self._check(pairs, key, [3, 7])
+
+    def test_flipped_signatures_do_not_cancel_out(self):
+        for symbol in (-1, 1):
+            key = _key(symbol)
+            n = key[2]
+            pairs = _pairs(key, 6)
+            for index in (1, 4):
+                pairs[index] = (pairs[index][0], n - pairs[index][1])
+            self._check(pairs, key, [1, 4])
+            # a single flip, and every signature flipped
+            self._check([pairs[1]] + _pairs(key, 3), key, [0])
+            self._check([(checksum, n - signature) for checksum, signature in _pairs(key, 4)], key, [0, 1, 2, 3])
+
+    def test_checksum_outside_the_modulus(self):
+        key = _key(-1)
+        n = key[2]
+        pairs = _pairs(key, 4)
+        pairs[2] = (pairs[2][0] + n, pairs[2][1])
+        self._check(pairs, key, [2])
+
+    def test_small_exponent(self):
+        keys = support.keychain()
+        key = (keys["e"], keys["d"], keys["n"])
+        pairs = _pairs(key, 5)
+        pairs[0] = (pairs[0][0], keys["n"] - pairs[0][1])
+        self._check(pairs, key, [0])
+
+    def test_validate_signatures(self):
+        e, d, n = key = _key(-1)
+        pairs = _pairs(key, 3)
+        self.assertTrue(validate_signatures(pairs, (e, n)))
+        with self.assertRaises(BadSignature):
+            validate_signatures(pairs + [(1, 2)], (e, n))
+        self.assertEqual(find_bad_signatures([], (e, n)), [])
+
+
+class CrtSigningTest(unittest.TestCase):
+
+    def setUp(self):
+        keys = support.keychain()
+        self.key = (keys["e"], keys["n"])
+        self.d = keys["d"]
+        self.crt_key = (keys["p"], keys["q"]) + compute_crt_parameters(keys["d"], keys["p"], keys["q"])
+
+    def test_matches_plain_signature(self):
+        for _ in range(5):
+            message = random.getrandbits(256)
+            self.assertEqual(sign(message, self.key, self.crt_key), pow(message, self.d, self.key[1]))
+
+    def test_faulty_signature_is_not_released(self):
+        p, q, dp, dq, q_inv = self.crt_key
+        with self.assertRaises(SigningFault):
+            sign(random.getrandbits(256), self.key, (p, q, dp + 1, dq, q_inv))
+
+
+class BatchInverseTest(unittest.TestCase):
+
+    def test_matches_single_inverses(self):
+        modulus = support.keychain()["n"]
+        values = [random.getrandbits(1024) % modulus for _ in range(20)]
+        self.assertEqual(batch_modulo_multiplicative_inverse(values, modulus),
+                         [modulo_multiplicative_inverse(value, modulus) for value in values])
+
+    def test_values_without_inverse(self):
+        self.assertEqual(batch_modulo_multiplicative_inverse([3, 0, 6, 5, 15, 7], 15), [None, None, None, None, None, 13])
+        self.assertEqual(batch_modulo_multiplicative_inverse([], 15), [])
+        self.assertEqual(batch_modulo_multiplicative_inverse([4, 5], 10), [None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+import unittest
+from merchant.claim_journal import ClaimJournal, ClaimJournalReader, list_segments
+
+
+def _claim(token_uuid: str, number: int = 0) -> dict:
+    return {"token": {"uuid": token_uuid}, "number": number}
+
+
+class ClaimJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _journal(self, **kwargs) -> ClaimJournal:
+        journal = ClaimJournal(self.directory, fsync=False, **kwargs)
+        self.addCleanup(journal.close)
+        return journal
+
+    def _replayed(self) -> list:
+        return [record["claim"] for record in ClaimJournalReader(self.directory).replay()]
+
+    def test_replay_and_lookup(self):
+        journal = self._journal()
+        claims = [_claim("a", 0), _claim("b", 1), _claim("a", 2)]
+        for claim in claims:
+            journal.append(claim)
+        self.assertEqual(self._replayed(), claims)
+        reader = ClaimJournalReader(self.directory)
+        self.assertEqual([record["claim"] for record in reader.lookup("a")], [claims[0], claims[2]])
+        self.assertEqual(reader.lookup("c"), [])
+        # the index picks up records appended after the first lookup
+        journal.append(_claim("c", 3))
+        self.assertEqual([record["claim"] for record in reader.lookup("c")], [_claim("c", 3)])
+
+    def test_concurrent_appends_are_all_recorded(self):
+        journal = self._journal()
+        threads = [threading.Thread(target=journal.append, args=(_claim("t%d" % number, number),)) for number in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claim["number"] for claim in self._replayed()), list(range(20)))
+
+    def test_rotates_segments(self):
+        journal = ClaimJournal(self.directory, segment_size=100, fsync=False)
+        for number in range(5):
+            journal.append(_claim("r", number))
+        self.assertGreater(len(list_segments(self.directory)), 1)
+        self.assertEqual([claim["number"] for claim in self._replayed()], list(range(5)))
+        journal.close()
+        # reopening continues the last segment
+        reopened = self._journal(segment_size=100)
+        reopened.append(_claim("r", 5))
+        self.assertEqual([claim["number"] for claim in self._replayed()], list(range(6)))
+
+    def test_torn_tail_is_dropped_on_open(self):
+        journal = ClaimJournal(self.directory, fsync=False)
+        journal.append(_claim("a", 0))
+        journal.close()
+        with open(list_segments(self.directory)[-1], "ab") as segment:
+            segment.write(b'{"time":1,"claim":{"tok')
+        self.assertEqual(self._replayed(), [_claim("a", 0)])
+        self._journal().append(_claim("b", 1))
+        self.assertEqual(self._replayed(), [_claim("a", 0), _claim("b", 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
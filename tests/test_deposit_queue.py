@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from tests import support
+from merchant import deposit_queue
+from merchant.deposit_queue import DepositQueue, PENDING, SETTLED, REJECTED, FAILED
+
+
+class FakeResponse:
+    """ Just enough of a requests.Response for wire.read_response """
+
+    def __init__(self, document, status_code: int = 200):
+        self.document = document
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {"Content-Type": "application/json"}
+        self.text = json.dumps(document)
+
+    def json(self):
+        return self.document
+
+
+class DepositQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        import bank.handlers as handlers
+        self.handlers = handlers
+        support.use_bank_keychain()
+        self.directory = tempfile.mkdtemp()
+        self.queue = DepositQueue(os.path.join(self.directory, "deposits.sqlite3"))
+        # every attempt is due right away
+        self.patches = [mock.patch.object(deposit_queue, "RETRY_BASE", 0)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.queue._db.close()
+        shutil.rmtree(self.directory)
+
+    def _bank(self, url, document):
+        with support.quiet():
+            payload, status = self.handlers.redeem_batch(document)
+        return FakeResponse(payload, status)
+
+    def _statuses(self) -> list:
+        return [status for status, in self.queue._db.execute("SELECT status FROM deposits ORDER BY id")]
+
+    def _flush(self, post):
+        with mock.patch.object(deposit_queue.wire, "post", side_effect=post), support.quiet():
+            return self.queue.flush()
+
+    def test_settles_and_rejects(self):
+        claim = support.revealed_claim(support.new_token())
+        bad = support.revealed_claim(support.new_token())
+        bad["signature"] = claim["signature"]
+        for queued in (claim, bad):
+            self.queue.enqueue(queued)
+        self.assertEqual(self._flush(self._bank), 2)
+        self.assertEqual(self._statuses(), [SETTLED, REJECTED])
+        self.assertEqual(self.queue.stats(), {PENDING: 0, SETTLED: 1, REJECTED: 1, FAILED: 0})
+
+    def test_retry_after_lost_response_is_settled(self):
+        claim = support.revealed_claim(support.new_token())
+        self.queue.enqueue(claim)
+
+        def lost_response(url, document):
+            self._bank(url, document)
+            raise IOError("Read timed out")
+        self._flush(lost_response)
+        self.assertEqual(self._statuses(), [PENDING])
+        self._flush(self._bank)
+        self.assertEqual(self._statuses(), [SETTLED])
+
+    def test_replayed_claim_is_still_rejected(self):
+        claim = support.revealed_claim(support.new_token())
+        self._bank(None, {"claims": [claim]})
+        self.queue.enqueue(claim)
+        self._flush(self._bank)
+        self.assertEqual(self._statuses(), [REJECTED])
+
+    def test_server_errors_give_up_after_max_attempts(self):
+        self.queue.enqueue(support.revealed_claim(support.new_token()))
+        failing = lambda url, document: FakeResponse({"status": "success", "results": [
+            {"status": "rejected", "error": "RuntimeError", "code": 500}]})
+        with mock.patch.object(deposit_queue, "MAX_ATTEMPTS", 3):
+            for _ in range(2):
+                self._flush(failing)
+                self.assertEqual(self._statuses(), [PENDING])
+            self._flush(failing)
+        self.assertEqual(self._statuses(), [FAILED])
+        self.assertEqual(self._flush(failing), 0)
+
+    def test_unreachable_bank_keeps_retrying(self):
+        self.queue.enqueue(support.revealed_claim(support.new_token()))
+
+        def unreachable(url, document):
+            raise IOError("Connection refused")
+        with mock.patch.object(deposit_queue, "MAX_ATTEMPTS", 2):
+            for _ in range(3):
+                self._flush(unreachable)
+        self.assertEqual(self._statuses(), [PENDING])
+        self._flush(self._bank)
+        self.assertEqual(self._statuses(), [SETTLED])
+
+    def test_pending_deposits_survive_a_restart(self):
+        self.queue.enqueue(support.revealed_claim(support.new_token()))
+        self.queue._db.close()
+        self.queue = DepositQueue(self.queue.path)
+        self.assertEqual(self.queue.stats()[PENDING], 1)
+        self._flush(self._bank)
+        self.assertEqual(self._statuses(), [SETTLED])
+
+
+if __name__ == "__main__":
+    unittest.main()
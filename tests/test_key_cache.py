@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+from tests import support
+from merchant import key_cache
+
+BANK = "http://bank.test"
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, document: dict = None, etag: str = "\"v1\"", max_age: int = 60):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.document = document
+        self.headers = {"ETag": etag, "Cache-Control": "public, max-age=%d" % max_age}
+
+    def json(self):
+        return self.document
+
+
+class KeyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        key_cache.invalidate()
+        self.addCleanup(key_cache.invalidate)
+        keys = support.keychain()
+        self.key = (keys["e"], keys["n"])
+        self.document = {"key": keys["e"].to_bytes(64, "big").hex(), "modulus": keys["n"].to_bytes(128, "big").hex()}
+        self.now = 1000.0
+        self.requests = []
+        self.responses = []
+        patches = [
+            mock.patch.object(key_cache.time, "monotonic", lambda: self.now),
+            mock.patch.object(key_cache.http_client, "get", self._get),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _get(self, url, headers=None):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+    def _fetch(self, refresh=False):
+        with support.quiet():
+            return key_cache.get_bank_key(BANK, refresh)
+
+    def test_cached_while_fresh(self):
+        self.responses = [FakeResponse(200, self.document)]
+        self.assertEqual(self._fetch(), self.key)
+        self.now += 59
+        self.assertEqual(self._fetch(), self.key)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_revalidated_once_expired(self):
+        self.responses = [FakeResponse(200, self.document), FakeResponse(304)]
+        self._fetch()
+        self.now += 61
+        self.assertEqual(self._fetch(), self.key)
+        self.assertEqual(self.requests[1], {"If-None-Match": "\"v1\""})
+
+    def test_forced_refresh_is_rate_limited(self):
+        self.responses = [FakeResponse(200, self.document), FakeResponse(304)]
+        self._fetch()
+        self.now += 1
+        self._fetch(refresh=True)
+        self.assertEqual(len(self.requests), 1)
+        self.now += key_cache.MIN_REFRESH_INTERVAL
+        self._fetch(refresh=True)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_expired_key_is_not_served_within_refresh_interval(self):
+        self.responses = [FakeResponse(200, self.document, max_age=1), FakeResponse(500, {})]
+        self._fetch()
+        self.now += 2
+        with self.assertRaises(IOError):
+            self._fetch(refresh=True)
+        self.assertEqual(len(self.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
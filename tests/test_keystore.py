@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from tests import support
+import bank.data as data
+from bank import keystore
+from bank.keystore import KeychainCorrupted
+
+_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class KeystoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "keys", "bank_keychain.json")
+        self.keychain = support.keychain()
+
+    def _save_changed(self, **fields):
+        keystore.save_keychain(dict(self.keychain, **fields), self.path)
+
+    def test_round_trip(self):
+        self.assertEqual(keystore.save_keychain(self.keychain, self.path), self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(keystore.load_keychain(self.path), {field: self.keychain[field] for field in "ednpq"})
+        self.assertEqual(keystore.load_or_create_keychain(self.path)["n"], self.keychain["n"])
+
+    def test_modulus_not_matching_factors(self):
+        self._save_changed(n=self.keychain["n"] + 2)
+        with self.assertRaises(KeychainCorrupted):
+            keystore.load_keychain(self.path)
+
+    def test_exponents_not_matching(self):
+        self._save_changed(d=self.keychain["d"] + 2)
+        with self.assertRaises(KeychainCorrupted):
+            keystore.load_keychain(self.path)
+
+    def test_unreadable_file(self):
+        keystore.save_keychain(self.keychain, self.path)
+        with open(self.path) as key_file:
+            stored = json.load(key_file)
+        for broken in (dict(stored, d="not hex"), {"e": stored["e"]}):
+            with open(self.path, "w") as key_file:
+                json.dump(broken, key_file)
+            with self.assertRaises(KeychainCorrupted):
+                keystore.load_keychain(self.path)
+
+    def test_cli_refuses_to_overwrite(self):
+        keystore.save_keychain(self.keychain, self.path)
+        with open(self.path) as key_file:
+            before = key_file.read()
+        result = subprocess.run([sys.executable, "-m", "bank.keystore", self.path],
+                                cwd=_root, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("--force", result.stdout)
+        with open(self.path) as key_file:
+            self.assertEqual(key_file.read(), before)
+
+
+class BankKeychainTest(unittest.TestCase):
+
+    def setUp(self):
+        previous = data._keychain
+        self.addCleanup(setattr, data, "_keychain", previous)
+        data._keychain = None
+
+    def test_concurrent_first_use_creates_one_keychain(self):
+        calls = []
+
+        def load_or_create_keychain():
+            calls.append(threading.get_ident())
+            time.sleep(0.05)
+            return support.keychain()
+
+        moduli = []
+        with mock.patch.object(keystore, "load_or_create_keychain", load_or_create_keychain):
+            threads = [threading.Thread(target=lambda: moduli.append(data.get_public_modulus())) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(moduli, [support.keychain()["n"]] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+from tests import support
+from util import blind_signatures, primes
+from util.primes import SMALL_PRIMES, generate_primes, is_prime, sieve_window, random_odd
+
+
+class PrimesTest(unittest.TestCase):
+
+    def test_is_prime(self):
+        self.assertEqual([n for n in range(60) if is_prime(n)],
+                         [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59])
+        # Carmichael numbers and a known large prime
+        for n in (561, 41041, 825265):
+            self.assertFalse(is_prime(n))
+        self.assertTrue(is_prime(2 ** 127 - 1))
+
+    def test_sieve_window(self):
+        start = random_odd(256)
+        offsets = set(sieve_window(start, 512))
+        for offset in range(512):
+            candidate = start + 2 * offset
+            self.assertEqual(offset in offsets, all(candidate % prime for prime in SMALL_PRIMES))
+
+    def test_generate_primes(self):
+        for workers in (1, 2):
+            found = generate_primes(3, 256, workers=workers)
+            self.assertEqual(len(set(found)), 3)
+            for prime in found:
+                self.assertEqual(prime.bit_length(), 256)
+                self.assertTrue(is_prime(prime))
+
+
+class KeyGenerationPoolTest(unittest.TestCase):
+
+    def test_one_pool_per_keychain(self):
+        pools, contexts = [], []
+        real_pool = primes.ProcessPoolExecutor
+
+        def counting_pool(*args, **kwargs):
+            contexts.append(kwargs.get("mp_context"))
+            pools.append(real_pool(*args, **kwargs))
+            return pools[-1]
+        # the first public exponent is rejected, so another prime is searched for
+        gcds = iter([3])
+        real_gcd = blind_signatures.gcd
+        with mock.patch.object(primes, "ProcessPoolExecutor", counting_pool), \
+                mock.patch.object(blind_signatures, "gcd", lambda a, b: next(gcds, None) or real_gcd(a, b)), \
+                support.quiet():
+            e, d, n, p, q = blind_signatures.generate_keychain(include_factors=True, profile="test", workers=2)
+        self.assertEqual(len(pools), 1)
+        # never forked from the possibly threaded caller
+        self.assertIn(contexts[0].get_start_method(), ("forkserver", "spawn"))
+        self.assertEqual(next(gcds, None), None)
+        self.assertEqual(p * q, n)
+        self.assertEqual((e * d) % ((p - 1) * (q - 1)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from util import profiling
+
+
+class RotateTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _save(self, count: int) -> list:
+        names = ["20260101T0000%02d.000__redeem__200__5ms.prof" % second for second in range(count)]
+        for name in names:
+            open(os.path.join(self.directory, name), "wb").close()
+        return names
+
+    def _saved(self) -> list:
+        return sorted(os.listdir(self.directory))
+
+    def test_keeps_newest(self):
+        names = self._save(5)
+        profiling._rotate(self.directory, 2)
+        self.assertEqual(self._saved(), names[-2:])
+
+    def test_keep_zero_keeps_the_latest_profile(self):
+        names = self._save(3)
+        profiling._rotate(self.directory, 0)
+        self.assertEqual(self._saved(), names[-1:])
+
+    def test_profiler_with_keep_zero_saves_its_profile(self):
+        profiler = profiling.RequestProfiler(self.directory, sample_rate=1, token=None, min_duration=0, keep=0)
+        running = profiler.start()
+        self.assertIsNotNone(running)
+        path = profiler.stop(running, "/redeem", "200")
+        self.assertEqual(self._saved(), [os.path.basename(path)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from tests import support
+
+
+class RedeemBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        import bank.logic as logic
+        import bank.handlers as handlers
+        self.logic = logic
+        self.handlers = handlers
+        support.use_bank_keychain()
+
+    def _claims(self, count: int) -> list:
+        return [support.revealed_claim(support.new_token()) for _ in range(count)]
+
+    def test_every_claim_gets_a_result(self):
+        good, missing, not_hex, wrong, forged = self._claims(5)
+        del missing["signature"]
+        not_hex["signature"] = "zz" + not_hex["signature"][2:]
+        wrong["signature"] = good["signature"]
+        forged["signature"] = support.signature(forged["checksum"], None)[:-2] + "00"
+        claims = [good, missing, not_hex, wrong, forged, dict(good), "not a claim"]
+        with support.quiet():
+            payload, status = self.handlers.redeem_batch({"claims": claims})
+        self.assertEqual(status, 200)
+        self.assertEqual([(result["status"], result.get("error")) for result in payload["results"]], [
+            ("success", None),
+            ("rejected", "BadSignature"),
+            ("rejected", "BadSignature"),
+            ("rejected", "BadSignature"),
+            ("rejected", "BadSignature"),
+            ("rejected", "MerchantSpentAgain"),
+            ("rejected", "BadTokenFormat"),
+        ])
+        self.assertEqual(payload["results"][0]["token"], good["checksum"])
+        self.assertTrue(all(result.get("code", 200) < 500 for result in payload["results"]))
+
+    def test_batch_matches_single_redemptions(self):
+        claims = self._claims(4)
+        claims[2]["signature"] = claims[1]["signature"]
+        with support.quiet():
+            results = self.logic.redeem_tokens(claims)
+        self.assertEqual([isinstance(result, Exception) for result in results], [False, False, True, False])
+        support.use_bank_keychain()
+        for claim, result in zip(claims, results):
+            with support.quiet():
+                try:
+                    self.logic.redeem_token(claim)
+                    single = None
+                except Exception as e:
+                    single = e.__class__
+            self.assertEqual(single, result.__class__ if isinstance(result, Exception) else None)
+
+    def test_missing_signature_on_redeem(self):
+        claim = self._claims(1)[0]
+        del claim["signature"]
+        with support.quiet():
+            payload, status = self.handlers.redeem(claim)
+        self.assertEqual(status, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import time
+import unittest
+from unittest import mock
+from util.session_store import SessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def test_put_get_pop(self):
+        store = SessionStore(ttl=60, max_size=10)
+        store.put("a", 1)
+        self.assertIn("a", store)
+        self.assertEqual(store.get("a"), 1)
+        self.assertEqual(store.pop("a"), 1)
+        self.assertIsNone(store.pop("a"))
+        self.assertEqual(store.pop("a", "gone"), "gone")
+
+    def test_expiry(self):
+        store = SessionStore(ttl=10, max_size=10, stripes=1)
+        now = time.monotonic()
+        with mock.patch("util.session_store.time.monotonic", return_value=now):
+            store.put("a", 1)
+            store.put("b", 2)
+        with mock.patch("util.session_store.time.monotonic", return_value=now + 11):
+            self.assertIsNone(store.get("a"))
+            self.assertIsNone(store.pop("a"))
+            store.purge()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.stats()["expired"], 2)
+
+    def test_bounded(self):
+        store = SessionStore(ttl=60, max_size=4, stripes=1)
+        for key in range(6):
+            store.put(key, key)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.stats()["evicted"], 2)
+        # the oldest sessions go first
+        self.assertIsNone(store.get(0))
+        self.assertEqual(store.get(5), 5)
+
+    def test_smallest_stores(self):
+        for max_size, stripes in ((1, 16), (1, 1), (3, 16), (17, 16)):
+            store = SessionStore(ttl=60, max_size=max_size, stripes=stripes)
+            for key in range(3 * max_size):
+                store.put(key, key)
+            self.assertLessEqual(len(store), max_size + stripes)
+            self.assertEqual(store.get(3 * max_size - 1), 3 * max_size - 1)
+
+    def test_empty_store_is_refused(self):
+        for max_size in (0, -1):
+            with self.assertRaises(ValueError):
+                SessionStore(max_size=max_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
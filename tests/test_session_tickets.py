@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from tests import support
+from merchant.deposit_queue import DepositQueue, PENDING
+from util.session_tickets import InvalidTicket, seal, open_ticket
+
+KEY = bytes(range(32))
+
+
+class SessionTicketTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        ticket = seal({"keep": "ab", "checksums": [1, 2]}, "test", 60, KEY)
+        self.assertEqual(open_ticket(ticket, "test", KEY), {"keep": "ab", "checksums": [1, 2]})
+
+    def test_purpose_key_and_tampering(self):
+        ticket = seal({"a": 1}, "test", 60, KEY)
+        with self.assertRaises(InvalidTicket):
+            open_ticket(ticket, "other", KEY)
+        with self.assertRaises(InvalidTicket):
+            open_ticket(ticket, "test", bytes(32))
+        tampered = ticket[:20] + ("A" if ticket[20] != "A" else "B") + ticket[21:]
+        with self.assertRaises(InvalidTicket):
+            open_ticket(tampered, "test", KEY)
+        for garbage in ("", "!!!", "AAAA"):
+            with self.assertRaises(InvalidTicket):
+                open_ticket(garbage, "test", KEY)
+
+    def test_expired(self):
+        ticket = seal({"a": 1}, "test", -1, KEY)
+        with self.assertRaises(InvalidTicket):
+            open_ticket(ticket, "test", KEY)
+
+    def test_used_tickets_store(self):
+        used = []
+
+        class Store:
+            def use_ticket(self, nonce, expires):
+                if nonce in used:
+                    return False
+                used.append(nonce)
+                return True
+
+        ticket = seal({"a": 1}, "test", 60, KEY)
+        self.assertEqual(open_ticket(ticket, "test", KEY), {"a": 1})
+        self.assertEqual(open_ticket(ticket, "test", KEY, used_tickets=Store()), {"a": 1})
+        with self.assertRaises(InvalidTicket):
+            open_ticket(ticket, "test", KEY, used_tickets=Store())
+        # other tickets for the same payload are unaffected
+        self.assertEqual(open_ticket(seal({"a": 1}, "test", 60, KEY), "test", KEY, used_tickets=Store()), {"a": 1})
+
+
+class SharedUsedTicketsTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "deposits.sqlite3")
+
+    def test_shared_between_queues_on_one_file(self):
+        first, second = DepositQueue(self.path), DepositQueue(self.path)
+        expires = int(time.time()) + 60
+        self.assertTrue(first.use_ticket(b"nonce", expires))
+        self.assertFalse(second.use_ticket(b"nonce", expires))
+        self.assertTrue(second.use_ticket(b"other", expires))
+
+    def test_forgotten_once_expired(self):
+        queue = DepositQueue(self.path)
+        self.assertTrue(queue.use_ticket(b"old", int(time.time()) - 1))
+        self.assertTrue(queue.use_ticket(b"new", int(time.time()) + 60))
+        self.assertTrue(queue.use_ticket(b"old", int(time.time()) + 60))
+        self.assertEqual(queue._db.execute("SELECT COUNT(*) FROM used_tickets").fetchone()[0], 2)
+
+
+class MerchantTicketReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        import merchant.merchant_logic as logic
+        self.logic = logic
+        keys = support.keychain()
+        self.patches = [
+            mock.patch.object(logic, "SESSION_MODE", "ticket"),
+            mock.patch.object(logic, "SETTLEMENT_MODE", "queue"),
+            mock.patch.object(logic, "get_bank_key", lambda address, refresh=False: (keys["e"], keys["n"])),
+            mock.patch.object(logic.claim_journal, "get_journal"),
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # one queue file, opened separately by two merchant processes
+        path = os.path.join(directory.name, "deposits.sqlite3")
+        self.queues = [DepositQueue(path), DepositQueue(path)]
+        self.process = 0
+        self.patches.append(mock.patch.object(logic.deposit_queue, "get_queue", lambda: self.queues[self.process]))
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_replayed_ticket_is_rejected(self):
+        token = support.new_token()
+        purchase = support.revealed_claim(token)
+        for field in ("revealed-identities", "identity-pattern"):
+            del purchase[field]
+        with support.quiet():
+            session_id, pattern = self.logic.redeem_token(dict(purchase))
+            keys = [key[toggle] for key, toggle in zip(token["identity_keys"], pattern)]
+            self.assertTrue(self.logic.fill_request(session_id, keys, claim=dict(purchase)))
+            # the replay reaches the other process
+            self.process = 1
+            with self.assertRaises(self.logic.InvalidSession):
+                self.logic.fill_request(session_id, keys, claim=dict(purchase))
+        self.assertEqual(self.queues[1].stats()[PENDING], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
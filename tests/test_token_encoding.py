@@ -0,0 +1,105 @@
+import copy
+import unittest
+from tests import support
+from util.custom_exceptions import BadTokenFormat, ChecksumConflict
+from util.token_encoding import token_checksum, validate_token_checksum, parse_hex, parse_uuid
+from util.token_format import verify_format
+
+
+class TokenEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.claim = support.new_token()
+        self.token = self.claim["token"]
+
+    def test_checksum_ignores_key_order(self):
+        reordered = dict(reversed(list(self.token.items())))
+        self.assertEqual(token_checksum(self.token), token_checksum(reordered))
+        self.assertEqual(token_checksum(self.token).hex(), self.claim["checksum"])
+
+    def test_checksum_covers_every_field(self):
+        for field, value in (("amount", 1001), ("created_datetime", "2026-01-01T00:00:00")):
+            self.assertNotEqual(token_checksum(self.token), token_checksum(dict(self.token, **{field: value})))
+
+    def test_other_spellings_of_the_uuid_are_rejected(self):
+        value = self.token["uuid"]
+        for spelling in (value.upper(), "{%s}" % value, "urn:uuid:%s" % value, value.replace("-", "")):
+            with self.assertRaises(BadTokenFormat):
+                token_checksum(dict(self.token, uuid=spelling))
+            claim = copy.deepcopy(self.claim)
+            claim["token"]["uuid"] = spelling
+            with self.assertRaises(BadTokenFormat):
+                verify_format(claim)
+
+    def test_other_spellings_of_hex_are_rejected(self):
+        for spell in (str.upper, lambda value: value[:2] + " " + value[2:]):
+            token = copy.deepcopy(self.token)
+            token["identities"][0]["identity"] = (spell(token["identities"][0]["identity"][0]),
+                                                  token["identities"][0]["identity"][1])
+            with self.assertRaises(BadTokenFormat):
+                token_checksum(token)
+            with self.assertRaises(BadTokenFormat):
+                verify_format(dict(self.claim, token=token))
+            with self.assertRaises(BadTokenFormat):
+                verify_format(dict(self.claim, checksum=spell(self.claim["checksum"])))
+
+    def test_fields_outside_the_checksum_are_rejected(self):
+        with self.assertRaises(BadTokenFormat):
+            token_checksum(dict(self.token, note="pay to bearer 1,000,000"))
+        token = copy.deepcopy(self.token)
+        token["identities"][0] = dict(token["identities"][0], note="x")
+        with self.assertRaises(BadTokenFormat):
+            token_checksum(token)
+
+    def test_parsers(self):
+        self.assertEqual(parse_hex("00ff"), b"\x00\xff")
+        self.assertEqual(len(parse_uuid(self.token["uuid"])), 16)
+        for value in ("00FF", "0", " 00", "zz"):
+            with self.assertRaises(ValueError):
+                parse_hex(value)
+
+    def test_legacy_checksums_are_off_by_default(self):
+        import json, hashlib
+        legacy = hashlib.sha256(json.dumps(self.token).encode("utf-8")).digest()
+        with self.assertRaises(ChecksumConflict):
+            validate_token_checksum(self.token, legacy)
+        self.assertTrue(validate_token_checksum(self.token, token_checksum(self.token)))
+
+
+class LedgerKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        support.use_bank_keychain()
+
+    def test_recased_uuid_is_the_same_ledger_entry(self):
+        import bank.data as data
+        claim = support.revealed_claim(support.new_token())
+        data.redeem_token(claim)
+        self.assertIs(data.get_token(claim["token"]["uuid"].upper()), claim)
+        self.assertIs(data.get_token("{%s}" % claim["token"]["uuid"]), claim)
+
+    def test_recased_uuid_cannot_be_redeemed_again(self):
+        import bank.logic as logic
+        token = support.new_token()
+        claim = support.revealed_claim(token, [0] * 5)
+        with support.quiet():
+            logic.redeem_token(claim)
+            recased = copy.deepcopy(support.revealed_claim(token, [1] * 5))
+            recased["token"]["uuid"] = recased["token"]["uuid"].upper()
+            with self.assertRaises(BadTokenFormat):
+                logic.redeem_token(recased)
+            with self.assertRaises(logic.ClientSpentAgain):
+                logic.redeem_token(support.revealed_claim(token, [1] * 5))
+
+    def test_unsigned_field_cannot_be_redeemed(self):
+        import bank.data as data
+        import bank.logic as logic
+        claim = copy.deepcopy(support.revealed_claim(support.new_token()))
+        claim["token"]["note"] = "pay to bearer 1,000,000"
+        with support.quiet(), self.assertRaises(BadTokenFormat):
+            logic.redeem_token(claim)
+        self.assertIsNone(data.get_token(claim["token"]["uuid"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
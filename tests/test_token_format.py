@@ -0,0 +1,62 @@
+import copy
+import unittest
+from tests import support
+from util.custom_exceptions import BadTokenFormat, TokenFormatMalformed
+from util.token_format import compile_format, verify_format
+
+
+class CompiledFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.claim = support.new_token()
+
+    def _rejected(self, change):
+        claim = copy.deepcopy(self.claim)
+        change(claim)
+        with self.assertRaises(BadTokenFormat) as raised:
+            verify_format(claim)
+        return str(raised.exception)
+
+    def test_accepts_a_client_token(self):
+        self.assertTrue(verify_format(self.claim))
+        self.assertTrue(verify_format(dict(self.claim, token=dict(self.claim["token"], amount=10.5))))
+
+    def test_missing_field_names_its_path(self):
+        message = self._rejected(lambda claim: claim["token"]["identities"][2].pop("checksum"))
+        self.assertIn("token.identities[2].checksum", message)
+
+    def test_wrong_types(self):
+        self._rejected(lambda claim: claim["token"].update(amount="1000"))
+        self._rejected(lambda claim: claim["token"].update(amount=True))
+        self._rejected(lambda claim: claim.update(token=[]))
+        with self.assertRaises(BadTokenFormat):
+            verify_format([self.claim])
+
+    def test_lengths_and_string_formats(self):
+        self._rejected(lambda claim: claim["token"]["identities"].pop())
+        self._rejected(lambda claim: claim.update(checksum=claim["checksum"][:-2]))
+        self._rejected(lambda claim: claim["token"].update(created_datetime="yesterday"))
+        message = self._rejected(lambda claim: claim["token"].update(uuid="not-a-uuid"))
+        self.assertIn("token.uuid", message)
+
+    def test_malformed_format_fails_at_compile_time(self):
+        for token_format in ({"amount": "decimal"},
+                             {"amount": {"format": "hex"}},
+                             {"amount": {"type": "str", "format": "base58"}},
+                             {"amount": {"type": "str", "length": "64"}},
+                             {"amount": {"type": "enum"}},
+                             {"amount": {"type": "dict"}}):
+            with self.assertRaises(TokenFormatMalformed):
+                compile_format(token_format)
+
+    def test_enum_and_nested_formats(self):
+        validate = compile_format({"stage": {"type": "enum", "options": ["withdraw", "spend"]},
+                                   "bits": {"type": "list", "format": {"type": "str", "format": "bitstring"}}})
+        self.assertTrue(validate({"stage": "spend", "bits": ["0110", "1"]}))
+        for token in ({"stage": "deposit", "bits": []}, {"stage": "spend", "bits": ["012"]}):
+            with self.assertRaises(BadTokenFormat):
+                validate(token)
+
+
+if __name__ == "__main__":
+    unittest.main()
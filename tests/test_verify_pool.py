@@ -0,0 +1,45 @@
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from tests import support
+
+
+class VerifyPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        import bank.logic as logic
+        self.logic = logic
+        patch = mock.patch.object(logic, "VERIFY_WORKERS", 2)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self._shutdown)
+
+    def _shutdown(self):
+        if self.logic._verify_pool is not None:
+            self.logic._verify_pool.shutdown()
+            self.logic._verify_pool = None
+
+    def test_verifies_across_the_pool(self):
+        claims = [support.new_token() for _ in range(3)]
+        self.assertEqual(self.logic._verify_revealed_claims(claims), ["Test Wallet | #000000001"] * 3)
+        claims[1]["token"]["amount"] = 1
+        with self.assertRaises(self.logic.ChecksumConflict):
+            self.logic._verify_revealed_claims(claims)
+
+    def test_workers_are_not_forked_from_the_server(self):
+        self.assertIn(self.logic._get_verify_pool()._mp_context.get_start_method(), ("forkserver", "spawn"))
+
+    def test_broken_pool_is_replaced(self):
+        claims = [support.new_token() for _ in range(2)]
+        broken = self.logic._get_verify_pool()
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        with self.assertRaises(BrokenProcessPool):
+            self.logic._verify_revealed_claims(claims)
+        self.assertIsNot(self.logic._get_verify_pool(), broken)
+        self.assertEqual(len(self.logic._verify_revealed_claims(claims)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
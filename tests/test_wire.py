@@ -0,0 +1,111 @@
+import gzip
+import json
+import time
+import unittest
+from unittest import mock
+from util import wire
+from util.wire import WireFormatError
+
+
+class WireCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        document = {
+            "checksum": "00ff" * 16,
+            "upper": "ABCD",
+            "spaced": "ab cd",
+            "empty": "",
+            "text": "héllo",
+            "numbers": [0, 1, -1, 2 ** 64, -(2 ** 4096 - 1), 1.5, -0.0],
+            "flags": [True, False, None],
+            "nested": {"a": [{"b": []}, {}]},
+        }
+        self.assertEqual(wire.decode(wire.encode(document)), document)
+        self.assertEqual(wire.decode(wire.encode([])), [])
+
+    def test_hex_strings_are_stored_as_bytes(self):
+        checksum = "ab" * 32
+        self.assertLess(len(wire.encode(checksum)), len(json.dumps(checksum)) / 1.8)
+        self.assertEqual(wire.encode("AB"), wire.MAGIC + b"S\x02AB")
+
+    def test_malformed_documents(self):
+        valid = wire.encode({"a": [1, "ff"]})
+        malformed = [
+            b"",
+            b"{}",
+            wire.MAGIC,
+            valid[:-1],
+            valid + b"N",
+            wire.MAGIC + b"X",
+            wire.MAGIC + b"S\x02\xff\xfe",
+            wire.MAGIC + b"L\x05N",
+            wire.MAGIC + b"M\x01I\x02N",
+            wire.MAGIC + b"D\x00",
+            wire.MAGIC + b"H\x7f\x00",
+            wire.MAGIC + b"L\x01" * 100 + b"N",
+        ]
+        for data in malformed:
+            with self.assertRaises(WireFormatError, msg=data):
+                wire.decode(data)
+
+    def test_long_varints_are_rejected_quickly(self):
+        for tag in (b"I", b"S", b"L"):
+            start = time.perf_counter()
+            with self.assertRaises(WireFormatError):
+                wire.decode(wire.MAGIC + tag + b"\xff" * (1 << 20) + b"\x00")
+            self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_integer_limit(self):
+        self.assertEqual(wire.decode(wire.encode(2 ** wire.MAX_INT_BITS - 1)), 2 ** wire.MAX_INT_BITS - 1)
+        with self.assertRaises(WireFormatError):
+            wire.encode(2 ** wire.MAX_INT_BITS)
+        too_large = 2 ** (wire.MAX_INT_BITS + 1) << 1
+        with self.assertRaises(WireFormatError):
+            wire.decode(wire.MAGIC + b"I" + wire._varint(too_large))
+
+    def test_unencodable_values(self):
+        for value in ({1: "a"}, object(), b"bytes"):
+            with self.assertRaises(WireFormatError):
+                wire.encode(value)
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def test_parse_body(self):
+        document = {"a": "ff"}
+        self.assertEqual(wire.parse_body(wire.encode(document), wire.BINARY_TYPE), document)
+        self.assertEqual(wire.parse_body(b'{"a": "ff"}', "application/json; charset=utf-8"), document)
+        self.assertEqual(wire.parse_body(gzip.compress(wire.encode(document)), wire.BINARY_TYPE, "gzip"), document)
+        self.assertIsNone(wire.parse_body(b"a=b", "application/x-www-form-urlencoded"))
+        for body, content_type, encoding in ((b"{", "application/json", None),
+                                             (b"not gzip", wire.BINARY_TYPE, "gzip"),
+                                             (b"{}", "application/json", "br")):
+            with self.assertRaises(WireFormatError):
+                wire.parse_body(body, content_type, encoding)
+
+    def test_decompressed_size_is_capped(self):
+        bomb = gzip.compress(b"\x00" * (1 << 20))
+        with mock.patch.object(wire, "MAX_BODY_SIZE", 1 << 16):
+            with self.assertRaises(WireFormatError):
+                wire.parse_body(bomb, wire.BINARY_TYPE, "gzip")
+
+    def test_render(self):
+        document = {"signature": "ab" * 512}
+        body, headers = wire.render(document)
+        self.assertEqual(headers["Content-Type"], wire.JSON_TYPE)
+        self.assertEqual(json.loads(body), document)
+        body, headers = wire.render(document, "%s, %s" % (wire.BINARY_TYPE, wire.JSON_TYPE))
+        self.assertEqual(headers["Content-Type"], wire.BINARY_TYPE)
+        self.assertEqual(wire.decode(body), document)
+        _, headers = wire.render(document, "%s;q=0" % wire.BINARY_TYPE)
+        self.assertEqual(headers["Content-Type"], wire.JSON_TYPE)
+        with mock.patch.object(wire, "COMPRESS", True):
+            body, headers = wire.render(document, None, "gzip, deflate")
+            self.assertEqual(headers["Content-Encoding"], "gzip")
+            self.assertEqual(json.loads(gzip.decompress(body)), document)
+            _, headers = wire.render(document, None, None)
+            self.assertNotIn("Content-Encoding", headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
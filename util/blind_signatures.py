@@ -1,43 +1,8 @@
 from Crypto import Random
 from Crypto.Random import random
 import hashlib
-from util.custom_exceptions import BadSignature, ChecksumConflict
-def is_prime(n, k=128):
-    """ Test if a number is prime        
-        Args:
-            n -- int -- the number to test
-            k -- int -- the number of tests to do        
-    return True if n is prime
-    """
-    # Test if n is not even.
-    # But care, 2 is prime !
-    if n == 2 or n == 3:
-        return True
-    if n <= 1 or n % 2 == 0:
-        return False
-    # find r and s
-    s = 0
-    r = n - 1
-    while r & 1 == 0:
-        s += 1
-        r //= 2
-    # do k tests
-    for _ in range(k):
-        a = random.randrange(2, n - 1)
-        x = pow(a, r, n)
-        if x != 1 and x != n - 1:
-            j = 1
-            while j < s and x != n - 1:
-                x = pow(x, 2, n)
-                if x == 1:
-                    return False
-                j += 1
-            if x != n - 1:
-                return False    
-
-    return True
-
-
+from util.custom_exceptions import BadSignature, ChecksumConflict, SigningFault
+from util.primes import is_prime, generate_prime, generate_primes, get_profile_bits, search_pool
 def generate_prime_candidate(length):
     """ Generate an odd integer randomly        
         Args:
@@ -46,23 +11,20 @@ def generate_prime_candidate(length):
         return a integer
     """
     # generate random bits
-    p = int.from_bytes(Random.get_random_bytes(length), 'big')
+    p = int.from_bytes(Random.get_random_bytes((length + 7) // 8), 'big')
+    p &= (1 << length) - 1
     # apply a mask to set MSB and LSB to 1
     p |= (1 << length - 1) | 1    
     return p
 
-def generate_prime_number(length=128):
+def generate_prime_number(length=1024):
     """ Generate a prime
         Args:
             length -- int -- length of the prime to generate, in bits
          
         return a prime
     """
-    p = 4
-    # keep generating while the primality test fail
-    while not is_prime(p, 128):
-        p = generate_prime_candidate(length)
-    return p
+    return generate_prime(length)
 
 def gcd(a, b):
     A = max(a, b)
@@ -90,6 +52,39 @@ def modulo_multiplicative_inverse(A, M):
     
     return x
 
+def batch_modulo_multiplicative_inverse(values, M):
+    """
+    Returns the multiplicative modulo inverses of all `values` under M, in
+    order, with None for the values that are not co-prime with M.
+    Uses Montgomery's trick: a single inversion of the product of all values
+    plus 3(m-1) multiplications, instead of one inversion per value.
+    """
+    values = [value % M for value in values]
+    inverses = [None] * len(values)
+    invertible = [index for index, value in enumerate(values) if value != 0]
+    while invertible:
+        # prefix[j] = values[invertible[0]] * ... * values[invertible[j]]
+        prefix = []
+        product = 1
+        for index in invertible:
+            product = (product * values[index]) % M
+            prefix.append(product)
+        divisor, x, _ = extended_euclid_gcd(product, M)
+        if divisor == 1:
+            break
+        # some value shares a factor with M, find and drop them
+        invertible = [index for index in invertible if gcd(values[index], M) == 1]
+    else:
+        return inverses
+
+    inverse = x % M  # inverse of the whole product
+    for j in range(len(invertible) - 1, 0, -1):
+        index = invertible[j]
+        inverses[index] = (inverse * prefix[j - 1]) % M
+        inverse = (inverse * values[index]) % M
+    inverses[invertible[0]] = inverse
+    return inverses
+
 def extended_euclid_gcd(a, b):
     """
     Returns a list `result` of size 3 where:
@@ -112,23 +107,71 @@ def extended_euclid_gcd(a, b):
     return [old_r, old_s, old_t]
     
 
-def generate_keychain():
+SMALL_PUBLIC_EXPONENT = 65537
+
+def generate_keychain(include_factors=False, profile=None, workers=None, public_exponent=None):
+    """
+    Generates an RSA keychain, with a modulus of the size given by the key
+    profile (see util.primes.KEY_PROFILES).
+    The public key e is a random prime as long as p and q, unless a fixed
+    public_exponent (e.g. SMALL_PUBLIC_EXPONENT) is given, which makes every
+    signature validation a handful of multiplications instead of a full-size
+    exponentiation.
+    Returns (e, d, n), or (e, d, n, p, q) when include_factors is set so
+    the caller can sign with the Chinese Remainder Theorem.
+    """
     print("Generating Public/Private Keychain")
-    p = generate_prime_number()
-    q = p
-    while q == p:
-        q = generate_prime_number()
-        
-    n = p * q
-    phi = (p-1) * (q-1)
-    e = generate_prime_number()
-    while gcd(e, phi) > 1:
-        e = generate_prime_number()
+    prime_bits = get_profile_bits(profile) // 2
+    # every search below shares one set of worker processes
+    with search_pool(workers) as pool:
+        if public_exponent:
+            e = public_exponent
+            factors = []
+            while len(factors) < 2:
+                for prime in generate_primes(2 - len(factors), prime_bits, workers, pool=pool):
+                    # e must be invertible modulo phi = (p-1)(q-1)
+                    if gcd(e, prime - 1) == 1 and prime not in factors:
+                        factors.append(prime)
+            p, q = factors
+        else:
+            p, q, e = generate_primes(3, prime_bits, workers, pool=pool)
+
+        n = p * q
+        phi = (p-1) * (q-1)
+        while gcd(e, phi) > 1:
+            e = generate_prime(prime_bits, workers, pool=pool)
 
     d = modulo_multiplicative_inverse(e, phi)
     print("Done Generating Keychain")
+    if include_factors:
+        return (e, d, n, p, q)
     return (e, d, n)
 
+def compute_crt_parameters(d, p, q):
+    """
+    Returns the CRT parameters (dP, dQ, qInv) for the private key d = e^-1 mod phi(p*q)
+    """
+    return (d % (p - 1), d % (q - 1), modulo_multiplicative_inverse(q, p))
+
+def sign(message:int, key:tuple, crt_key:tuple):
+    """
+    Signs `message` using the Chinese Remainder Theorem, two half-size
+    exponentiations instead of one over the full modulus.
+    key format: (e, n) : (public key, public modulus)
+    crt_key format: (p, q, dP, dQ, qInv)
+    The result is checked against the public key before it is returned, so a
+    faulty computation never leaks a value that could factor the modulus.
+    """
+    e, n = key
+    p, q, dp, dq, q_inv = crt_key
+    m_p = pow(message % p, dp, p)
+    m_q = pow(message % q, dq, q)
+    h = (q_inv * (m_p - m_q)) % p
+    signature = m_q + h * q
+    if pow(signature, e, n) != message % n:
+        raise SigningFault("CRT signature failed verification against the public key")
+    return signature
+
 def validate_signature(checksum:int, signature:int, key:tuple, verbose=False):
     _validation = pow(signature, *key) # key format: (e, n) : (public key, public modulus)
     if verbose:
@@ -138,6 +181,67 @@ def validate_signature(checksum:int, signature:int, key:tuple, verbose=False):
         raise BadSignature()
     return True
 
+def jacobi(a:int, n:int) -> int:
+    """ Jacobi symbol (a/n) for an odd n > 0: 1 or -1, or 0 when a and n share a factor """
+    a %= n
+    result = 1
+    while a:
+        zeros = (a & -a).bit_length() - 1
+        a >>= zeros
+        if zeros & 1 and n & 7 in (3, 5):
+            result = -result
+        if a & n & 3 == 3:
+            result = -result
+        a, n = n % a, a
+    return result if n == 1 else 0
+
+def find_bad_signatures(pairs:list, key:tuple, security:int=64):
+    """
+    Checks many (checksum, signature) pairs under one key (e, n) and returns
+    the indices of the pairs that do not validate.
+    All pairs are first checked together with randomized batch verification:
+        (prod s_i^r_i)^2e == (prod m_i^r_i)^2  (mod n)
+    for random `security`-bit r_i, which accepts a batch containing a bad
+    signature with probability at most 2^-security. Only when the batch fails
+    is every pair checked on its own to find the bad ones.
+    Anyone can turn a signature s into n - s, whose e-th power is -m, and
+    without the squares two such signatures would cancel out. Squaring leaves
+    the sign to a Jacobi symbol check per pair: s^e = m implies (s/n) = (m/n),
+    while (-m/n) = -(m/n) when (-1/n) = -1. When (-1/n) = 1 the symbol cannot
+    tell the signs apart, so every pair is checked on its own.
+    """
+    e, n = key
+    if not pairs:
+        return []
+    bad, batch = [], []
+    # with a small e one pow(s, e, n) is already cheaper than two r_i powers
+    if len(pairs) > 1 and e.bit_length() > 2 * security and jacobi(n - 1, n) == -1:
+        signatures, checksums = 1, 1
+        for index, (checksum, signature) in enumerate(pairs):
+            if not 0 <= checksum < n or jacobi(signature, n) != jacobi(checksum, n):
+                bad.append(index)
+                continue
+            batch.append(index)
+            r = random.getrandbits(security) | 1
+            signatures = (signatures * pow(signature, r, n)) % n
+            checksums = (checksums * pow(checksum, r, n)) % n
+        if pow(signatures, 2 * e, n) == pow(checksums, 2, n):
+            return bad
+    else:
+        batch = range(len(pairs))
+    bad.extend(index for index in batch if pow(pairs[index][1], e, n) != pairs[index][0])
+    return sorted(bad)
+
+def validate_signatures(pairs:list, key:tuple, security:int=64):
+    """
+    Batch counterpart of validate_signature, raises BadSignature naming the
+    indices of the pairs that do not validate.
+    """
+    bad = find_bad_signatures(pairs, key, security)
+    if bad:
+        raise BadSignature("Bad signatures at positions %s" % ", ".join(map(str, bad)))
+    return True
+
 def validate_checksum(data:bytes, checksum:bytes, verbose=False):
     if isinstance(data, str):
         data = data.encode('utf-8')
@@ -0,0 +1,34 @@
+import os
+
+# All runtime settings are read from environment variables prefixed with DIGICASH_
+
+
+def get_str(name: str, default: str = None) -> str:
+    return os.environ.get(name, default)
+
+
+def get_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("Expected an integer for %s, found %s" % (name, value))
+
+
+def get_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("Expected a number for %s, found %s" % (name, value))
+
+
+def get_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
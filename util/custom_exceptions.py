@@ -16,3 +16,8 @@ class TokenFormatMalformed(ValueError):
 class BadTokenFormat(ValueError):
     """ To be raised when the provided token does not follow the defined token format. """
     pass
+
+
+class SigningFault(ArithmeticError):
+    """ To be raised when a freshly computed signature does not verify against the signing key. """
+    pass
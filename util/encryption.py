@@ -23,5 +23,16 @@ def aes_decrypt(enc: bytes, key:bytes) -> bytes:
             )
         )
 
+def aes_encrypt_many(raws:list, keys:list) -> list:
+    """ aes_encrypt of each raw with its key, drawing all the IVs at once """
+    ivs = Random.get_random_bytes(AES.block_size * len(raws))
+    encrypted = []
+    for index, (raw, key) in enumerate(zip(raws, keys)):
+        iv = ivs[index * AES.block_size:(index + 1) * AES.block_size]
+        encrypted.append(iv + AES.new(key, AES.MODE_CBC, iv).encrypt(_pad(raw)))
+    return encrypted
+
 def xor_bytes(a:bytes, b:bytes) -> bytes:
-    return bytes(tuple(_a ^ _b for _a, _b in zip(a, b)))
\ No newline at end of file
+    # as one big-integer XOR; like zip, the longer input is cut to the shorter
+    length = min(len(a), len(b))
+    return (int.from_bytes(a[:length], 'big') ^ int.from_bytes(b[:length], 'big')).to_bytes(length, 'big')
\ No newline at end of file
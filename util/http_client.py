@@ -0,0 +1,71 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from util import config
+
+# Shared HTTP layer for calls between the client, the merchant and the bank.
+# One pooled keep-alive session per process, so repeated calls to the same
+# service reuse their TCP connections.
+
+# seconds to wait for a connection / for the response
+CONNECT_TIMEOUT = config.get_float("DIGICASH_HTTP_CONNECT_TIMEOUT", 3.05)
+READ_TIMEOUT = config.get_float("DIGICASH_HTTP_READ_TIMEOUT", 30)
+# connections kept alive per host, and hosts kept in the pool
+POOL_SIZE = config.get_int("DIGICASH_HTTP_POOL_SIZE", 16)
+POOL_HOSTS = config.get_int("DIGICASH_HTTP_POOL_HOSTS", 8)
+# retries on connection errors, and on 502/503/504 for idempotent requests.
+# POST is never retried once sent: /redeem and /fill-request must not run twice.
+RETRIES = config.get_int("DIGICASH_HTTP_RETRIES", 3)
+RETRY_BACKOFF = config.get_float("DIGICASH_HTTP_RETRY_BACKOFF", 0.2)
+
+_session = None
+_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def close():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,203 @@
+import bisect
+import contextlib
+import threading
+import time
+from util import config
+
+# In-process metrics, exposed on /metrics in the Prometheus text format
+# (version 0.0.4). Metrics register themselves when they are created, and
+# render() writes out every registered metric.
+#
+#   stage_seconds = metrics.Histogram("digicash_bank_stage_seconds", "...", ("operation", "stage"))
+#   with stage_seconds.time("redeem", "verify_signature"):
+#       ...
+#
+# Each process keeps its own values; behind several server processes,
+# scrape each process or aggregate in the monitoring system.
+
+ENABLED = config.get_bool("DIGICASH_METRICS", True)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = ["%s=\"%s\"" % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = dict()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _check_labels(self, labels: tuple):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s expects labels %s, found %d values" % (self.name, self.labelnames, len(labels)))
+
+    def samples(self):
+        """ Yields (suffix, label string, value) for the exposition """
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield "", _labels(self.labelnames, labels), value
+
+    def render(self) -> str:
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+            "# TYPE %s %s" % (self.name, self.type_name),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, labels, _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+
+    type_name = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+
+    type_name = "gauge"
+
+    def set(self, value: float, *labels):
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class CallbackMetric(_Metric):
+    """ A counter or gauge read when rendered: callback() yields (labels, value) pairs """
+
+    def __init__(self, name: str, documentation: str, callback, labelnames: tuple = (), type_name: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type_name = type_name
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield "", _labels(self.labelnames, tuple(labels)), value
+
+
+class _Timer:
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram(_Metric):
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        self._check_labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # one count per bucket plus +Inf, and the sum of the observations
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """ Context manager observing the time spent in its block """
+        if not ENABLED:
+            return contextlib.nullcontext()
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", _labels(self.labelnames, labels, "le=\"%s\"" % _number(float(bound))), cumulative
+            yield "_sum", _labels(self.labelnames, labels), total
+            yield "_count", _labels(self.labelnames, labels), cumulative
+
+
+@contextlib.contextmanager
+def track(histogram: Histogram, counter: Counter, *labels):
+    """
+    Observes the duration of the block in histogram, and counts it in
+    counter under labels plus its outcome: "success", or the class name of
+    the exception that left the block.
+    """
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        yield
+    except BaseException as e:
+        outcome = e.__class__.__name__
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+        counter.inc(*(labels + (outcome,)))
+
+
+def session_store_metrics(prefix: str, store):
+    """ Registers gauges and counters reading a util.session_store.SessionStore """
+    CallbackMetric(prefix + "_sessions_open", "Sessions currently held in memory.",
+                   lambda: [((), store.stats()["size"])])
+    CallbackMetric(prefix + "_sessions_expired_total", "Sessions dropped after their TTL.",
+                   lambda: [((), store.stats()["expired"])], type_name="counter")
+    CallbackMetric(prefix + "_sessions_evicted_total", "Sessions evicted because the store was full.",
+                   lambda: [((), store.stats()["evicted"])], type_name="counter")
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    return "".join(metric.render() for metric in metrics)
@@ -0,0 +1,193 @@
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from Crypto import Random
+from Crypto.Random import random
+from util import config
+
+# Key size profiles, by modulus size in bits. Each prime is half of the modulus.
+KEY_PROFILES = {
+    "test": 1024,
+    "standard": 2048,
+    "high": 3072,
+}
+DEFAULT_KEY_PROFILE = "standard"
+
+# Number of consecutive odd candidates examined by one search task
+SEARCH_WINDOW = 2048
+
+
+def _primes_below(limit):
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+
+# odd primes used to sieve candidates before any Miller-Rabin round
+SMALL_PRIMES = tuple(_primes_below(2048)[1:])
+
+
+def get_profile_bits(profile: str = None) -> int:
+    """ Returns the modulus size in bits for a named key profile """
+    profile = profile or config.get_str("DIGICASH_KEY_PROFILE", DEFAULT_KEY_PROFILE)
+    try:
+        return KEY_PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown key profile %s, expected one of %s" % (profile, ", ".join(KEY_PROFILES)))
+
+
+def miller_rabin_rounds(bits: int) -> int:
+    """
+    Number of Miller-Rabin rounds for a random candidate of `bits` bits,
+    giving an error probability below 2^-100 (FIPS 186-4, Table C.3).
+    """
+    if bits >= 1536:
+        return 4
+    if bits >= 1024:
+        return 5
+    if bits >= 512:
+        return 7
+    return 40
+
+
+def is_prime(n, k=128):
+    """ Test if a number is prime
+        Args:
+            n -- int -- the number to test
+            k -- int -- the number of tests to do
+    return True if n is prime
+    """
+    # Test if n is not even.
+    # But care, 2 is prime !
+    if n == 2 or n == 3:
+        return True
+    if n <= 1 or n % 2 == 0:
+        return False
+    # find r and s
+    s = 0
+    r = n - 1
+    while r & 1 == 0:
+        s += 1
+        r //= 2
+    # do k tests
+    for _ in range(k):
+        a = random.randrange(2, n - 1)
+        x = pow(a, r, n)
+        if x != 1 and x != n - 1:
+            j = 1
+            while j < s and x != n - 1:
+                x = pow(x, 2, n)
+                if x == 1:
+                    return False
+                j += 1
+            if x != n - 1:
+                return False
+
+    return True
+
+
+def random_odd(bits: int) -> int:
+    """ Random odd integer of exactly `bits` bits with the two top bits set,
+    so that the product of two of them is exactly 2*bits long. """
+    n = int.from_bytes(Random.get_random_bytes((bits + 7) // 8), "big")
+    n &= (1 << bits) - 1
+    n |= (3 << (bits - 2)) | 1
+    return n
+
+
+def sieve_window(start: int, window: int = SEARCH_WINDOW) -> list:
+    """
+    Returns the offsets i in [0, window) for which start + 2*i has no factor
+    in SMALL_PRIMES. `start` must be odd.
+    """
+    composite = bytearray(window)
+    for prime in SMALL_PRIMES:
+        # start + 2i = 0 (mod prime)  <=>  i = -start * 2^-1 (mod prime)
+        first = (-start * ((prime + 1) // 2)) % prime
+        composite[first::prime] = b"\x01" * len(range(first, window, prime))
+    return [i for i in range(window) if not composite[i]]
+
+
+def search_window(bits: int, rounds: int = None, window: int = SEARCH_WINDOW):
+    """
+    Sieves a window of odd candidates from a random starting point and
+    returns the first one that passes Miller-Rabin, or None.
+    """
+    rounds = rounds or miller_rabin_rounds(bits)
+    start = random_odd(bits)
+    for offset in sieve_window(start, window):
+        candidate = start + 2 * offset
+        if candidate.bit_length() > bits:
+            break
+        if is_prime(candidate, rounds):
+            return candidate
+    return None
+
+
+def _get_workers(workers):
+    if workers is None:
+        workers = config.get_int("DIGICASH_PRIME_WORKERS", os.cpu_count() or 1)
+    return max(1, workers)
+
+
+@contextlib.contextmanager
+def search_pool(workers: int = None):
+    """
+    A process pool that several generate_primes calls can share, e.g. all
+    the searches of one key generation; None when there is a single worker.
+    """
+    workers = _get_workers(workers)
+    if workers == 1:
+        yield None
+        return
+    # the workers are started from a fresh process, not forked: a key may be
+    # generated inside a threaded server, whose other threads may hold locks
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        yield pool
+
+
+def generate_primes(count: int, bits: int, workers: int = None, rounds: int = None, pool=None) -> list:
+    """
+    Generates `count` distinct primes of exactly `bits` bits, searching
+    windows in parallel across a process pool when more than one worker is
+    available. Pass a pool from search_pool to reuse it across calls.
+    """
+    if pool is None:
+        with search_pool(workers) as pool:
+            return _search_primes(pool, count, bits, workers, rounds)
+    return _search_primes(pool, count, bits, workers, rounds)
+
+
+def _search_primes(pool, count: int, bits: int, workers: int, rounds: int) -> list:
+    primes = []
+    if pool is None:
+        while len(primes) < count:
+            prime = search_window(bits, rounds)
+            if prime is not None and prime not in primes:
+                primes.append(prime)
+        return primes
+
+    pending = {pool.submit(search_window, bits, rounds) for _ in range(_get_workers(workers))}
+    try:
+        while len(primes) < count:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                prime = future.result()
+                if prime is not None and prime not in primes and len(primes) < count:
+                    primes.append(prime)
+                if len(primes) < count:
+                    pending.add(pool.submit(search_window, bits, rounds))
+    finally:
+        for future in pending:
+            future.cancel()
+    return primes
+
+
+def generate_prime(bits: int, workers: int = None, rounds: int = None, pool=None) -> int:
+    return generate_primes(1, bits, workers, rounds, pool)[0]
@@ -0,0 +1,180 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import cProfile
+import hmac
+import random
+import re
+import tempfile
+import threading
+import time
+from util import config
+
+# Opt-in request profiling for the Flask apps. A request is profiled with
+# cProfile when it is sampled (DIGICASH_PROFILE_SAMPLE_RATE) or when it
+# carries the X-Digicash-Profile header set to DIGICASH_PROFILE_TOKEN. The
+# profile is saved as <time>__<route>__<outcome>__<duration>ms.prof, and
+# only the newest DIGICASH_PROFILE_KEEP profiles are kept.
+#
+#   python -m util.profiling /tmp/digicash-profiles/bank --route fill-request
+
+# fraction of requests profiled, from 0 to 1
+SAMPLE_RATE = config.get_float("DIGICASH_PROFILE_SAMPLE_RATE", 0)
+# secret enabling profiling of a single request by header; unset disables the header
+TOKEN = config.get_str("DIGICASH_PROFILE_TOKEN")
+HEADER = "X-Digicash-Profile"
+# profiles of faster requests are discarded
+MIN_DURATION = config.get_float("DIGICASH_PROFILE_MIN_DURATION", 0)
+# newest profiles kept on disk, at least 1
+KEEP = config.get_int("DIGICASH_PROFILE_KEEP", 200)
+PROFILE_DIR = config.get_str("DIGICASH_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "digicash-profiles"))
+
+_profile_name = re.compile(r"^(?P<time>\d{8}T\d{6}\.\d{3})__(?P<route>[\w.-]+)__(?P<outcome>[\w.-]+)__(?P<duration>\d+)ms\.prof$")
+_unsafe = re.compile(r"[^\w.-]+")
+
+# one request is profiled at a time: cProfile hooks are process-wide on newer Pythons
+_profiling = threading.Lock()
+
+
+def _tag(value: str) -> str:
+    return _unsafe.sub("-", value).strip("-") or "root"
+
+
+def profile_path(directory: str, route: str, outcome: str, duration: float) -> str:
+    now = time.time()
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(now)) + ".%03d" % (int(now * 1000) % 1000)
+    return os.path.join(directory, "%s__%s__%s__%dms.prof" % (stamp, _tag(route), _tag(outcome), duration * 1000))
+
+
+def list_profiles(directory: str) -> list:
+    """ Saved profiles, oldest first, as dicts of path, time, route, outcome and duration (ms) """
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory)):
+        match = _profile_name.match(name)
+        if match:
+            profile = match.groupdict()
+            profile["duration"] = int(profile["duration"])
+            profile["path"] = os.path.join(directory, name)
+            profiles.append(profile)
+    return profiles
+
+
+def _rotate(directory: str, keep: int):
+    # the profile just written is always kept
+    keep = max(1, keep)
+    for profile in list_profiles(directory)[:-keep]:
+        try:
+            os.remove(profile["path"])
+        except OSError:
+            pass
+
+
+class RequestProfiler:
+
+    def __init__(self, directory: str, sample_rate: float = SAMPLE_RATE, token: str = TOKEN,
+                 min_duration: float = MIN_DURATION, keep: int = KEEP):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.min_duration = min_duration
+        self.keep = keep
+
+    def wanted(self, header_value: str = None) -> bool:
+        if header_value and self.token and hmac.compare_digest(header_value.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, header_value: str = None):
+        """ Returns a running (profile, start time), or None when this request is not profiled """
+        if not self.wanted(header_value) or not _profiling.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active
+            _profiling.release()
+            return None
+        return profile, time.perf_counter()
+
+    def stop(self, running, route: str, outcome: str):
+        profile, start = running
+        try:
+            profile.disable()
+        finally:
+            _profiling.release()
+        duration = time.perf_counter() - start
+        if duration < self.min_duration:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = profile_path(self.directory, route, outcome, duration)
+        profile.dump_stats(path)
+        _rotate(self.directory, self.keep)
+        return path
+
+
+def install(web, name: str, directory: str = None):
+    """
+    Adds the profiling hook to a Flask app. Does nothing unless sampling or
+    the header token is configured. Profiles go to directory, by default
+    DIGICASH_PROFILE_DIR/<name>.
+    """
+    if SAMPLE_RATE <= 0 and not TOKEN:
+        return None
+    from flask import g, request
+    profiler = RequestProfiler(directory or os.path.join(PROFILE_DIR, name))
+
+    @web.before_request
+    def _start_profile():
+        g.profile = profiler.start(request.headers.get(HEADER))
+
+    @web.after_request
+    def _profile_outcome(response):
+        g.profile_outcome = str(response.status_code)
+        return response
+
+    @web.teardown_request
+    def _stop_profile(error):
+        running = g.pop("profile", None)
+        if running is None:
+            return
+        outcome = error.__class__.__name__ if error is not None else g.pop("profile_outcome", "unknown")
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        try:
+            profiler.stop(running, route, outcome)
+        except Exception as e:
+            print("Failed to save the request profile: %s" % str(e))
+
+    return profiler
+
+
+if __name__ == "__main__":
+    import argparse
+    import pstats
+    parser = argparse.ArgumentParser(description="Summarize saved request profiles.")
+    parser.add_argument("directory", nargs="?", default=PROFILE_DIR, help="profile directory")
+    parser.add_argument("--route", help="only profiles of this route, e.g. fill-request")
+    parser.add_argument("--outcome", help="only profiles with this outcome, e.g. 500 or TokenRejected")
+    parser.add_argument("--min-ms", type=int, default=0, help="only profiles of requests at least this slow")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key (cumulative, tottime, calls, ...)")
+    parser.add_argument("--limit", type=int, default=25, help="functions shown")
+    parser.add_argument("--list", action="store_true", help="only list the matching profiles")
+    args = parser.parse_args()
+
+    profiles = [profile for profile in list_profiles(args.directory)
+                if (args.route is None or profile["route"] == _tag(args.route))
+                and (args.outcome is None or profile["outcome"] == args.outcome)
+                and profile["duration"] >= args.min_ms]
+    if not profiles:
+        print("No matching profiles in %s" % args.directory)
+        sys.exit(1)
+    for profile in profiles:
+        print("%s  %-20s %-20s %6d ms  %s" % (profile["time"], profile["route"], profile["outcome"],
+                                             profile["duration"], os.path.basename(profile["path"])))
+    durations = sorted(profile["duration"] for profile in profiles)
+    print("\n%d profiles, median %d ms, max %d ms\n" % (len(durations), durations[len(durations) // 2], durations[-1]))
+    if not args.list:
+        stats = pstats.Stats(*[profile["path"] for profile in profiles])
+        stats.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
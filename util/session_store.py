@@ -0,0 +1,89 @@
+import collections
+import threading
+import time
+
+# In-memory session store for the two-step protocols (bank withdrawals,
+# merchant purchases): entries expire after a TTL, the store is bounded, and
+# keys are spread over independently locked stripes.
+
+
+class SessionStore:
+
+    def __init__(self, ttl: float = 300, max_size: int = 100000, stripes: int = 16):
+        if max_size < 1:
+            raise ValueError("A session store must hold at least one session, found max_size=%d" % max_size)
+        self.ttl = ttl
+        self.max_size = max_size
+        stripes = max(1, min(stripes, max_size))
+        # each stripe holds at most its share of max_size; entries are kept in
+        # insertion order, which with a fixed TTL is also expiry order
+        self._stripe_size = -(-max_size // stripes)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._entries = [collections.OrderedDict() for _ in range(stripes)]
+        self._expired = [0] * stripes
+        self._evicted = [0] * stripes
+
+    def _stripe(self, key):
+        return hash(key) % len(self._locks)
+
+    def _purge(self, stripe: int, now: float):
+        """ Drops expired entries from the front of a stripe; caller holds its lock """
+        entries = self._entries[stripe]
+        while entries:
+            key, (deadline, _) = next(iter(entries.items()))
+            if deadline > now:
+                break
+            del entries[key]
+            self._expired[stripe] += 1
+
+    def put(self, key, value):
+        stripe = self._stripe(key)
+        now = time.monotonic()
+        with self._locks[stripe]:
+            entries = self._entries[stripe]
+            self._purge(stripe, now)
+            entries.pop(key, None)
+            while entries and len(entries) >= self._stripe_size:
+                entries.popitem(last=False)
+                self._evicted[stripe] += 1
+            entries[key] = (now + self.ttl, value)
+
+    def pop(self, key, default=None):
+        """ Removes and returns the session, or default if it is unknown or expired """
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            entry = self._entries[stripe].pop(key, None)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                self._expired[stripe] += 1
+                return default
+            return entry[1]
+
+    def get(self, key, default=None):
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            entry = self._entries[stripe].get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return default
+            return entry[1]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries)
+
+    def purge(self):
+        """ Drops every expired session """
+        now = time.monotonic()
+        for stripe, lock in enumerate(self._locks):
+            with lock:
+                self._purge(stripe, now)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "expired": sum(self._expired),
+            "evicted": sum(self._evicted),
+        }
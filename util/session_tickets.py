@@ -0,0 +1,95 @@
+import base64
+import binascii
+import json
+import struct
+import time
+from Crypto import Random
+from Crypto.Cipher import AES
+from util import config
+
+# Stateless sessions: the session state is sealed into an encrypted,
+# authenticated, expiring ticket (AES-256-GCM) handed to the client as its
+# session id. Any process holding the ticket key can open it, so no server
+# memory is used and no sticky routing is needed while the client works.
+#
+#   ticket = base64url(version | expiry | nonce | ciphertext | tag)
+#
+# version and expiry are authenticated along with a purpose string, so a
+# ticket issued for one protocol step cannot be presented to another.
+# Tickets are not single-use by themselves. A caller that must not accept a
+# ticket twice passes a store of used nonces to open_ticket, and that store
+# has to be shared by every process opening the tickets.
+
+TICKET_VERSION = 1
+_header = struct.Struct(">BQ")
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+
+_ticket_key = None
+
+
+class InvalidTicket(ValueError):
+    """ To be raised when a session ticket is malformed, forged or expired. """
+    pass
+
+
+def get_ticket_key() -> bytes:
+    """
+    The 32-byte key from DIGICASH_TICKET_KEY (hex). Every process that must
+    open the same tickets needs the same key; without one a random key is
+    used, which only works for a single process.
+    """
+    global _ticket_key
+    if _ticket_key is None:
+        value = config.get_str("DIGICASH_TICKET_KEY")
+        if value:
+            key = bytes.fromhex(value)
+            if len(key) != 32:
+                raise ValueError("DIGICASH_TICKET_KEY must be 32 bytes of hex, found %d bytes" % len(key))
+            _ticket_key = key
+        else:
+            print("DIGICASH_TICKET_KEY is not set, session tickets will only be valid in this process")
+            _ticket_key = Random.get_random_bytes(32)
+    return _ticket_key
+
+
+def seal(payload, purpose: str, ttl: float, key: bytes = None) -> str:
+    key = key or get_ticket_key()
+    header = _header.pack(TICKET_VERSION, int(time.time() + ttl))
+    nonce = Random.get_random_bytes(_NONCE_SIZE)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header + purpose.encode("utf-8"))
+    ciphertext, tag = cipher.encrypt_and_digest(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return base64.urlsafe_b64encode(header + nonce + ciphertext + tag).rstrip(b"=").decode("ascii")
+
+
+def open_ticket(ticket: str, purpose: str, key: bytes = None, used_tickets=None):
+    """
+    Returns the payload of a ticket. used_tickets is an optional store whose
+    use_ticket(nonce, expires) records the nonce and returns False when it
+    was already recorded; such a replayed ticket is rejected.
+    """
+    key = key or get_ticket_key()
+    try:
+        raw = base64.urlsafe_b64decode(ticket + "=" * (-len(ticket) % 4))
+    except (TypeError, ValueError, binascii.Error):
+        raise InvalidTicket("Session ticket is not valid base64")
+    if len(raw) < _header.size + _NONCE_SIZE + _TAG_SIZE:
+        raise InvalidTicket("Session ticket is too short")
+    header = raw[:_header.size]
+    version, expires = _header.unpack(header)
+    if version != TICKET_VERSION:
+        raise InvalidTicket("Unknown session ticket version %d" % version)
+    nonce = raw[_header.size:_header.size + _NONCE_SIZE]
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header + purpose.encode("utf-8"))
+    try:
+        payload = cipher.decrypt_and_verify(raw[_header.size + _NONCE_SIZE:-_TAG_SIZE], raw[-_TAG_SIZE:])
+    except ValueError:
+        raise InvalidTicket("Session ticket failed authentication")
+    # checked after authentication, so the expiry cannot have been tampered with
+    if expires < time.time():
+        raise InvalidTicket("Session ticket has expired")
+    if used_tickets is not None and not used_tickets.use_ticket(nonce, expires):
+        raise InvalidTicket("Session ticket has already been used")
+    return json.loads(payload)
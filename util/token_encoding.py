@@ -0,0 +1,96 @@
+import hashlib
+import json
+import re
+import struct
+import uuid
+from util import config
+from util.custom_exceptions import BadTokenFormat, ChecksumConflict
+
+# Canonical binary encoding of the "token" object, shared by client, merchant
+# and bank. Its SHA-256 is the token checksum, so the checksum no longer
+# depends on JSON key order, whitespace or float formatting.
+#
+#   version      1 byte
+#   amount       8 bytes, IEEE-754 double, big-endian
+#   uuid         16 bytes
+#   created      2-byte length + UTF-8 ISO-8601 datetime, as sent
+#   identities   2-byte count, then for each identity:
+#                  2 x (2-byte length + raw encrypted identity share)
+#                  2 x 32-byte share checksum
+# A token with any other field is refused: the checksum, and so the bank's
+# signature, would not cover it.
+ENCODING_VERSION = 1
+
+_token_fields = frozenset(("amount", "uuid", "created_datetime", "identities"))
+_identity_fields = frozenset(("identity", "checksum"))
+
+_header = struct.Struct(">Bd16sH")
+_length = struct.Struct(">H")
+
+# accept checksums computed over json.dumps(token) by older clients
+ACCEPT_LEGACY_CHECKSUMS = config.get_bool("DIGICASH_ACCEPT_LEGACY_CHECKSUMS", False)
+
+_hex_string = re.compile(r"(?:[0-9a-f]{2})*")
+
+
+def parse_uuid(value: str) -> bytes:
+    """
+    The 16 bytes of a uuid given in its canonical form (lowercase, hyphenated,
+    no braces or urn prefix). The checksum only covers these bytes, so any
+    other spelling of the same uuid would carry a valid signature while
+    looking like a different token to the ledger.
+    """
+    parsed = uuid.UUID(value)
+    if str(parsed) != value:
+        raise ValueError("uuid is not in canonical form: %s" % value)
+    return parsed.bytes
+
+
+def parse_hex(value: str) -> bytes:
+    """ The bytes of a lowercase hex string without whitespace """
+    if not _hex_string.fullmatch(value):
+        raise ValueError("expected lowercase hex without whitespace")
+    return bytes.fromhex(value)
+
+
+def _check_fields(item: dict, fields: frozenset, name: str):
+    extra = set(item) - fields
+    if extra:
+        raise ValueError("%s has fields the checksum does not cover: %s" % (name, ", ".join(sorted(map(str, extra)))))
+
+
+def encode_token(token: dict) -> bytes:
+    try:
+        _check_fields(token, _token_fields, "token")
+        created = token["created_datetime"].encode("utf-8")
+        identities = token["identities"]
+        output = bytearray(_header.pack(
+            ENCODING_VERSION, float(token["amount"]), parse_uuid(token["uuid"]), len(created)))
+        output += created
+        output += _length.pack(len(identities))
+        for identity in identities:
+            _check_fields(identity, _identity_fields, "identity")
+            for share in identity["identity"]:
+                share = parse_hex(share)
+                output += _length.pack(len(share))
+                output += share
+            for checksum in identity["checksum"]:
+                checksum = parse_hex(checksum)
+                if len(checksum) != 32:
+                    raise ValueError("identity checksums must be 32 bytes")
+                output += checksum
+    except (KeyError, TypeError, ValueError, AttributeError, struct.error) as e:
+        raise BadTokenFormat("Token cannot be encoded: %s" % str(e))
+    return bytes(output)
+
+
+def token_checksum(token: dict) -> bytes:
+    return hashlib.sha256(encode_token(token)).digest()
+
+
+def validate_token_checksum(token: dict, checksum: bytes):
+    if token_checksum(token) == checksum:
+        return True
+    if ACCEPT_LEGACY_CHECKSUMS and hashlib.sha256(json.dumps(token).encode("utf-8")).digest() == checksum:
+        return True
+    raise ChecksumConflict()
@@ -1,10 +1,12 @@
-import sys, os, datetime, json, uuid
+import sys, os, datetime, json
 
 _token_format = None
+_token_validator = None
 _current_dir = os.path.dirname(os.path.realpath(__file__))
 sys.argv.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
 from util.custom_exceptions import BadTokenFormat, TokenFormatMalformed
+from util.token_encoding import parse_hex, parse_uuid
 
 def _bitstring_decode(value:str):
   output = list()
@@ -15,6 +17,23 @@ def _bitstring_decode(value:str):
       raise ValueError("Expected 0 or 1, found %s" % char)
   return tuple(output)
 
+_expected_types = {
+  "str" : (str,),
+  "list" : (list, tuple),
+  "dict" : (dict,),
+  "float" : (float,),
+  "int": (int,),
+  "number": (int, float),
+}
+
+_string_formats = {
+  "uuid" : parse_uuid,
+  "datetime" : datetime.datetime.fromisoformat,
+  "date" : datetime.date.fromisoformat,
+  "bitstring" : _bitstring_decode,
+  "hex" : parse_hex,
+}
+
 def get_token_format():
   global _token_format
   if _token_format is None:
@@ -22,101 +41,134 @@ def get_token_format():
       _token_format = json.load(tf_file)
   return _token_format
 
+def _join(parent:str, key:str):
+  return (parent + "." + key) if parent else key
+
+def _compile_type_check(type_name:str, path:str):
+  """ Returns check(item, path) that only tests the type of item """
+  _types = _expected_types.get(type_name)
+  if _types is None:
+    raise TokenFormatMalformed("Unknown type for %s: %s" % (path, str(type_name)))
+  # bool is an int subclass, but never a valid number in a token
+  _exclude_bool = bool not in _types and int in _types
+
+  def check(item, path):
+    if not isinstance(item, _types) or (_exclude_bool and isinstance(item, bool)):
+      raise BadTokenFormat("Token has incorrect value for %s : %s; expected type %s" % (path, item.__class__.__name__, type_name))
+  return check
+
+def _compile_length_check(expected_format:dict, path:str):
+  _expected_length = expected_format.get("length")
+  if _expected_length is None:
+    return None
+  if not isinstance(_expected_length, int):
+    raise TokenFormatMalformed("(optional) Expected integer length for %s; found %s" % (path, str(_expected_length)))
+
+  def check(item, path):
+    if len(item) != _expected_length:
+      raise BadTokenFormat("Expected %s to have length %d; found length %d" % (path, _expected_length, len(item)))
+  return check
+
+def _compile_spec(expected_format, path:str):
+  """
+  Compiles the format of one value into check(item, path), raising
+  TokenFormatMalformed now for problems in the format itself.
+  """
+  if isinstance(expected_format, str):
+    return _compile_type_check(expected_format, path)
+  if not isinstance(expected_format, dict):
+    raise TokenFormatMalformed("Unexpected format for %s" % path)
+  type_name = expected_format.get("type")
+  if type_name is None:
+    raise TokenFormatMalformed("Expected type for %s, found None" % path)
+
+  if type_name == "enum":
+    _options = expected_format.get("options")
+    if not isinstance(_options, list):
+      raise TokenFormatMalformed("Enum options not defined for %s" % path)
+
+    def check_enum(item, path):
+      if item not in _options:
+        raise BadTokenFormat("Token has incorrect value for %s : %s; expected one of %s" % (path, item, _options))
+    return check_enum
+
+  checks = [_compile_type_check(type_name, path)]
+  _length_check = _compile_length_check(expected_format, path)
+  if _length_check is not None:
+    checks.append(_length_check)
+
+  if type_name == "str":
+    _expected_str_format = expected_format.get("format")
+    if _expected_str_format is not None:
+      _parser = _string_formats.get(_expected_str_format)
+      if _parser is None:
+        raise TokenFormatMalformed("Unknown string format for %s: %s" % (path, _expected_str_format))
+
+      def check_str_format(item, path):
+        try:
+          _parser(item)
+        except Exception:
+          raise BadTokenFormat("Expected %s to have format %s, found %s" % (path, _expected_str_format, item))
+      checks.append(check_str_format)
+
+  elif type_name == "dict":
+    _expected_properties = expected_format.get("properties")
+    if _expected_properties is None:
+      raise TokenFormatMalformed("Expected dict properties for %s" % path)
+    checks.append(_compile_properties(_expected_properties, path))
+
+  elif type_name == "list":
+    _expected_item_format = expected_format.get("format")
+    if _expected_item_format is not None:
+      _item_check = _compile_spec(_expected_item_format, path + "[]")
+
+      def check_items(item, path):
+        for index, i in enumerate(item):
+          _item_check(i, "%s[%d]" % (path, index))
+      checks.append(check_items)
+
+  if len(checks) == 1:
+    return checks[0]
+  checks = tuple(checks)
+
+  def check(item, path):
+    for _check in checks:
+      _check(item, path)
+  return check
+
+def _compile_properties(properties:dict, parent:str=""):
+  """ Compiles a {field: format} mapping into check(item, path) for a dict """
+  if not isinstance(properties, dict):
+    raise TokenFormatMalformed("Expected dict properties for %s" % (parent or "token"))
+  fields = tuple((key, _compile_spec(value, _join(parent, key))) for key, value in properties.items())
+
+  def check(item, path):
+    for key, _check in fields:
+      value = item.get(key)
+      if value is None:
+        raise BadTokenFormat("Expected value for %s, found None" % _join(path, key))
+      _check(value, _join(path, key))
+  return check
+
+def compile_format(token_format:dict):
+  """
+  Compiles a token format (see token_format.json) into validate(token).
+  The format is interpreted once here; validate only runs the checks.
+  """
+  _check = _compile_properties(token_format)
+
+  def validate(token):
+    if not isinstance(token, dict):
+      raise BadTokenFormat("Token has incorrect value : %s; expected type dict" % token.__class__.__name__)
+    _check(token, "")
+    return True
+  return validate
+
+def get_token_validator():
+  global _token_validator
+  if _token_validator is None:
+    _token_validator = compile_format(get_token_format())
+  return _token_validator
+
 def verify_format(token:dict):
-  token_format = get_token_format()
-  
-  def _check_format(_format, token, parent = ""):
-    _expected_types = {
-      "str" : str,
-      "list" : list,
-      "dict" : dict,
-      "float" : float,
-      "int": int,
-    }
-
-    _string_formats = {
-      "uuid" : uuid.UUID,
-      "datetime" : datetime.datetime.fromisoformat,
-      "date" : datetime.date.fromisoformat,
-      "bitstring" : _bitstring_decode,
-      "hex" : bytes.fromhex,
-    }
-
-    def _check_format_str(item, key:str, expected_type:str):
-      fullPath = (parent + "." + key) if parent else key
-      _type = _expected_types.get(expected_type)
-      if _type is None:
-        raise TokenFormatMalformed("Unknown type for %s: %s" % (fullPath, str(item)))
-      if isinstance(item, _type):
-        return True
-      else:
-        raise BadTokenFormat("Token has incorrect value for %s : %s; expected type %s"%(fullPath, item, expected_type))
-    
-    def _check_format_dict(item, key:str, expected_format:dict, parent:str=""):
-      fullPath = (parent + "." + key) if parent else key
-      if(expected_format.get("type") is None):
-        raise BadTokenFormat("Expected type for %s, found None" % fullPath)
-      _type = _expected_types.get(expected_format["type"])
-      if _type is None:
-        if expected_format["type"] == "enum":
-          if not isinstance(expected_format.get("options"), list):
-            raise TokenFormatMalformed("Enum options not defined for %s"% fullPath)
-        raise BadTokenFormat("Unknown type for %s: %s" % (fullPath, str(item)))
-      if not isinstance(item, _type):
-        raise BadTokenFormat("Token has incorrect value for %s : %s; expected type %s"%(fullPath, item.__class__.__name__, expected_format["type"]))
-      
-      if _type is str:
-        _expected_length = expected_format.get("length")
-        if _expected_length is not None:
-          if isinstance(_expected_length, int):
-            if(_expected_length != len(item)):
-              raise BadTokenFormat
-          else:
-            raise TokenFormatMalformed("(optional) Expected integer length for %s; found %s" % (fullPath, str(_expected_length)))
-        _expected_str_format = expected_format.get("format")
-        if _expected_str_format is not None:
-          _parser = _string_formats.get(_expected_str_format)
-          try:
-            _tmp = _parser(item)
-          except:
-            raise BadTokenFormat("(optional) Expected format %s, found %s" % (_expected_str_format, item))
-      
-      if _type is dict:
-        _expected_properties = expected_format.get("properties")
-        if _expected_properties is None:
-          raise TokenFormatMalformed("Expected dict properties for %s" % fullPath)
-        else:
-          _check_format(_expected_properties, item, parent=fullPath)
-      if _type is list:
-        _expected_length = expected_format.get("length")
-        if _expected_length is not None:
-          if isinstance(_expected_length, int):
-            if(_expected_length != len(item)):
-              raise BadTokenFormat("Expected %s to have length %d; found length %d" % (fullPath, _expected_length, len(item)))
-          else:
-            raise TokenFormatMalformed("(optional) Expected integer length for %s; found %s" % (key, str(_expected_length)))
-        _expected_item_format = expected_format.get("format")
-        if _expected_item_format is not None:
-          for index, i in enumerate(item):
-            if isinstance(_expected_item_format, str):
-              _check_format_str(i, fullPath + "[%d]"%index, _expected_item_format)
-            elif isinstance(_expected_item_format, dict):
-              _check_format_dict(i, _expected_item_format, index, parent=fullPath + "[%d]"%index)
-            else:
-              raise TokenFormatMalformed("Unexpected format for %s"%fullPath)
-
-      for key, value in _format.items():
-        if isinstance(value, dict):
-          if token.get(key) is None:
-            raise BadTokenFormat("Expected value for %s, found None" % key)
-          _check_format_dict(token[key], key, value, parent=parent)
-        elif isinstance(value, str):
-          print(token, _format)
-          if token.get(key) is None:
-            raise BadTokenFormat("Expected value for %s, found None" % key)
-          _check_format_str(token[key], key, value)
-        else:
-          raise TokenFormatMalformed("Unexpected value in token format")
-  
-  _check_format(token_format, token)
-  return True
\ No newline at end of file
+  return get_token_validator()(token)
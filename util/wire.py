@@ -0,0 +1,312 @@
+import gzip
+import json
+import struct
+import zlib
+from util import config, http_client
+
+# Compact binary encoding of the protocol documents, negotiated per request
+# next to JSON. The documents keep their JSON shape; the binary encoding
+# stores every lowercase hex string (checksums, signatures, encrypted
+# identity shares, keys) as its raw bytes, half the size, and gives it back
+# as the same hex string when decoded, so handlers see identical documents.
+#
+#   document = MAGIC value
+#   value    = "N" | "T" | "F"                    null, true, false
+#            | "I" varint(zigzag(int))           integer of any size
+#            | "D" float64                       big-endian double
+#            | "S" varint(length) utf-8          string
+#            | "H" varint(length) bytes          lowercase hex string, as bytes
+#            | "L" varint(count) value*          list
+#            | "M" varint(count) (value value)*  object: string key, value
+#
+# Requests say what they send with Content-Type, and ask for binary
+# responses with Accept. Either side may gzip a body (Content-Encoding).
+
+BINARY_TYPE = "application/vnd.digicash+binary"
+JSON_TYPE = "application/json"
+MAGIC = b"\xdc\x01"
+
+# what the client sends: "json" or "binary"
+WIRE_FORMAT = config.get_str("DIGICASH_WIRE_FORMAT", "json")
+# gzip request and response bodies of at least COMPRESS_MIN_SIZE bytes
+COMPRESS = config.get_bool("DIGICASH_WIRE_COMPRESS", False)
+COMPRESS_MIN_SIZE = config.get_int("DIGICASH_WIRE_COMPRESS_MIN_SIZE", 1024)
+COMPRESS_LEVEL = config.get_int("DIGICASH_WIRE_COMPRESS_LEVEL", 6)
+# largest body accepted once decompressed, in bytes
+MAX_BODY_SIZE = config.get_int("DIGICASH_WIRE_MAX_BODY", 16 * 1024 * 1024)
+# deepest nesting of lists and objects accepted
+MAX_DEPTH = 32
+# largest integer accepted, in bits; an RSA modulus fits
+MAX_INT_BITS = 4096
+# longest varints accepted: lengths and counts, and zigzag integers
+_MAX_LENGTH_BYTES = 10
+_MAX_INT_BYTES = (MAX_INT_BITS + 1 + 6) // 7
+
+
+
+class WireFormatError(ValueError):
+    """ To be raised when a request or response body cannot be decoded. """
+    pass
+
+
+def _hex_bytes(value: str):
+    """ The bytes of a non-empty lowercase hex string, else None """
+    if not value or len(value) & 1:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    # fromhex also takes upper case and spaces, which would not survive the round trip
+    return raw if len(raw) * 2 == len(value) and raw.hex() == value else None
+
+
+def _varint(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode(value, out: bytearray, depth: int):
+    if isinstance(value, str):
+        raw = _hex_bytes(value)
+        if raw is not None:
+            out += b"H"
+            out += _varint(len(raw))
+            out += raw
+        else:
+            data = value.encode("utf-8")
+            out += b"S"
+            out += _varint(len(data))
+            out += data
+    elif value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        if value.bit_length() > MAX_INT_BITS:
+            raise WireFormatError("Integers are limited to %d bits" % MAX_INT_BITS)
+        out += b"I"
+        out += _varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+    elif isinstance(value, float):
+        out += b"D"
+        out += struct.pack(">d", value)
+    elif isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            raise WireFormatError("Document is nested deeper than %d levels" % MAX_DEPTH)
+        out += b"M"
+        out += _varint(len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise WireFormatError("Object keys must be strings, found %s" % key.__class__.__name__)
+            _encode(key, out, depth + 1)
+            _encode(item, out, depth + 1)
+    elif isinstance(value, (list, tuple)):
+        if depth >= MAX_DEPTH:
+            raise WireFormatError("Document is nested deeper than %d levels" % MAX_DEPTH)
+        out += b"L"
+        out += _varint(len(value))
+        for item in value:
+            _encode(item, out, depth + 1)
+    else:
+        raise WireFormatError("Cannot encode a value of type %s" % value.__class__.__name__)
+
+
+def encode(document) -> bytes:
+    out = bytearray(MAGIC)
+    _encode(document, out, 0)
+    return bytes(out)
+
+
+def _decoder(data: bytes):
+    """ Returns value(pos, depth) -> (value, next pos) reading data; IndexError when data runs out """
+    end = len(data)
+
+    def varint(pos: int, max_bytes: int = _MAX_LENGTH_BYTES) -> tuple:
+        # bounded, so a long run of continuation bytes cannot cost quadratic time
+        value, shift, stop = 0, 0, pos + max_bytes
+        while pos < stop:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value, pos
+            shift += 7
+        raise WireFormatError("Varint is longer than %d bytes" % max_bytes)
+
+    def chunk(pos: int) -> tuple:
+        length = data[pos]
+        if length < 0x80:
+            pos += 1
+        else:
+            length, pos = varint(pos)
+        stop = pos + length
+        if stop > end:
+            raise IndexError()
+        return data[pos:stop], stop
+
+    def value(pos: int, depth: int) -> tuple:
+        tag = data[pos]
+        pos += 1
+        if tag == 0x48:  # H
+            raw, pos = chunk(pos)
+            return raw.hex(), pos
+        if tag == 0x53:  # S
+            raw, pos = chunk(pos)
+            try:
+                return raw.decode("utf-8"), pos
+            except UnicodeDecodeError as e:
+                raise WireFormatError("Invalid UTF-8 in a string: %s" % str(e))
+        if tag == 0x4d or tag == 0x4c:  # M, L
+            if depth >= MAX_DEPTH:
+                raise WireFormatError("Document is nested deeper than %d levels" % MAX_DEPTH)
+            count, pos = varint(pos)
+            # every entry takes at least one byte
+            if count > end - pos:
+                raise WireFormatError("Document is shorter than its item count")
+            depth += 1
+            if tag == 0x4c:
+                items = []
+                for _ in range(count):
+                    item, pos = value(pos, depth)
+                    items.append(item)
+                return items, pos
+            document = dict()
+            for _ in range(count):
+                key, pos = value(pos, depth)
+                if key.__class__ is not str:
+                    raise WireFormatError("Object keys must be strings")
+                document[key], pos = value(pos, depth)
+            return document, pos
+        if tag == 0x49:  # I
+            number, pos = varint(pos, _MAX_INT_BYTES)
+            if number.bit_length() > MAX_INT_BITS + 1:
+                raise WireFormatError("Integers are limited to %d bits" % MAX_INT_BITS)
+            return (number >> 1 if not number & 1 else -((number + 1) >> 1)), pos
+        if tag == 0x44:  # D
+            if pos + 8 > end:
+                raise IndexError()
+            return struct.unpack_from(">d", data, pos)[0], pos + 8
+        if tag == 0x4e:  # N
+            return None, pos
+        if tag == 0x54:  # T
+            return True, pos
+        if tag == 0x46:  # F
+            return False, pos
+        raise WireFormatError("Unknown value tag %r" % bytes([tag]))
+
+    return value
+
+
+def decode(data: bytes):
+    if not data.startswith(MAGIC):
+        raise WireFormatError("Not a binary protocol document")
+    try:
+        document, pos = _decoder(data)(len(MAGIC), 0)
+    except IndexError:
+        raise WireFormatError("Document ends inside a value")
+    if pos != len(data):
+        raise WireFormatError("Trailing bytes after the document")
+    return document
+
+
+def _mimetype(content_type: str) -> str:
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def _decompress(body: bytes, content_encoding: str) -> bytes:
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding not in ("gzip", "x-gzip"):
+        raise WireFormatError("Unsupported Content-Encoding %s" % content_encoding)
+    decompressor = zlib.decompressobj(wbits=31)
+    try:
+        data = decompressor.decompress(body, MAX_BODY_SIZE)
+    except zlib.error as e:
+        raise WireFormatError("Invalid gzip body: %s" % str(e))
+    if decompressor.unconsumed_tail:
+        raise WireFormatError("Body is larger than %d bytes once decompressed" % MAX_BODY_SIZE)
+    return data
+
+
+def parse_body(body: bytes, content_type: str, content_encoding: str = None):
+    """
+    Returns the document in a request or response body, or None when it is
+    neither JSON nor the binary format. Raises WireFormatError when it is
+    malformed.
+    """
+    mimetype = _mimetype(content_type)
+    is_json = mimetype == JSON_TYPE or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+    if not is_json and mimetype != BINARY_TYPE:
+        return None
+    body = _decompress(body, content_encoding)
+    if mimetype == BINARY_TYPE:
+        return decode(body)
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise WireFormatError("Failed to decode JSON object: %s" % str(e))
+
+
+def _accepts(header: str, value: str) -> bool:
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() == value and "q=0" not in params.replace(" ", "").split(";"):
+            return True
+    return False
+
+
+def render(document, accept: str = None, accept_encoding: str = None) -> tuple:
+    """
+    Encodes a response document as the client asked: binary when Accept
+    names the binary type, JSON otherwise, gzipped when compression is on
+    and the client accepts it. Returns (body, headers).
+    """
+    if _accepts(accept, BINARY_TYPE):
+        body, content_type = encode(document), BINARY_TYPE
+    else:
+        body, content_type = json.dumps(document).encode("utf-8"), JSON_TYPE
+    headers = {"Content-Type": content_type, "Vary": "Accept, Accept-Encoding"}
+    if COMPRESS and len(body) >= COMPRESS_MIN_SIZE and _accepts(accept_encoding, "gzip"):
+        body = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def post(url: str, document, wire_format: str = None):
+    """ POSTs a document in WIRE_FORMAT; read the response with read_response """
+    wire_format = wire_format or WIRE_FORMAT
+    if wire_format == "binary":
+        body, headers = encode(document), {"Content-Type": BINARY_TYPE, "Accept": BINARY_TYPE + ", " + JSON_TYPE}
+    else:
+        body, headers = json.dumps(document).encode("utf-8"), {"Content-Type": JSON_TYPE}
+    if COMPRESS and len(body) >= COMPRESS_MIN_SIZE:
+        body = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return http_client.post(url, data=body, headers=headers)
+
+
+def read_response(response):
+    """ The document in a response, JSON or binary """
+    if _mimetype(response.headers.get("Content-Type")) == BINARY_TYPE:
+        # requests has already undone any Content-Encoding
+        return decode(response.content)
+    return response.json()
+
+
+def response_text(response) -> str:
+    """ The response body for logs and error messages, binary documents shown as JSON """
+    if _mimetype(response.headers.get("Content-Type")) == BINARY_TYPE:
+        try:
+            return json.dumps(decode(response.content))
+        except WireFormatError as e:
+            return "<%s>" % str(e)
+    return response.text